@@ -1,5 +1,6 @@
 import pandas as pd
-from numpy import mean
+import numpy as np
+from multiprocessing import Pool
 
 class Batters(object):
     def __init__(self, df, minPA=None):
@@ -9,6 +10,8 @@ class Batters(object):
         else:
             self.batterIds = pd.unique(self.df['batterId'])
         self.df = df[df['batterId'].isin(self.batterIds)]
+        self.tables = None
+        self.samples = {}
 
     def min_pa(self, df, minPA):
         df_group = (df[df['paResult'].isnull() == False].groupby('batterId')
@@ -75,51 +78,257 @@ class Batters(object):
         df['net_total'] = df['dSwing'].fillna(df['dTake'])
         return df.groupby('batter')['net_total']
 
-    def create_full_dataframe(self):
-        """ Returns data frame of the cumulative sum of all metrics
-        """
-        objs = [self.get_swing_value_added().agg(sum),
-                self.get_swing_value_lost().agg(sum),
-                self.get_take_value_added().agg(sum),
-                self.get_take_value_lost().agg(sum),
-                self.get_swing_value_total().agg(sum),
-                self.get_take_value_total().agg(sum),
-                self.get_value_net_total().agg(sum)]
-        keys = ['dSwing|Swing', 'dSwing|Take', 'dTake|Take', 'dTake|Swing',
-                'dSwing', 'dTake', 'NetTotal']
-        df = pd.concat(objs, keys=keys, axis=1).round(2)
-        return df
+    # Metrics computed by aggregate, in table column order. Each pitch is
+    # classified once into one of the first four, then adds to its side's
+    # total (4 or 5) and to NetTotal (6).
+    metrics = ['dSwing|Swing', 'dSwing|Take', 'dTake|Take', 'dTake|Swing',
+               'dSwing', 'dTake', 'NetTotal']
+
+    def classify(self):
+        """ Returns an integer code for each pitch: 0 swung when it should
+            have, 1 swung when it should not have, 2 took when it should have,
+            3 took when it should not have, -1 neither swung nor took.
+        """
+        swing = (self.df['swing'] == True).values
+        take = (self.df['take'] == True).values
+        shouldSwing = (self.df['shouldSwing'] == True).values
+        shouldTake = (self.df['shouldTake'] == True).values
+        codes = np.full(len(self.df), -1, dtype=int)
+        codes[take & ~shouldTake] = 3
+        codes[take & shouldTake] = 2
+        codes[swing & ~shouldSwing] = 1
+        codes[swing & shouldSwing] = 0
+        return codes
+
+    def reduce(self, groups=None, nGroups=1):
+        """ Single grouped reduction over the pitches. groups optionally
+            assigns each pitch an integer split code below nGroups (-1 to
+            drop it). Returns the sorted batter names and the sums, lengths
+            and non-null counts of every metric, each shaped
+            (nGroups, batters, metrics).
+        """
+        codes = self.classify()
+        batters, names = pd.factorize(self.df['batter'], sort=True)
+        if groups is None:
+            groups = np.zeros(len(codes), dtype=int)
+        values = np.where(codes < 2, self.df['dSwing'].values,
+                          self.df['dTake'].values)
+        rows = np.flatnonzero((codes >= 0) & (batters >= 0) & (groups >= 0))
+        codes, values = codes[rows], values[rows]
+        cells = groups[rows] * len(names) + batters[rows]
+        nMetrics = len(self.metrics)
+        # Each pitch counts towards its own metric, its side's total and
+        # NetTotal. Rows are kept in order so sums match groupby sums.
+        metric = np.concatenate([codes, 4 + codes // 2,
+                                 np.full(len(codes), 6, dtype=int)])
+        keys = np.tile(cells, 3) * nMetrics + metric
+        values = np.tile(values, 3)
+        present = ~np.isnan(values)
+        size = nGroups * len(names) * nMetrics
+        shape = (nGroups, len(names), nMetrics)
+        sums = np.bincount(keys, weights=np.where(present, values, 0),
+                           minlength=size).reshape(shape)
+        lens = np.bincount(keys, minlength=size).reshape(shape)
+        counts = np.bincount(keys, weights=present,
+                             minlength=size).reshape(shape)
+        return np.asarray(names), sums, lens, counts
+
+    def build_tables(self, names, sums, lens, counts):
+        """ Full, count and mean tables from one group of reduce results
+        """
+        seen = lens.sum(axis=1) > 0
+        index = pd.Index(names[seen], name='batter')
+        sums = np.where(lens > 0, sums, np.nan)[seen]
+        lens, counts = lens[seen], counts[seen]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            means = np.where(counts > 0, sums / counts, np.nan)
+        full = pd.DataFrame(sums, index=index, columns=self.metrics).round(2)
+        count = pd.DataFrame(lens, index=index,
+                             columns=[x + '_count' for x in self.metrics])
+        mean_df = pd.DataFrame(means * 100, index=index,
+                               columns=[x + '_mean' for x in self.metrics])
+        return full, count, mean_df.round(4)
+
+    def aggregate(self):
+        """ Compute the full, count and mean tables in a single grouped
+            reduction over the pitches. The tables are cached.
+        """
+        if self.tables is None:
+            names, sums, lens, counts = self.reduce()
+            self.tables = self.build_tables(names, sums[0], lens[0],
+                                            counts[0])
+        return self.tables
+
+    def aggregate_split(self, labels):
+        """ Full, count and mean tables for every value of labels, a Series
+            aligned with self.df such as self.df['pitcherHand'], from a
+            single reduction. Returns {value: (full, count, mean)}.
+        """
+        groups, values = pd.factorize(labels, sort=True)
+        names, sums, lens, counts = self.reduce(groups, len(values))
+        tables = {}
+        for num, value in enumerate(values):
+            if lens[num].any():
+                tables[value] = self.build_tables(names, sums[num], lens[num],
+                                                  counts[num])
+        return tables
+
+    def bootstrap_data(self):
+        """ Arrays the bootstrap resamples from: the classified pitches
+            ordered by batter with their codes, values and whether the value
+            is present, and each batter's first pitch and number of pitches.
+        """
+        codes = self.classify()
+        batters, names = pd.factorize(self.df['batter'], sort=True)
+        values = np.where(codes < 2, self.df['dSwing'].values,
+                          self.df['dTake'].values)
+        rows = np.flatnonzero((codes >= 0) & (batters >= 0))
+        rows = rows[np.argsort(batters[rows], kind='mergesort')]
+        pitchBatters = batters[rows]
+        present = ~np.isnan(values[rows])
+        # Renumber batters to those with classified pitches, as the tables
+        seen, pitchBatters = np.unique(pitchBatters, return_inverse=True)
+        lens = np.bincount(pitchBatters, minlength=len(seen))
+        starts = np.concatenate([[0], np.cumsum(lens)[:-1]])
+        return {'batters': pitchBatters, 'codes': codes[rows],
+                'values': np.where(present, values[rows], 0),
+                'present': present.astype(float), 'starts': starts,
+                'lens': lens, 'names': np.asarray(names)[seen]}
+
+    def bootstrap(self, resamples=1000, seed=0, processes=None,
+                  blockDraws=2 ** 20):
+        """ Resample each batter's classified pitches with replacement
+            resamples times. Each block of resamples is drawn and reduced
+            with weighted bincounts, using about blockDraws pitches at a
+            time, optionally across processes. Returns the batter names and
+            the sums and means per 100 pitches of every metric, each shaped
+            (resamples, batters, metrics). The result is cached.
+        """
+        key = (resamples, seed)
+        if key in self.samples:
+            return self.samples[key]
+        data = self.bootstrap_data()
+        n = max(len(data['codes']), 1)
+        size = max(1, min(resamples, blockDraws // n))
+        tasks = [(num, min(size, resamples - start), seed)
+                 for num, start in enumerate(range(0, resamples, size))]
+        if processes:
+            pool = Pool(processes, initializer=set_bootstrap_data,
+                        initargs=(data,))
+            try:
+                blocks = pool.map(bootstrap_block, tasks)
+            finally:
+                pool.close()
+                pool.join()
+        else:
+            set_bootstrap_data(data)
+            try:
+                blocks = [bootstrap_block(task) for task in tasks]
+            finally:
+                set_bootstrap_data(None)
+        sums = np.concatenate([x[0] for x in blocks])
+        counts = np.concatenate([x[1] for x in blocks])
+        with np.errstate(divide='ignore', invalid='ignore'):
+            means = np.where(counts > 0, sums / counts, np.nan) * 100
+        self.samples[key] = (data['names'], sums, means)
+        return self.samples[key]
+
+    def intervals(self, level=0.95, resamples=1000, seed=0, processes=None):
+        """ Bootstrap percentile intervals of the full and mean tables.
+            Returns two DataFrames with <column>_low and <column>_high for
+            every column of the full and mean tables.
+        """
+        names, sums, means = self.bootstrap(resamples, seed, processes)
+        tail = (1 - level) / 2 * 100
+        frames = []
+        for samples, suffix, digits in [(sums, '', 2), (means, '_mean', 4)]:
+            with np.errstate(invalid='ignore'):
+                low, high = np.nanpercentile(samples, [tail, 100 - tail],
+                                             axis=0)
+            columns = {}
+            for num, metric in enumerate(self.metrics):
+                columns[metric + suffix + '_low'] = low[:, num]
+                columns[metric + suffix + '_high'] = high[:, num]
+            frames.append(pd.DataFrame(columns,
+                                       index=pd.Index(names)).round(digits))
+        return tuple(frames)
+
+    def with_intervals(self, df, bounds):
+        """ df with the matching bounds columns following each column.
+            Bounds are blank where the value itself is.
+        """
+        df = df.join(bounds)
+        columns = []
+        for column in df.columns[:-len(bounds.columns)]:
+            columns += [column, column + '_low', column + '_high']
+            for bound in columns[-2:]:
+                df[bound] = df[bound].where(df[column].notnull())
+        return df[columns]
+
+    def create_dataframes(self):
+        """ Returns the full, count and mean data frames together
+        """
+        return tuple(x.copy() for x in self.aggregate())
+
+    def create_full_dataframe(self, ci=None, **kwargs):
+        """ Returns data frame of the cumulative sum of all metrics. With
+            ci, a confidence level such as 0.95, bootstrap interval columns
+            follow each metric; kwargs are passed to intervals.
+        """
+        full = self.aggregate()[0].copy()
+        if ci:
+            full = self.with_intervals(full, self.intervals(ci, **kwargs)[0])
+        return full
 
     def create_count_dataframe(self):
         """ Returns data frame of the cumulative count of all metrics
         """
-        objs = [self.get_swing_value_added().agg(len),
-                self.get_swing_value_lost().agg(len),
-                self.get_take_value_added().agg(len),
-                self.get_take_value_lost().agg(len),
-                self.get_swing_value_total().agg(len),
-                self.get_take_value_total().agg(len),
-                self.get_value_net_total().agg(len)]
-        keys = ['dSwing|Swing_count', 'dSwing|Take_count', 'dTake|Take_count',
-                'dTake|Swing_count', 'dSwing_count', 'dTake_count',
-                'NetTotal_count']
-        df = pd.concat(objs, keys=keys, axis=1).round(2)
-        df.columns = df.columns.droplevel(1)
-        return df
-
-    def create_mean_dataframe(self):
+        return self.aggregate()[1].copy()
+
+    def create_mean_dataframe(self, ci=None, **kwargs):
         """ Returns data frame of the mean of all metrics normalized per 100
-            pitches
-        """
-        objs = [self.get_swing_value_added().agg(mean) * 100,
-                self.get_swing_value_lost().agg(mean) * 100,
-                self.get_take_value_added().agg(mean) * 100,
-                self.get_take_value_lost().agg(mean) * 100,
-                self.get_swing_value_total().agg(mean) * 100,
-                self.get_take_value_total().agg(mean) * 100,
-                self.get_value_net_total().agg(mean) * 100]
-        keys = ['dSwing|Swing_mean', 'dSwing|Take_mean', 'dTake|Take_mean',
-                'dTake|Swing_mean', 'dSwing_mean', 'dTake_mean',
-                'NetTotal_mean']
-        df = pd.concat(objs, keys=keys, axis=1).round(4)
-        return df
\ No newline at end of file
+            pitches, with bootstrap intervals as create_full_dataframe
+        """
+        means = self.aggregate()[2].copy()
+        if ci:
+            means = self.with_intervals(means,
+                                        self.intervals(ci, **kwargs)[1])
+        return means
+
+
+# Resampling data shared with bootstrap worker processes
+bootstrapData = None
+
+
+def set_bootstrap_data(data):
+    global bootstrapData
+    bootstrapData = data
+
+
+def bootstrap_block(task):
+    """ Draw one block of resamples. task is (block number, resamples,
+        seed); each block has its own random stream so results do not depend
+        on the number of processes. Returns the sums and non-null counts of
+        every metric, each shaped (resamples, batters, metrics).
+    """
+    num, resamples, seed = task
+    data = bootstrapData
+    batters, starts, lens = data['batters'], data['starts'], data['lens']
+    nBatters = len(lens)
+    rng = np.random.RandomState([seed, num])
+    draws = rng.random_sample((resamples, len(batters)))
+    draws = starts[batters] + (draws * lens[batters]).astype(int)
+    # Reduce to the four components, then add up the totals
+    cells = ((np.arange(resamples)[:, None] * nBatters + batters) * 4 +
+             data['codes'][draws]).ravel()
+    size = resamples * nBatters * 4
+    shape = (resamples, nBatters, 4)
+    results = []
+    for weights in [data['values'], data['present']]:
+        parts = np.bincount(cells, weights=weights[draws].ravel(),
+                            minlength=size).reshape(shape)
+        results.append(np.concatenate(
+            [parts, parts[:, :, :2].sum(axis=2)[:, :, None],
+             parts[:, :, 2:].sum(axis=2)[:, :, None],
+             parts.sum(axis=2)[:, :, None]], axis=2))
+    return results
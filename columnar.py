@@ -0,0 +1,154 @@
+import csv
+import json
+import os
+import numpy as np
+import pandas as pd
+
+# Columns kept in a columnar processed season and their types
+COLUMNS = [('batter', 'category'), ('batterId', 'int32'),
+           ('gameString', 'category'), ('gameDate', 'category'),
+           ('pitcherHand', 'category'), ('pitchType', 'category'),
+           ('pitchResult', 'category'), ('paResult', 'category'),
+           ('outs', 'int8'), ('balls', 'int8'), ('strikes', 'int8'),
+           ('probCalledStrike', 'float64'), ('runExpPrior', 'float64'),
+           ('runExpSwing', 'float64'), ('runExpTake', 'float64')]
+
+
+class ColumnarWriter(object):
+    """ Writes processed rows as a directory of typed binary columns, one
+        file per column plus meta.json. Categorical columns are stored as
+        int32 codes into sorted categories, empty values as missing.
+        It is used as the output file of Season.process_file: lines written
+        are passed on to out, if given, the first line being the header.
+    """
+    def __init__(self, directory, out=None, columns=None, bufferRows=65536):
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        self.directory = directory
+        self.out = out
+        self.columns = columns or COLUMNS
+        self.bufferRows = bufferRows
+        self.positions = None
+        self.buffers = dict((name, []) for name, dtype in self.columns)
+        self.categories = dict((name, {}) for name, dtype in self.columns
+                               if dtype == 'category')
+        self.files = dict((name, open(self.path(name), 'wb'))
+                          for name, dtype in self.columns)
+        self.rows = 0
+
+    def path(self, name):
+        return os.path.join(self.directory, name + '.bin')
+
+    def write(self, data):
+        if self.out:
+            self.out.write(data)
+        rows = csv.reader(data.splitlines(True))
+        if self.positions is None:
+            header = next(rows)
+            self.positions = [header.index(name) for name, dtype in
+                              self.columns]
+        self.add_rows(rows)
+
+    def writelines(self, lines):
+        self.write(''.join(lines))
+
+    def tell(self):
+        return self.out.tell()
+
+    def add_rows(self, rows):
+        columns = [(self.buffers[name], pos, dtype, self.categories.get(name))
+                   for (name, dtype), pos in zip(self.columns,
+                                                 self.positions)]
+        for row in rows:
+            for buf, pos, dtype, codes in columns:
+                value = row[pos]
+                if codes is not None:
+                    code = codes.get(value) if value else -1
+                    if code is None:
+                        code = codes[value] = len(codes)
+                    buf.append(code)
+                elif dtype.startswith('float'):
+                    buf.append(float(value) if value else np.nan)
+                else:
+                    buf.append(int(value))
+            self.rows += 1
+            if len(columns[0][0]) >= self.bufferRows:
+                self.flush()
+
+    def flush(self):
+        for name, dtype in self.columns:
+            if dtype == 'category':
+                dtype = 'int32'
+            np.array(self.buffers[name], dtype=dtype).tofile(
+                self.files[name])
+            del self.buffers[name][:]
+
+    def close(self):
+        """ Flush the columns, renumber category codes in sorted order and
+            write meta.json
+        """
+        self.flush()
+        for f in self.files.values():
+            f.close()
+        meta = {'rows': self.rows, 'columns': []}
+        for name, dtype in self.columns:
+            column = {'name': name, 'dtype': dtype}
+            if dtype == 'category':
+                found = self.categories[name]
+                categories = sorted(found)
+                mapping = np.empty(len(found) + 1, dtype='int32')
+                mapping[-1] = -1
+                for num, value in enumerate(categories):
+                    mapping[found[value]] = num
+                codes = np.fromfile(self.path(name), dtype='int32')
+                mapping[codes].tofile(self.path(name))
+                column['categories'] = categories
+            meta['columns'].append(column)
+        json.dump(meta, open(os.path.join(self.directory, 'meta.json'), 'w'))
+        if self.out:
+            self.out.close()
+
+
+class ColumnarStore(object):
+    """ Reads a directory written by ColumnarWriter. Columns are memory
+        mapped and only those asked for are touched.
+    """
+    def __init__(self, directory):
+        self.directory = directory
+        meta = json.load(open(os.path.join(directory, 'meta.json')))
+        self.rows = meta['rows']
+        self.columns = [x['name'] for x in meta['columns']]
+        self.meta = dict((x['name'], x) for x in meta['columns'])
+
+    def __len__(self):
+        return self.rows
+
+    def column(self, name):
+        """ A column as a memory mapped array, or a pandas Categorical
+        """
+        if name not in self.meta:
+            raise KeyError('%s has no column %s' % (self.directory, name))
+        meta = self.meta[name]
+        dtype = 'int32' if meta['dtype'] == 'category' else meta['dtype']
+        path = os.path.join(self.directory, name + '.bin')
+        if self.rows:
+            values = np.memmap(path, dtype=dtype, mode='r',
+                               shape=(self.rows,))
+        else:
+            values = np.zeros(0, dtype=dtype)
+        if meta['dtype'] == 'category':
+            # json gives unicode, the CSV reader gives utf-8 strings
+            categories = [x.encode('utf-8') for x in meta['categories']]
+            return pd.Categorical.from_codes(values, categories)
+        return values
+
+    def frame(self, columns=None):
+        """ DataFrame of the given columns, all by default
+        """
+        columns = columns or self.columns
+        return pd.DataFrame(dict((name, self.column(name))
+                                 for name in columns), columns=columns)
+
+
+def is_columnar(path):
+    return os.path.isfile(os.path.join(path, 'meta.json'))
@@ -0,0 +1,442 @@
+""" Synthetic play-by-play seasons for load testing.
+
+    A PitchModel learns from a sample file, such as tests/2016-WS.csv, how
+    pitch results depend on the count, the pitch data seen with each result,
+    what balls in play become and how runners and outs change after each
+    plate appearance result. A SeasonGenerator plays out seasons of games
+    pitch by pitch with it, with teams, rosters, lineups, pitching changes
+    and innings that follow the rules, and streams them to a CSV with the
+    sample's columns. Only one game is held in memory and the output
+    depends only on the sample and the seed.
+
+        python generator.py data/synthetic.csv --rows 10000000 --seed 1
+        python generator.py data/synthetic.csv --seasons 5
+"""
+import argparse
+import csv
+from bisect import bisect_right
+from datetime import date, timedelta
+import numpy as np
+
+# Columns describing the pitch itself, drawn together from one sample row
+PITCH_COLUMNS = ['pitchType', 'releaseVelocity', 'spinRate', 'spinDir', 'px',
+                 'pz', 'szt', 'szb', 'x0', 'y0', 'z0', 'vx0', 'vy0', 'vz0',
+                 'ax', 'ay', 'az', 'probCalledStrike']
+BATTED_COLUMNS = ['battedBallType', 'battedBallAngle', 'battedBallDistance']
+TEAMS = ['ana', 'ari', 'atl', 'bal', 'bos', 'cha', 'chn', 'cin', 'cle', 'col',
+         'det', 'hou', 'kca', 'lan', 'mia', 'mil', 'min', 'nya', 'nyn', 'oak',
+         'phi', 'pit', 'sdn', 'sea', 'sfn', 'sln', 'tba', 'tex', 'tor', 'was']
+POSITIONS = ['C', '1B', '2B', '3B', 'SS', 'LF', 'CF', 'RF', 'DH']
+DESCRIPTIONS = {'S': '%s singles.', 'D': '%s doubles.', 'T': '%s triples.',
+                'HR': '%s homers.', 'K': '%s strikes out.',
+                'BB': '%s walks.', 'IBB': '%s intentionally walked.',
+                'HBP': '%s hit by pitch.', 'IP_OUT': '%s flies out.',
+                'DP': '%s grounds into a double play.',
+                'FC': "%s reaches on a fielder's choice.",
+                'ROE': '%s reaches on a fielding error.',
+                'SF': '%s hits a sacrifice fly.',
+                'SH': '%s hits a sacrifice bunt.'}
+
+
+def cumulative(counts):
+    """ (values, cumulative probabilities) of a dict of value counts, in
+        sorted order so draws do not depend on dict order
+    """
+    values = sorted(counts)
+    totals = np.cumsum([counts[x] for x in values], dtype=float)
+    return values, list(totals / totals[-1])
+
+
+class PitchModel(object):
+    """ What a SeasonGenerator draws from, learned from a sample file
+    """
+    balls = {'B', 'BID', 'PO', 'IB'}
+    strikes = {'SL', 'SS', 'FT', 'MB', 'S', 'C'}
+    fouls = {'F', 'FB'}
+    # Outs made on the play by the rules, where the sample has no example
+    outs = {'K': 1, 'IP_OUT': 1, 'SF': 1, 'SH': 1, 'FC': 1, 'DP': 2, 'TP': 3}
+    advances = {'S': 1, 'ROE': 1, 'D': 2, 'T': 3, 'HR': 4}
+
+    def __init__(self, filename):
+        reader = csv.reader(open(filename, 'r'))
+        self.header = next(reader)
+        pos = dict((key, num) for num, key in enumerate(self.header))
+        results, pitches, inPlay, batted = {}, {}, {}, {}
+        self.transitions = {}
+        trueValues = set()
+        pas = walks = 0
+        for row in reader:
+            get = lambda key: row[pos[key]]
+            count = (int(get('balls')), int(get('strikes')))
+            result, paResult = get('pitchResult'), get('paResult')
+            if get('manOnFirst').lower() == 'true':
+                trueValues.add(get('manOnFirst'))
+            pitch = tuple(get(key) for key in PITCH_COLUMNS)
+            pitches.setdefault((result, get('pitcherHand')), []).append(pitch)
+            pitches.setdefault((result, None), []).append(pitch)
+            if result != 'IB':
+                counts = results.setdefault(count, {})
+                counts[result] = counts.get(result, 0) + 1
+            if not paResult:
+                continue
+            pas += 1
+            walks += paResult == 'IBB'
+            if result == 'IP':
+                inPlay[paResult] = inPlay.get(paResult, 0) + 1
+                batted.setdefault(paResult, []).append(
+                    tuple(get(key) for key in BATTED_COLUMNS))
+            bases = self.bases(*[get(x).lower() == 'true' for x in
+                                 ['manOnFirst', 'manOnSecond', 'manOnThird']])
+            after = self.bases(*[get(x).lower() == 'true' for x in
+                                 ['endManOnFirst', 'endManOnSecond',
+                                  'endManOnThird']])
+            runs = int(get('runsHome') or 0)
+            outs = int(get('outs'))
+            # Everyone on base before, and the batter, either scored, is
+            # still on or was put out
+            made = (bin(bases).count('1') + 1 - bin(after).count('1') -
+                    runs)
+            self.transitions.setdefault((paResult, bases, outs), []).append(
+                (after, runs, max(0, min(made, 3 - outs))))
+        self.true = trueValues.pop() if trueValues else 'true'
+        self.false = 'FALSE' if self.true.isupper() else 'false'
+        everything = {}
+        for counts in results.values():
+            for result, num in counts.items():
+                everything[result] = everything.get(result, 0) + num
+        self.results = dict((count, cumulative(counts)) for count, counts in
+                            results.items())
+        self.anyResult = cumulative(everything)
+        self.pitches = pitches
+        self.inPlay = cumulative(inPlay)
+        self.batted = batted
+        self.intentional = walks / float(max(pas, 1))
+
+    def bases(self, first, second, third):
+        return int(first) | (2 if second else 0) | (4 if third else 0)
+
+    def kind(self, result, strikes):
+        """ How a pitch result changes the count: 'ball', 'strike', 'IP',
+            'HBP' or None for a foul with two strikes. Anything else counts
+            as a ball.
+        """
+        if result in self.strikes or (result in self.fouls and strikes < 2):
+            return 'strike'
+        if result in self.fouls:
+            return None
+        if result in ('IP', 'HBP'):
+            return result
+        return 'ball'
+
+    def result(self, balls, strikes, u):
+        values, probs = self.results.get((balls, strikes), self.anyResult)
+        return values[min(bisect_right(probs, u), len(values) - 1)]
+
+    def in_play(self, u):
+        values, probs = self.inPlay
+        return values[min(bisect_right(probs, u), len(values) - 1)]
+
+    def pitch(self, result, hand, u):
+        """ Pitch data of a sample pitch with this result, thrown with this
+            hand where the sample has one
+        """
+        pitches = self.pitches.get((result, hand)) or \
+            self.pitches.get((result, None)) or self.pitches[('B', None)]
+        return pitches[int(u * len(pitches))]
+
+    def transition(self, paResult, bases, outs, u):
+        """ (bases after, runs, outs made) after a plate appearance, from
+            the sample where it has this result in this state, otherwise by
+            the rules
+        """
+        seen = self.transitions.get((paResult, bases, outs))
+        if seen:
+            return seen[int(u * len(seen))]
+        if paResult in ('BB', 'IBB', 'HBP'):
+            forced = bases | 1
+            if bases & 1:
+                forced |= 2
+                if bases & 2:
+                    forced |= 4
+                    if bases & 4:
+                        return forced, 1, 0
+            return forced, 0, 0
+        if paResult in self.advances:
+            advance = self.advances[paResult]
+            moved = (bases << advance) | (1 << (advance - 1))
+            return moved & 7, bin(moved >> 3).count('1'), 0
+        made = min(self.outs.get(paResult, 1), 3 - outs)
+        if outs + made >= 3:
+            return 0, 0, made
+        if paResult == 'SF' and bases & 4:
+            return bases & 3, 1, made
+        if paResult in ('FC', 'DP') and bases & 1:
+            # The runner from first is out, and with a DP the batter too
+            return bases if paResult == 'FC' else bases & 6, 0, made
+        return bases, 0, made
+
+
+class Team(object):
+    def __init__(self, num, code, batters, pitchers, idBase):
+        self.code = code
+        start = idBase + num * 1000
+        self.batters = range(start, start + batters)
+        self.pitchers = range(start + 500, start + 500 + pitchers)
+        self.games = 0
+
+
+class SeasonGenerator(object):
+    """ Plays out seasons of games between teams, pitch by pitch. Each team
+        has a roster of batters, the first two of them catchers, and of
+        pitchers, the first five starters. Regulars play most games.
+    """
+    def __init__(self, model, seed=0, teams=30, games=162, batters=33,
+                 pitchers=25, umpires=90, startYear=2016, idBase=100000):
+        assert batters >= 11 and pitchers >= 6
+        self.model = model
+        self.rng = np.random.RandomState(seed)
+        self.draws, self.drawn = [], 0
+        self.teams = [Team(num, TEAMS[num % len(TEAMS)] +
+                           ('' if num < len(TEAMS) else str(num)), batters,
+                           pitchers, idBase) for num in range(teams)]
+        self.games = games
+        self.umpires = range(idBase * 4, idBase * 4 + umpires)
+        self.startYear = startYear
+        # Players are named by id, their hands drawn once
+        self.hands = {}
+        for team in self.teams:
+            for batterId in team.batters:
+                self.hands[batterId] = 'L' if self.uniform() < 0.4 else 'R'
+            for pitcherId in team.pitchers:
+                self.hands[pitcherId] = 'L' if self.uniform() < 0.3 else 'R'
+        self.weights = np.cumsum(0.8 ** np.arange(batters - 2))
+        self.weights /= self.weights[-1]
+        self.pos = dict((key, num) for num, key in enumerate(model.header))
+
+    def uniform(self):
+        """ Next uniform draw, taken from the generator in blocks
+        """
+        if self.drawn == len(self.draws):
+            self.draws = self.rng.random_sample(65536).tolist()
+            self.drawn = 0
+        self.drawn += 1
+        return self.draws[self.drawn - 1]
+
+    def name(self, playerId):
+        return 'Player %d' % playerId
+
+    def lineup(self, team):
+        """ Nine (batterId, position) pairs: a catcher and eight others,
+            regulars more often than the bench
+        """
+        catcher = team.batters[0 if self.uniform() < 0.8 else 1]
+        others = team.batters[2:]
+        chosen = []
+        while len(chosen) < 8:
+            batterId = others[bisect_right(self.weights, self.uniform())]
+            if batterId not in chosen:
+                chosen.append(batterId)
+        chosen.sort()
+        return zip([catcher] + chosen, POSITIONS)
+
+    def reliever(self, team, current):
+        while True:
+            pitcherId = team.pitchers[5 + int(self.uniform() *
+                                              (len(team.pitchers) - 5))]
+            if pitcherId != current:
+                return pitcherId
+
+    def schedule(self, year):
+        """ Yields (date, visitor, home) for a season. Every team plays
+            each game day, with a day off every seventh day.
+        """
+        day = date(year, 4, 3)
+        for num in range(self.games):
+            if num and num % 6 == 0:
+                day += timedelta(days=1)
+            order = self.rng.permutation(len(self.teams))
+            for idx in range(0, len(order) - 1, 2):
+                yield day, self.teams[order[idx]], self.teams[order[idx + 1]]
+            day += timedelta(days=1)
+
+    def rows(self, seasons=1):
+        """ Yields output rows, one game's worth at a time
+        """
+        for year in xrange(self.startYear, self.startYear + seasons):
+            for day, visitor, home in self.schedule(year):
+                for row in self.game(year, day, visitor, home):
+                    yield row
+
+    def game(self, year, day, visitor, home):
+        """ The rows of one game, played to at least nine innings and until
+            a team leads after a full inning, or the home team takes the
+            lead in the ninth or later
+        """
+        pos = self.pos
+        gameString = 'gid_%s_%smlb_%smlb_1' % (day.strftime('%Y_%m_%d'),
+                                               visitor.code, home.code)
+        umpireId = self.umpires[int(self.uniform() * len(self.umpires))]
+        common = {'seasonYear': str(year), 'gameString': gameString,
+                  'gameDate': day.strftime('%Y-%m-%d') + ' 19:05:00',
+                  'gameType': 'R', 'visitor': visitor.code.upper(),
+                  'home': home.code.upper(), 'umpireId': str(umpireId),
+                  'umpire': self.name(umpireId)}
+        sides = []
+        for team in [visitor, home]:
+            starter = team.pitchers[team.games % 5]
+            team.games += 1
+            sides.append({'team': team, 'lineup': self.lineup(team),
+                          'up': 0, 'pitcher': starter, 'pitches': 0,
+                          'limit': 85 + 20 * self.uniform()})
+        rows, runs, faced = [], [0, 0], {}
+        inning = 0
+        while (inning < 9 or runs[0] == runs[1]) and inning < 30:
+            inning += 1
+            for half, side in enumerate('TB'):
+                if half and inning >= 9 and runs[1] > runs[0]:
+                    break
+                batting, fielding = sides[half], sides[1 - half]
+                outs, bases = 0, 0
+                while outs < 3:
+                    if half and inning >= 9 and runs[1] > runs[0]:
+                        break
+                    if fielding['pitches'] >= fielding['limit']:
+                        fielding['pitcher'] = self.reliever(
+                            fielding['team'], fielding['pitcher'])
+                        fielding['pitches'] = 0
+                        fielding['limit'] = 10 + 25 * self.uniform()
+                    batterId, position = batting['lineup'][batting['up']]
+                    batting['up'] = (batting['up'] + 1) % 9
+                    pitcherId = fielding['pitcher']
+                    key = (batterId, pitcherId)
+                    faced[key] = faced.get(key, 0) + 1
+                    catcherId = fielding['lineup'][0][0]
+                    pa = dict(common, inning=str(inning), side=side,
+                              batterId=str(batterId),
+                              batter=self.name(batterId),
+                              batterHand=self.hands[batterId],
+                              pitcherId=str(pitcherId),
+                              pitcher=self.name(pitcherId),
+                              pitcherHand=self.hands[pitcherId],
+                              catcherId=str(catcherId),
+                              catcher=self.name(catcherId),
+                              timesFaced=str(faced[key]),
+                              batterPosition=position)
+                    paRows, bases, scored, made = self.plate_appearance(
+                        pa, outs, bases, runs)
+                    runs[half] += scored
+                    outs += made
+                    fielding['pitches'] += len(paRows)
+                    rows.extend(paRows)
+        for row in rows:
+            row[pos['visitingTeamFinalRuns']] = str(runs[0])
+            row[pos['homeTeamFinalRuns']] = str(runs[1])
+        return rows
+
+    def plate_appearance(self, pa, outs, bases, runs):
+        """ Rows of a plate appearance starting with outs and bases, and the
+            bases, runs and outs it ends with
+        """
+        model = self.model
+        balls = strikes = 0
+        rows = []
+        intentional = self.uniform() < model.intentional
+        paResult = None
+        while paResult is None:
+            result = 'IB' if intentional else model.result(balls, strikes,
+                                                           self.uniform())
+            kind = model.kind(result, strikes)
+            if kind == 'ball' and balls == 3:
+                paResult = 'IBB' if intentional else 'BB'
+            elif kind == 'strike' and strikes == 2:
+                paResult = 'K'
+            elif kind == 'HBP':
+                paResult = 'HBP'
+            elif kind == 'IP':
+                paResult = model.in_play(self.uniform())
+            after, scored, made = bases, 0, 0
+            if paResult:
+                after, scored, made = model.transition(paResult, bases, outs,
+                                                       self.uniform())
+            rows.append(self.row(pa, outs, balls, strikes, bases, after,
+                                 runs, result, paResult, scored))
+            balls += kind == 'ball'
+            strikes += kind == 'strike'
+        return rows, after, scored, made
+
+    def row(self, pa, outs, balls, strikes, bases, after, runs, result,
+            paResult, scored):
+        model, pos = self.model, self.pos
+        row = [''] * len(model.header)
+        for key, value in pa.items():
+            row[pos[key]] = value
+        flag = lambda x: model.true if x else model.false
+        row[pos['balls']], row[pos['strikes']] = str(balls), str(strikes)
+        row[pos['outs']] = str(outs)
+        for num, key in enumerate(['manOnFirst', 'manOnSecond',
+                                   'manOnThird']):
+            row[pos[key]] = flag(bases & (1 << num))
+            row[pos['end' + key[0].upper() + key[1:]]] = flag(
+                after & (1 << num))
+        row[pos['visitingTeamCurrentRuns']] = str(runs[0])
+        row[pos['homeTeamCurrentRuns']] = str(runs[1])
+        row[pos['pitchResult']] = result
+        pitch = model.pitch(result, pa['pitcherHand'], self.uniform())
+        for key, value in zip(PITCH_COLUMNS, pitch):
+            row[pos[key]] = value
+        if paResult:
+            row[pos['paResult']] = paResult
+            row[pos['runsHome']] = str(scored) if scored else ''
+            row[pos['atbatDesc']] = DESCRIPTIONS.get(
+                paResult, '%s ' + paResult + '.') % pa['batter']
+            batted = model.batted.get(paResult)
+            if result == 'IP' and batted:
+                values = batted[int(self.uniform() * len(batted))]
+                for key, value in zip(BATTED_COLUMNS, values):
+                    row[pos[key]] = value
+        return row
+
+    def write(self, output, rows=None, seasons=1):
+        """ Stream seasons of games to output, stopping after rows rows if
+            given, with as many more seasons as that takes. Returns the
+            number of rows written.
+        """
+        if rows is not None:
+            seasons = 10 ** 6
+        writer = csv.writer(open(output, 'w'), lineterminator='\n')
+        writer.writerow(self.model.header)
+        written = 0
+        for row in self.rows(seasons):
+            if written == rows:
+                break
+            writer.writerow(row)
+            written += 1
+        return written
+
+
+def generate(sample, output, rows=None, seasons=1, seed=0, **kwargs):
+    """ Learn from sample and write a synthetic file to output
+    """
+    generator = SeasonGenerator(PitchModel(sample), seed=seed, **kwargs)
+    return generator.write(output, rows=rows, seasons=seasons)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('output')
+    parser.add_argument('--sample', default='tests/2016-WS.csv',
+                        help='play-by-play file to learn from')
+    parser.add_argument('--rows', type=int,
+                        help='stop after this many rows')
+    parser.add_argument('--seasons', type=int, default=1)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--teams', type=int, default=30)
+    parser.add_argument('--games', type=int, default=162,
+                        help='games per team per season')
+    args = parser.parse_args(argv)
+    generate(args.sample, args.output, rows=args.rows, seasons=args.seasons,
+             seed=args.seed, teams=args.teams, games=args.games)
+
+
+if __name__ == '__main__':
+    main()
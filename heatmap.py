@@ -1,3 +1,4 @@
+from bisect import bisect_left
 import numpy as np
 
 class HeatMap(object):
@@ -22,6 +23,8 @@ class HeatMap(object):
         self.ignorePaResults = {'BI', 'CI', 'FI', 'NO_PLAY'}
         self.S, self.D, self.T, self.HR = 0, 1, 2, 3
         self.miss, self.out, self.foul, self.swing, self.total = 4, 5, 6, 7, 8
+        # Bumped whenever a (hand, pitchType) map changes, for caching
+        self.versions = {}
 
     def generate_new_map(self):
         """ Generate nine 5 x 5 heat maps:
@@ -67,10 +70,93 @@ class HeatMap(object):
     def get_location(self, px, pz):
         """ For a given pitch coordinate, return its location in the zone map.
         """
-        i = 4 - list(np.less_equal(pz, self.zs)).index(True)
-        j = list(np.less_equal(px, self.xs)).index(True)
+        if px != px or pz != pz:
+            raise ValueError('px and pz must be numbers')
+        i = 4 - bisect_left(self.zs, pz)
+        j = bisect_left(self.xs, px)
         return i, j
 
+    def get_locations(self, px, pz):
+        """ Vectorized get_location. Returns arrays of rows and columns in
+            the zone map, -1 where px or pz is not a number.
+        """
+        px = np.asarray(px, dtype=float)
+        pz = np.asarray(pz, dtype=float)
+        i = 4 - np.searchsorted(self.zs, pz, side='left')
+        j = np.searchsorted(self.xs, px, side='left')
+        missing = np.isnan(px) | np.isnan(pz)
+        i[missing] = -1
+        j[missing] = -1
+        return i, j
+
+    def classify_pitches(self, pitchTypes, pitchResults, paResults):
+        """ Vectorized form of the rules in process_pitch.
+            Returns a boolean array of pitches that are not ignored and an
+            (n, 9) array of how much each pitch adds to each of the nine
+            maps.
+        """
+        n = len(pitchTypes)
+        valid = np.array([not ((t in self.ignorePitchTypes) or
+                               (r in self.ignorePitchResults) or
+                               (p in self.ignorePaResults))
+                          for t, r, p in zip(pitchTypes, pitchResults,
+                                             paResults)], dtype=bool)
+        counts = np.zeros((n, 9), dtype=int)
+        counts[:, self.total] = 1
+        counts[:, self.swing] = [r in self.swings for r in pitchResults]
+        counts[:, self.foul] = [r in self.fouls for r in pitchResults]
+        counts[:, self.miss] = [(r in self.misses) and (r not in self.fouls)
+                                for r in pitchResults]
+        hits = {'S': self.S, 'D': self.D, 'T': self.T, 'HR': self.HR}
+        for num, paResult in enumerate(paResults):
+            if paResult in self.outs:
+                counts[num, self.out] = self.outs[paResult]
+            elif paResult in hits:
+                counts[num, hits[paResult]] = 1
+        counts[~valid] = 0
+        return valid, counts
+
+    def pitch_counts(self, pitchType, pitchResult, paResult):
+        """ Scalar form of classify_pitches: the (map, amount) pairs a
+            pitch adds to, or None if it is ignored. Results depend only on
+            the pitch and PA results, so they are cached.
+        """
+        if ((pitchType in self.ignorePitchTypes) or
+            (pitchResult in self.ignorePitchResults) or
+            (paResult in self.ignorePaResults)):
+            return None
+        if not hasattr(self, 'countsCache'):
+            self.countsCache = {}
+        key = (pitchResult, paResult)
+        if key not in self.countsCache:
+            counts = self.classify_pitches([''], [pitchResult],
+                                           [paResult])[1][0]
+            self.countsCache[key] = tuple((idx, int(counts[idx])) for idx in
+                                          np.flatnonzero(counts))
+        return self.countsCache[key]
+
+    def add_counts(self, i, j, pitchType, hand, counts):
+        """ Add a pitch already located at zone cell i, j and classified by
+            pitch_counts.
+        """
+        if pitchType not in self.maps[hand]:
+            self.maps[hand][pitchType] = self.generate_new_map()
+        self.bump_version(hand, pitchType)
+        cells = self.maps[hand][pitchType]
+        for idx, amount in counts:
+            cells[idx, i, j] += amount
+
+    def merge(self, other):
+        """ Add the counts of another HeatMap to this one
+        """
+        for hand, maps in other.maps.items():
+            for pitchType, counts in maps.items():
+                if pitchType in self.maps[hand]:
+                    self.maps[hand][pitchType] += counts
+                else:
+                    self.maps[hand][pitchType] = counts.copy()
+                self.bump_version(hand, pitchType)
+
     def process_pitch(self, px, pz, pitchType, pitchResult, paResult, hand):
         """ Input pitchfx data and use it to update heat maps
         """
@@ -81,6 +167,7 @@ class HeatMap(object):
         if pitchType not in self.maps[hand]:
             self.maps[hand][pitchType] = self.generate_new_map()
         i, j = self.get_location(px, pz)
+        self.bump_version(hand, pitchType)
         self.add_total(i, j, pitchType, hand)
         if pitchResult in self.swings:
             self.add_swing(i, j, pitchType, hand)
@@ -99,6 +186,18 @@ class HeatMap(object):
         elif paResult == 'HR':
             self.add_homer(i, j, pitchType, paResult, hand)
 
+    def version(self, hand, pitchType):
+        """ Number of times the (hand, pitchType) map has been updated
+        """
+        # Heat maps pickled before versions were added have none
+        return getattr(self, 'versions', {}).get((hand, pitchType), 0)
+
+    def bump_version(self, hand, pitchType):
+        if not hasattr(self, 'versions'):
+            self.versions = {}
+        key = (hand, pitchType)
+        self.versions[key] = self.versions.get(key, 0) + 1
+
     def get_value(self, px, pz, pitchType, idx, hand):
         try:
             i, j = self.get_location(px, pz)
@@ -107,6 +206,61 @@ class HeatMap(object):
         except KeyError:
             return float(0)
 
+    def outcome_distribution(self, px, pz, pitchType, hand):
+        """ Input pitch type and location
+            Returns [P(single|swing), P(double|swing), P(triple|swing),
+            P(homer|swing), P(miss|swing), P(out|swing), P(foul|swing)]
+            from a single zone lookup.
+        """
+        i, j = self.get_location(px, pz)
+        try:
+            cell = self.maps[hand][pitchType][:, i, j]
+        except KeyError:
+            cell = np.zeros(9)
+        swings = float(cell[self.swing])
+        return [float(cell[idx]) / swings for idx in
+                (self.S, self.D, self.T, self.HR, self.miss, self.out,
+                 self.foul)]
+
+    def cell_counts(self, px, pz, pitchTypes, hands, stats):
+        """ Returns an (n, len(stats)) array of the given maps' counts at
+            each pitch's zone cell, 0 where the pitch has no location.
+        """
+        i, j = self.get_locations(px, pz)
+        cells = np.zeros((len(i), len(stats)))
+        pitchTypes = np.asarray(pitchTypes, dtype=object)
+        hands = np.asarray(hands, dtype=object)
+        for hand in self.maps:
+            for pitchType, counts in self.maps[hand].items():
+                rows = np.flatnonzero((hands == hand) &
+                                      (pitchTypes == pitchType) & (i >= 0))
+                cells[rows] = counts[stats][:, i[rows], j[rows]].T
+        return cells
+
+    def outcome_distributions(self, px, pz, pitchTypes, hands):
+        """ Vectorized outcome_distribution for arrays of pitches.
+            Returns an (n, 7) array, NaN where there are no swings recorded
+            or the pitch has no location.
+        """
+        stats = [self.S, self.D, self.T, self.HR, self.miss, self.out,
+                 self.foul, self.swing]
+        cells = self.cell_counts(px, pz, pitchTypes, hands, stats)
+        swings = cells[:, -1:]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            probs = cells[:, :-1] / swings
+        probs[swings[:, 0] == 0] = np.nan
+        return probs
+
+    def swing_rates(self, px, pz, pitchTypes, hands):
+        """ Vectorized prob_swing: the share of pitches seen at each pitch's
+            zone cell that were swung at, NaN where none were seen.
+        """
+        cells = self.cell_counts(px, pz, pitchTypes, hands,
+                                 [self.swing, self.total])
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return np.where(cells[:, 1] > 0, cells[:, 0] / cells[:, 1],
+                            np.nan)
+
     def prob_single(self, px, pz, pitchType, hand):
         """ Input pitch type and location
             Returns P(base|swing)
@@ -169,4 +323,271 @@ class HeatMap(object):
         """
         swings = self.get_value(px, pz, pitchType, self.swing, hand)
         totals = self.get_value(px, pz, pitchType, self.total, hand)
-        return swings / totals
\ No newline at end of file
+        return swings / totals
+
+
+class PitchTypeMaps(object):
+    """ Dict-like view of one batter and pitcher hand of a LeagueHeatMap,
+        mapping pitch type to its (9, 5, 5) block of the counts array.
+    """
+    def __init__(self, league, batter, hand):
+        self.league = league
+        self.batter = batter
+        self.hand = hand
+
+    def __getitem__(self, pitchType):
+        if pitchType not in self.league.pitchTypeCodes:
+            raise KeyError(pitchType)
+        code = self.league.pitchTypeCodes[pitchType]
+        return self.league.counts[self.batter, self.hand, code]
+
+    def __setitem__(self, pitchType, value):
+        code = self.league.register_pitch_types([pitchType])[0]
+        self.league.counts[self.batter, self.hand, code] = 0
+        self.league.add_block(self.batter, ['L', 'R'][self.hand], pitchType,
+                              value)
+
+    def __contains__(self, pitchType):
+        return pitchType in self.keys()
+
+    def keys(self):
+        """ Pitch types this batter has seen from this hand.
+        """
+        totals = self.league.counts[self.batter, self.hand, :,
+                                    self.league.heatmap.total]
+        totals = totals.sum(axis=(1, 2))
+        return [self.league.pitchTypes[code] for code in
+                np.flatnonzero(totals)]
+
+    def items(self):
+        return [(key, self[key]) for key in self.keys()]
+
+
+class HeatMapView(HeatMap):
+    """ HeatMap whose maps are backed by one batter of a LeagueHeatMap, so
+        the prob_* and process_pitch API keeps working. It pickles as an
+        independent HeatMap rather than with the whole league.
+    """
+    def __init__(self, league, batter):
+        HeatMap.__init__(self)
+        self.league = league
+        self.batter = batter
+        self.maps = {hand: PitchTypeMaps(league, batter, code)
+                     for hand, code in league.handCodes.items()}
+        self.versions = league.versions.setdefault(batter, {})
+
+    def process_pitch(self, px, pz, pitchType, pitchResult, paResult, hand):
+        """ HeatMap.process_pitch, adding through the league so its
+            counts are widened rather than wrapping
+        """
+        counts = self.pitch_counts(pitchType, pitchResult, paResult)
+        if counts is None:
+            return None
+        i, j = self.get_location(px, pz)
+        self.add_counts(i, j, pitchType, hand, counts)
+
+    def add_counts(self, i, j, pitchType, hand, counts):
+        block = self.generate_new_map()
+        for idx, amount in counts:
+            block[idx, i, j] += amount
+        self.league.add_block(self.batter, hand, pitchType, block)
+        self.bump_version(hand, pitchType)
+
+    def merge(self, other):
+        for hand, maps in other.maps.items():
+            for pitchType, counts in maps.items():
+                self.league.add_block(self.batter, hand, pitchType, counts)
+                self.bump_version(hand, pitchType)
+
+    def to_heatmap(self):
+        """ An independent HeatMap with a copy of this batter's counts
+        """
+        heatmap = HeatMap()
+        for hand in self.maps:
+            for pitchType, counts in self.maps[hand].items():
+                heatmap.maps[hand][pitchType] = counts.astype(int)
+        heatmap.versions = dict(self.versions)
+        return heatmap
+
+    def __reduce__(self):
+        return (HeatMap, (), self.to_heatmap().__dict__)
+
+
+class LeagueHeatMap(object):
+    """ Heat maps for every batter in one contiguous counts array indexed by
+        [batter code, hand, pitch type code, stat, i, j]. Batter ids and
+        pitch types are assigned codes as they are first seen. Behaves like
+        the {batterId: HeatMap} dict used by Season, its values being
+        HeatMapViews of the batters.
+    """
+    def __init__(self, dtype=np.uint16):
+        self.heatmap = HeatMap()
+        self.handCodes = {'L': 0, 'R': 1}
+        self.batterCodes, self.batterIds = {}, []
+        self.pitchTypeCodes, self.pitchTypes = {}, []
+        self.counts = np.zeros((0, 2, 0, 9, 5, 5), dtype=dtype)
+        # {batter code: {(hand, pitchType): version}} as in HeatMap
+        self.versions = {}
+
+    def resize(self, batters, pitchTypes):
+        """ Grow the counts array to hold at least the given number of
+            batters and pitch types.
+        """
+        shape = self.counts.shape
+        if batters <= shape[0] and pitchTypes <= shape[2]:
+            return
+        batters = max(batters, 2 * shape[0])
+        pitchTypes = max(pitchTypes, shape[2])
+        counts = np.zeros((batters, 2, pitchTypes, 9, 5, 5),
+                          dtype=self.counts.dtype)
+        counts[:shape[0], :, :shape[2]] = self.counts
+        self.counts = counts
+
+    def register_batters(self, batterIds):
+        """ Returns the codes of the batter ids, assigning new ones
+        """
+        for batterId in batterIds:
+            if batterId not in self.batterCodes:
+                self.batterCodes[batterId] = len(self.batterIds)
+                self.batterIds.append(batterId)
+        self.resize(len(self.batterIds), len(self.pitchTypes))
+        return np.array([self.batterCodes[x] for x in batterIds], dtype=int)
+
+    def register_pitch_types(self, pitchTypes):
+        """ Returns the codes of the pitch types, assigning new ones
+        """
+        for pitchType in pitchTypes:
+            if pitchType not in self.pitchTypeCodes:
+                self.pitchTypeCodes[pitchType] = len(self.pitchTypes)
+                self.pitchTypes.append(pitchType)
+        self.resize(len(self.batterIds), len(self.pitchTypes))
+        return np.array([self.pitchTypeCodes[x] for x in pitchTypes],
+                        dtype=int)
+
+    def widen(self, flat, increments):
+        """ Promote the counts dtype if adding the increments at the flat
+            indices would overflow it.
+        """
+        cells, inverse = np.unique(flat, return_inverse=True)
+        added = np.bincount(inverse, weights=increments)
+        current = self.counts.reshape(-1)[cells]
+        limit = np.iinfo(self.counts.dtype).max
+        while len(cells) and (current + added).max() > limit:
+            dtype = np.dtype('%s%d' % (self.counts.dtype.kind,
+                                       2 * self.counts.dtype.itemsize))
+            self.counts = self.counts.astype(dtype)
+            limit = np.iinfo(dtype).max
+
+    def add_block(self, batter, hand, pitchType, block):
+        """ Add a (9, 5, 5) block of counts to a batter code's map,
+            widening the dtype if needed
+        """
+        code = self.register_pitch_types([pitchType])[0]
+        start = np.ravel_multi_index((batter, self.handCodes[hand], code, 0,
+                                      0, 0), self.counts.shape)
+        block = np.asarray(block).reshape(-1)
+        cells = np.flatnonzero(block)
+        self.widen(start + cells, block[cells])
+        self.counts.reshape(-1)[start + cells] += \
+            block[cells].astype(self.counts.dtype)
+
+    def add_pitches(self, batterIds, px, pz, pitchTypes, pitchResults,
+                    paResults, hands):
+        """ Add arrays of pitches to the heat maps with one scatter-add.
+            Pitches ignored by HeatMap.process_pitch, without a location or
+            with an unknown pitcher hand are skipped. Returns the number of
+            pitches added.
+        """
+        valid, increments = self.heatmap.classify_pitches(pitchTypes,
+                                                          pitchResults,
+                                                          paResults)
+        i, j = self.heatmap.get_locations(px, pz)
+        hands = np.array([self.handCodes.get(x, -1) for x in hands],
+                         dtype=int)
+        valid &= (i >= 0) & (hands >= 0)
+        rows = np.flatnonzero(valid)
+        if not len(rows):
+            return 0
+        batters = self.register_batters([batterIds[x] for x in rows])
+        types = self.register_pitch_types([pitchTypes[x] for x in rows])
+        pitch = np.ravel_multi_index(
+            (batters, hands[rows], types, np.zeros(len(rows), dtype=int),
+             i[rows], j[rows]), self.counts.shape)
+        # Offset of each stat's map within a pitch type block
+        stride = self.counts.strides[3] // self.counts.itemsize
+        increments = increments[rows]
+        pitchIdx, stat = np.nonzero(increments)
+        flat = pitch[pitchIdx] + stat * stride
+        values = increments[pitchIdx, stat]
+        self.widen(flat, values)
+        np.add.at(self.counts.reshape(-1), flat,
+                  values.astype(self.counts.dtype))
+        hands = np.array(['L', 'R'])[hands[rows]]
+        for batter, hand, pitchType in zip(batters, hands,
+                                           [pitchTypes[x] for x in rows]):
+            versions = self.versions.setdefault(batter, {})
+            key = (hand, pitchType)
+            versions[key] = versions.get(key, 0) + 1
+        return len(rows)
+
+    def __getitem__(self, batterId):
+        if batterId not in self.batterCodes:
+            raise KeyError(batterId)
+        return HeatMapView(self, self.batterCodes[batterId])
+
+    def __setitem__(self, batterId, heatmap):
+        # Copied first, as heatmap may be a view of this batter
+        blocks = [(hand, pitchType, np.array(counts))
+                  for hand, maps in heatmap.maps.items()
+                  for pitchType, counts in maps.items()]
+        code = self.register_batters([batterId])[0]
+        self.counts[code] = 0
+        versions = self.versions.setdefault(code, {})
+        keys = set(versions)
+        for hand, pitchType, counts in blocks:
+            self.add_block(code, hand, pitchType, counts)
+            keys.add((hand, pitchType))
+        for key in keys:
+            versions[key] = versions.get(key, 0) + 1
+
+    def __contains__(self, batterId):
+        return batterId in self.batterCodes
+
+    def __len__(self):
+        return len(self.batterIds)
+
+    def keys(self):
+        return list(self.batterIds)
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def get(self, batterId, default=None):
+        if batterId in self:
+            return self[batterId]
+        return default
+
+    def items(self):
+        return [(batterId, self[batterId]) for batterId in self.batterIds]
+
+    def values(self):
+        return [heatmap for batterId, heatmap in self.items()]
+
+    def update(self, heatmaps):
+        for batterId, heatmap in heatmaps.items():
+            self[batterId] = heatmap
+
+    @classmethod
+    def from_season(cls, season, dtype=np.uint16):
+        """ Build from a {batterId: HeatMap} dict such as Season.season
+        """
+        league = cls(dtype=dtype)
+        for batterId, heatmap in season.items():
+            league[batterId] = heatmap
+        return league
+
+    def to_season(self):
+        """ Returns a {batterId: HeatMap} dict of independent HeatMaps
+        """
+        return dict((batterId, view.to_heatmap()) for batterId, view in
+                    self.items())
@@ -0,0 +1,157 @@
+from array import array
+from bisect import bisect_left
+from pickle import dump, load
+import numpy as np
+from heatmap import HeatMap
+from reader import PitchReader
+
+
+def day_number(gameDate):
+    """ 20160701 for '2016-07-01 19:05:00', 0 if there is no date
+    """
+    try:
+        return int(gameDate[:10].replace('-', ''))
+    except ValueError:
+        return 0
+
+
+class HeatMapHistory(object):
+    """ Point-in-time heat maps. Every pitch added to a batter's heat map is
+        logged as a compact delta (row, day, map, zone cell, counts) and a
+        snapshot of the batter's maps is kept every spacing deltas, so the
+        heat map as of any row or date is the nearest earlier snapshot plus
+        at most spacing deltas. A smaller spacing answers faster and takes
+        more memory and a larger pickle. It does not limit what is read to
+        answer: dump writes the whole history as one pickle and
+        load_history reads it back in full.
+    """
+    def __init__(self, spacing=256, lastSeason=None):
+        """ lastSeason is an optional dict of heat maps, such as a previous
+            season's, that every batter's history starts from.
+        """
+        self.spacing = spacing
+        self.classifier = HeatMap()
+        self.mapKeys, self.mapCodes = [], {}
+        self.countKeys, self.countCodes = [], {}
+        self.logs = {}
+        self.snapshots = {}
+        self.current = {}
+        self.rowsAdded = 0
+        if lastSeason:
+            for batterId, heatmap in lastSeason.items():
+                self.current[batterId] = dict(
+                    ((hand, pitchType), counts.copy())
+                    for hand, maps in heatmap.maps.items()
+                    for pitchType, counts in maps.items())
+
+    def code(self, keys, codes, key):
+        if key not in codes:
+            codes[key] = len(keys)
+            keys.append(key)
+        return codes[key]
+
+    def add_pitch(self, batterId, row, day, px, pz, pitchType, pitchResult,
+                  paResult, hand):
+        """ Log a pitch the way HeatMap.process_pitch would add it. row is
+            its position in the season and day its day_number; both must
+            not decrease from one pitch to the next.
+        """
+        counts = self.classifier.pitch_counts(pitchType, pitchResult,
+                                              paResult)
+        if counts is None:
+            return
+        i, j = self.classifier.get_location(px, pz)
+        if batterId not in self.logs:
+            self.logs[batterId] = dict((name, array('l')) for name in
+                                       ['rows', 'days', 'maps', 'cells',
+                                        'counts'])
+            self.current.setdefault(batterId, {})
+            self.snapshots[batterId] = [self.copy_maps(
+                self.current[batterId])]
+        log = self.logs[batterId]
+        key = (hand, pitchType)
+        mapCode = self.code(self.mapKeys, self.mapCodes, key)
+        log['rows'].append(row)
+        log['days'].append(day)
+        log['maps'].append(mapCode)
+        log['cells'].append(i * 5 + j)
+        log['counts'].append(self.code(self.countKeys, self.countCodes,
+                                       counts))
+        maps = self.current[batterId]
+        if key not in maps:
+            maps[key] = self.classifier.generate_new_map()
+        for idx, amount in counts:
+            maps[key][idx, i, j] += amount
+        if len(log['rows']) % self.spacing == 0:
+            self.snapshots[batterId].append(self.copy_maps(maps))
+
+    def copy_maps(self, maps):
+        return dict((key, counts.copy()) for key, counts in maps.items())
+
+    def add_file(self, filename, chunksize=100000):
+        """ Log every valid row of a play-by-play file, using the same rules
+            as Season.process_row. Rows are numbered from the first row of
+            the first file added.
+        """
+        reader = PitchReader(filename, extraColumns=['gameDate'])
+        for chunk in reader.chunks(chunksize):
+            for idx in np.flatnonzero(chunk.valid):
+                self.add_pitch(int(chunk['batterId'][idx]),
+                               self.rowsAdded + idx,
+                               day_number(chunk['gameDate'][idx]),
+                               chunk['px'][idx], chunk['pz'][idx],
+                               chunk['pitchType'][idx],
+                               chunk['pitchResult'][idx],
+                               chunk['paResult'][idx],
+                               chunk['pitcherHand'][idx])
+            self.rowsAdded += len(chunk)
+        return self
+
+    def deltas_before(self, batterId, row=None, date=None):
+        """ Number of the batter's logged pitches before row, or before the
+            start of date (a day_number or a date string)
+        """
+        log = self.logs[batterId]
+        if row is not None:
+            return bisect_left(log['rows'], row)
+        if date is not None:
+            if not isinstance(date, int):
+                date = day_number(str(date))
+            return bisect_left(log['days'], date)
+        return len(log['rows'])
+
+    def as_of(self, batterId, row=None, date=None):
+        """ The batter's HeatMap as it was before row, or before any pitch
+            on date, or now, as a copy that can be changed freely. Raises
+            KeyError for a batter with no history.
+        """
+        if batterId not in self.logs:
+            if batterId in self.current:
+                return self.to_heatmap(self.copy_maps(
+                    self.current[batterId]))
+            raise KeyError('No history for batter %s' % batterId)
+        count = self.deltas_before(batterId, row, date)
+        snapshot = count // self.spacing
+        maps = self.copy_maps(self.snapshots[batterId][snapshot])
+        log = self.logs[batterId]
+        for num in range(snapshot * self.spacing, count):
+            key = self.mapKeys[log['maps'][num]]
+            i, j = divmod(log['cells'][num], 5)
+            if key not in maps:
+                maps[key] = self.classifier.generate_new_map()
+            for idx, amount in self.countKeys[log['counts'][num]]:
+                maps[key][idx, i, j] += amount
+        return self.to_heatmap(maps)
+
+    def to_heatmap(self, maps):
+        heatmap = HeatMap()
+        for (hand, pitchType), counts in maps.items():
+            heatmap.maps[hand][pitchType] = counts
+        return heatmap
+
+    def dump(self, output):
+        dump(self, open(output, 'wb'), protocol=2)
+
+
+def load_history(filename):
+    return load(open(filename, 'rb'))
@@ -0,0 +1,155 @@
+import os
+import numpy as np
+import pandas as pd
+from batters import Batters
+from run_console import create_df
+
+
+class Leaderboards(object):
+    """ Top and bottom N batters for every metric of the Batters tables,
+        overall and split by pitcher hand, pitch type and count. Results are
+        cached and only recomputed when the processed data changes.
+    """
+    splits = ['pitcherHand', 'pitchType', 'count']
+    tables = ['value', 'count', 'mean']
+
+    def __init__(self, batters=None, source=None, minPA=None):
+        """ Either pass a Batters object, or the processed CSV as source to
+            have it reloaded whenever the file changes.
+        """
+        assert batters is not None or source
+        self.batters = batters
+        self.source = source
+        self.minPA = minPA
+        self.version = None
+        self.hashed = (None, None)
+        self.cache = {}
+        self.splitTables = {}
+        self.check()
+
+    def fingerprint(self):
+        """ Identifies the underlying processed data: the size and
+            modification time of the file, or of every file in a columnar
+            directory, or a hash of the Batters DataFrame.
+        """
+        if self.source:
+            paths = [self.source]
+            if os.path.isdir(self.source):
+                # Rewriting the columns in place leaves the directory as is
+                paths = [os.path.join(self.source, x) for x in
+                         sorted(os.listdir(self.source))]
+            stats = [(path, os.stat(path)) for path in paths]
+            return tuple((path, stat.st_size, stat.st_mtime)
+                         for path, stat in stats)
+        df = self.batters.df
+        if self.hashed[0] is not df:
+            self.hashed = (df, pd.util.hash_pandas_object(df).sum())
+        return self.hashed[1]
+
+    def check(self):
+        """ Clear the caches if the processed data has changed
+        """
+        version = self.fingerprint()
+        if version != self.version:
+            if self.source:
+                self.batters = Batters(create_df(self.source),
+                                       minPA=self.minPA)
+            self.cache = {}
+            self.splitTables = {}
+            self.version = version
+
+    def invalidate(self):
+        """ Clear the caches, for example after changing batters.df in place
+        """
+        self.version = None
+        self.batters.tables = None
+        self.batters.samples = {}
+        self.check()
+
+    def split_labels(self, split):
+        df = self.batters.df
+        if split == 'count':
+            return (df['balls'].astype(str) + '-' +
+                    df['strikes'].astype(str))
+        return df[split]
+
+    def get_tables(self, split=None, value=None):
+        """ The (value, count, mean) tables overall or for one split value.
+            All values of a split are computed together.
+        """
+        if split is None:
+            return self.batters.aggregate()
+        assert split in self.splits
+        if value not in self.split_values(split):
+            raise KeyError('No %s split %s' % (split, value))
+        return self.splitTables[split][value]
+
+    def split_values(self, split):
+        """ Values of a split that have at least one board
+        """
+        self.check()
+        if split not in self.splitTables:
+            self.splitTables[split] = self.batters.aggregate_split(
+                self.split_labels(split))
+        return sorted(self.splitTables[split])
+
+    def select(self, series, n, top=True):
+        """ Returns the n largest (or smallest) non-null values of series in
+            order, using a partial selection rather than a full sort.
+        """
+        series = series.dropna()
+        values = series.values if top else -series.values
+        n = min(n, len(values))
+        if n == 0:
+            return series.iloc[:0]
+        idx = np.sort(np.argpartition(-values, n - 1)[:n])
+        idx = idx[np.argsort(-values[idx], kind='mergesort')]
+        return series.iloc[idx]
+
+    def board(self, metric, n=20, top=True, table='value', split=None,
+              value=None):
+        """ Returns the top (or bottom) n batters for a metric, such as
+            'NetTotal', of the value, count or mean table, overall or for a
+            split value, as a Series.
+        """
+        self.check()
+        key = (metric, n, top, table, split, value)
+        if key not in self.cache:
+            tables = self.get_tables(split, value)
+            df = tables[self.tables.index(table)]
+            column = metric if table == 'value' else metric + '_' + table
+            self.cache[key] = self.select(df[column], n, top)
+        return self.cache[key]
+
+    def all_boards(self, n=20):
+        """ Materialize the top and bottom n boards of every metric of every
+            table, overall and for every split value. Returns a dict keyed
+            by (metric, top, table, split, value).
+        """
+        boards = {}
+        groups = [(None, None)]
+        for split in self.splits:
+            groups += [(split, value) for value in self.split_values(split)]
+        for split, value in groups:
+            for table in self.tables:
+                for metric in self.batters.metrics:
+                    for top in [True, False]:
+                        boards[(metric, top, table, split, value)] = \
+                            self.board(metric, n, top, table, split, value)
+        return boards
+
+    def write(self, directory, n=20):
+        """ Write every board to its own CSV file in directory
+        """
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        for key, board in self.all_boards(n).items():
+            board.to_csv(os.path.join(directory, self.filename(key, n)))
+
+    def filename(self, key, n):
+        metric, top, table, split, value = key
+        name = metric.replace('|', '_given_') + '_%s_%s_%d' % (
+            table, 'top' if top else 'bottom', n)
+        if split:
+            name += '_%s_%s' % (split, value)
+        return name + '.csv'
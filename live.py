@@ -0,0 +1,278 @@
+""" Live pitch feed scoring.
+
+    Pitch events are CSV rows with the same columns as the play-by-play
+    files. Each one is scored against the batter's current heat map, added
+    to Season.season and published with its scoring latency.
+
+    Serve a feed on a local socket, then replay a file into it:
+        python live.py serve --port 9999 --last-season data/heatmaps_2015.pickle
+        python live.py replay tests/2016-WS.csv --port 9999 --speed 10
+
+    The server starts from --last-season heat maps (a pickle or a heat map
+    store) or those of the latest checkpoint in --checkpoints, and saves
+    the updated heat maps to --save when it stops.
+
+    A client sends the CSV header line followed by rows and receives one
+    line of JSON per row.
+"""
+import argparse
+import csv
+import json
+import signal
+import socket
+import SocketServer
+import sys
+import threading
+import time
+from collections import deque
+from Queue import Queue
+from timeit import default_timer
+
+from season import Season
+from reader import PitchReader
+
+
+class LiveScorer(object):
+    """ Scores pitch events one at a time against a Season. Events from
+        several threads are serialized so heat maps are updated in the
+        order events arrive. publish is called with each scored event.
+    """
+    def __init__(self, season, header=None, publish=None, window=10000):
+        """ window is the number of recent latencies kept for percentiles
+        """
+        self.season = season
+        self.header = None
+        if header:
+            self.set_header(header)
+        self.publish = publish
+        self.lock = threading.Lock()
+        self.latencies = deque(maxlen=window)
+        self.events = 0
+        self.skipped = 0
+
+    def parse_header(self, header):
+        if isinstance(header, str):
+            header = next(csv.reader([header]))
+        return header
+
+    def set_header(self, header):
+        self.header = self.parse_header(header)
+
+    def score(self, line, received=None, header=None):
+        """ Score one CSV line then add it to the batter's heat map.
+            received is when the event arrived, by default now. Returns the
+            event dict, which has a skipped reason for rows that cannot be
+            scored.
+        """
+        return self.score_row(next(csv.reader([line])), received, header)
+
+    def score_row(self, row, received=None, header=None):
+        """ score for a row already parsed into fields
+        """
+        if received is None:
+            received = default_timer()
+        header = header or self.header
+        season = self.season
+        with self.lock:
+            if season.header is not header:
+                season.set_header(header)
+            try:
+                season.process_row(row)
+                prior, swing, take = season.generate_new_cols()
+            except ValueError as e:
+                self.skipped += 1
+                return {'skipped': str(e)}
+            except IndexError:
+                self.skipped += 1
+                return {'skipped': 'row has too few fields'}
+            except KeyError:
+                self.skipped += 1
+                return {'skipped': 'state not in the run expectancy tables'}
+            season.process_batter(*season.get_process_batter_params())
+            event = {'batterId': season.batterId,
+                     'runExpPrior': float(prior),
+                     'runExpSwing': float(swing) if swing else None,
+                     'runExpTake': float(take) if take else None,
+                     'blankReason': season.blankReason}
+            event['latency'] = default_timer() - received
+            self.latencies.append(event['latency'])
+            self.events += 1
+        if self.publish:
+            self.publish(event)
+        return event
+
+    def latency_stats(self):
+        """ Mean, median, 99th percentile and max of the recent latencies,
+            in seconds.
+        """
+        latencies = sorted(self.latencies)
+        if not latencies:
+            return {'events': self.events, 'skipped': self.skipped}
+        n = len(latencies)
+        return {'events': self.events, 'skipped': self.skipped,
+                'mean': sum(latencies) / n,
+                'median': latencies[n // 2],
+                'p99': latencies[min(n - 1, int(n * 0.99))],
+                'max': latencies[-1]}
+
+
+class QueueFeed(threading.Thread):
+    """ Scores lines put on a queue in a background thread, for feeds
+        within the same process.
+    """
+    def __init__(self, scorer, queue=None):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.scorer = scorer
+        self.queue = queue or Queue()
+
+    def put(self, line):
+        self.queue.put((default_timer(), line))
+
+    def run(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                break
+            received, line = item
+            self.scorer.score(line, received)
+
+    def stop(self):
+        """ Score everything already queued then stop
+        """
+        self.queue.put(None)
+        self.join()
+
+
+class FeedHandler(SocketServer.StreamRequestHandler):
+    """ Reads a header row then rows, replying with a JSON line per row.
+        Rows are parsed as CSV from the stream, so quoted fields may span
+        lines.
+    """
+    def handle(self):
+        scorer = self.server.scorer
+        header = None
+        for row in csv.reader(iter(self.rfile.readline, '')):
+            received = default_timer()
+            if not row:
+                continue
+            if header is None:
+                header = row
+                continue
+            event = scorer.score_row(row, received, header)
+            self.wfile.write(json.dumps(event, sort_keys=True) + '\n')
+            self.wfile.flush()
+
+
+class FeedServer(SocketServer.ThreadingMixIn, SocketServer.TCPServer):
+    allow_reuse_address = True
+    daemon_threads = True
+
+    def __init__(self, address, scorer):
+        SocketServer.TCPServer.__init__(self, address, FeedHandler)
+        self.scorer = scorer
+
+
+def replay(filename, send, speed=None, interval=22.0):
+    """ Feed filename's rows, header first, to send. Files have no pitch
+        times, so real speed is one pitch every interval seconds; speed
+        divides that, and None sends as fast as possible. Returns the number
+        of rows sent.
+    """
+    rows = 0
+    start = time.time()
+    reader = PitchReader(filename)
+    send(reader.headerLine)
+    for line, row in reader:
+        if speed:
+            delay = start + rows * interval / speed - time.time()
+            if delay > 0:
+                time.sleep(delay)
+        send(line)
+        rows += 1
+    return rows
+
+
+def replay_socket(filename, address, speed=None, interval=22.0, out=None):
+    """ Replay filename to a FeedServer, writing replies to out
+    """
+    conn = socket.create_connection(address)
+    replies = conn.makefile('r')
+    reader = threading.Thread(target=copy_lines, args=(replies, out))
+    reader.daemon = True
+    reader.start()
+    rows = replay(filename, conn.sendall, speed, interval)
+    conn.shutdown(socket.SHUT_WR)
+    reader.join()
+    conn.close()
+    return rows
+
+
+def copy_lines(source, out):
+    for line in iter(source.readline, ''):
+        if out:
+            out.write(line)
+
+
+def live_season(hits, count, lastSeason=None, checkpointDir=None):
+    """ Season to score a feed with, starting from lastSeason's heat maps
+        or those of the latest checkpoint in checkpointDir
+    """
+    season = Season(hits, count, lastSeason=lastSeason)
+    if checkpointDir and season.load_checkpoint(checkpointDir) is None:
+        raise ValueError('No checkpoints in %s' % checkpointDir)
+    return season
+
+
+def stop_serving(signum, frame):
+    raise KeyboardInterrupt
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('mode', choices=['serve', 'replay'])
+    parser.add_argument('filename', nargs='?',
+                        help='play-by-play CSV file to replay')
+    parser.add_argument('--host', default='localhost')
+    parser.add_argument('--port', type=int, default=9999)
+    parser.add_argument('--speed', type=float,
+                        help='replay speed relative to real time, '
+                             'default as fast as possible')
+    parser.add_argument('--interval', type=float, default=22.0,
+                        help='real seconds between pitches')
+    parser.add_argument('--hits', default='data/run_exp_hits_2015.pickle')
+    parser.add_argument('--count', default='data/run_exp_count_2015.pickle')
+    parser.add_argument('--last-season',
+                        help='heat maps to start from, a pickle or a heat '
+                             'map store directory')
+    parser.add_argument('--checkpoints',
+                        help='start from the heat maps of the latest '
+                             'checkpoint in this directory')
+    parser.add_argument('--save', default='data/heatmaps_live.pickle',
+                        help='where to save the heat maps on exit, a pickle '
+                             'or a directory for a heat map store')
+    args = parser.parse_args(argv)
+
+    if args.mode == 'replay':
+        replay_socket(args.filename, (args.host, args.port), args.speed,
+                      args.interval, sys.stdout)
+        return 0
+    season = live_season(args.hits, args.count, args.last_season,
+                         args.checkpoints)
+    scorer = LiveScorer(season)
+    server = FeedServer((args.host, args.port), scorer)
+    signal.signal(signal.SIGTERM, stop_serving)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    server.server_close()
+    with scorer.lock:
+        season.save_heatmaps(args.save)
+    sys.stderr.write(json.dumps(scorer.latency_stats(), sort_keys=True) +
+                     '\n')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
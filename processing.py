@@ -1,12 +1,70 @@
+import argparse
+from pickle import dump
 from season import Season
+from reader import PitchReader
+from run_expectancy import RunExpectancyBuilder
 
 run_exp_hits = 'data/run_exp_hits_2015.pickle'
 run_exp_count = 'data/run_exp_count_2015.pickle'
 heatmap = 'data/heatmaps_2015.pickle'
 
-season = Season(run_exp_hits, run_exp_count, lastSeason=heatmap)
-
 filename = 'data/2016.csv'
 output_file = 'data/2016_processed.csv'
+# Rows already processed on an earlier run are skipped, delete this directory
+# to reprocess the whole season
+checkpoint_dir = 'data/checkpoints_2016'
+
+# Outputs of the single scan build
+count_output = 'data/run_exp_count_2016.pickle'
+hits_output = 'data/run_exp_hits_2016.pickle'
+heatmap_output = 'data/heatmaps_2016.pickle'
+
+
+def build_season(season, filename, output, countOutput, hitsOutput,
+                 heatmapOutput):
+    """ Build everything a season produces from one scan of filename: the
+        processed CSV scored by season, the count and hits run expectancy
+        tables and the end of season heat maps, saved as
+        run_expectancy_count, run_expectancy_hits and process_season do.
+        Like process_season's, the heat maps are season's own, so they
+        include the counts of its lastSeason as well as this file's.
+        Returns the RunExpectancyBuilder.
+    """
+    season.reader = PitchReader(filename)
+    season.set_header(season.reader.header)
+    builder = RunExpectancyBuilder(season.reader.header)
+    out = open(output, 'w')
+    out.write(season.reader.headerLine.strip() +
+              ',runExpPrior,runExpSwing,runExpTake\n')
+    for line, row in season.reader:
+        try:
+            builder.add_row(row)
+        except IndexError:
+            pass
+        newLine = season.process_line(line, row)
+        if newLine is not None:
+            out.write(newLine)
+    out.close()
+    dump(builder.count_table().finalize(), open(countOutput, 'w'))
+    hits = builder.hits_table().finalize()
+    hits.fillna(0, inplace=True)
+    dump(hits, open(hitsOutput, 'w'))
+    season.save_heatmaps(heatmapOutput)
+    return builder
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--build', action='store_true',
+                        help='reprocess the whole season in one scan, also '
+                             'writing its run expectancy tables and heat '
+                             'maps')
+    args = parser.parse_args()
 
-season.process_file(filename, output_file)
\ No newline at end of file
+    season = Season(run_exp_hits, run_exp_count, lastSeason=heatmap)
+    if args.build:
+        build_season(season, filename, output_file, count_output,
+                     hits_output, heatmap_output)
+    else:
+        season.process_file(filename, output_file,
+                            checkpointDir=checkpoint_dir)
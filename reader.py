@@ -0,0 +1,176 @@
+import csv
+import time
+import numpy as np
+
+
+def is_true(value):
+    return value == 'TRUE'
+
+
+class PitchChunk(object):
+    """ A block of rows from a play-by-play file decoded into typed arrays.
+        lines holds the raw text of each row, valid marks the rows
+        Season.process_row would accept and reasons maps the others to why
+        they were rejected.
+    """
+    def __init__(self, lines, columns, reasons):
+        self.lines = lines
+        self.columns = columns
+        self.valid = columns.pop('valid')
+        self.reasons = reasons
+
+    def __len__(self):
+        return len(self.lines)
+
+    def __getitem__(self, key):
+        return self.columns[key]
+
+
+class PitchReader(object):
+    """ Streams a play-by-play CSV file. Column positions are resolved once
+        from the header and rows are decoded with the csv module, so quoted
+        fields such as atbatDesc are handled correctly.
+    """
+    intColumns = ['batterId', 'outs', 'balls', 'strikes']
+    floatColumns = ['px', 'pz', 'probCalledStrike']
+    boolColumns = ['manOnFirst', 'manOnSecond', 'manOnThird']
+    strColumns = ['pitchType', 'pitchResult', 'paResult', 'pitcherHand']
+    # Rejection reasons, matching the errors raised by Season.process_row
+    reasons = {'batterId': 'batterId has no value',
+               'px': 'px and/or pz have no value',
+               'pz': 'px and/or pz have no value',
+               'outs': 'outs, balls and/or strikes have no value',
+               'balls': 'outs, balls and/or strikes have no value',
+               'strikes': 'outs, balls and/or strikes have no value',
+               'probCalledStrike': 'probCalledStrike has no value'}
+
+    def __init__(self, filename, offset=None, extraColumns=None, end=None):
+        """ offset is a byte position, such as a previous reader's
+            offset, to start reading rows from. extraColumns are further
+            columns for chunks to hold as strings. end is a byte position
+            to stop at, such as the size of a file still being appended to
+            when it was opened; a last row not complete by then, without
+            its newline or with a quote left open, is left unread.
+        """
+        self.filename = filename
+        self.extraColumns = list(extraColumns or [])
+        self.end = end
+        self.file = open(filename, 'r')
+        self.lines = []
+        self.offset = 0
+        self.reader = csv.reader(self.read_lines())
+        self.header = next(self.reader)
+        self.headerLine = self.pop_line()
+        self.columns = dict((key, num) for num, key in
+                            enumerate(self.header))
+        if offset:
+            self.file.seek(offset)
+            self.offset = offset
+        self.rowsRead = 0
+        self.lastRow = None
+        self.start = time.time()
+        self.stop = None
+
+    def read_lines(self):
+        # readline rather than iteration so offsets match file positions
+        while True:
+            if self.end is None:
+                line = self.file.readline()
+            else:
+                line = self.file.readline(max(self.end - self.file.tell(), 0))
+            if not line:
+                break
+            self.lines.append(line)
+            yield line
+
+    def complete(self):
+        """ Whether the raw text of the row just parsed is a whole row
+        """
+        line = ''.join(self.lines)
+        return line.endswith('\n') and line.count('"') % 2 == 0
+
+    def pop_line(self):
+        """ Returns the raw text of the row just parsed
+        """
+        line = ''.join(self.lines)
+        self.lines = []
+        self.offset += len(line)
+        return line
+
+    def position(self, key):
+        if key not in self.columns:
+            raise KeyError('%s has no column %s' % (self.filename, key))
+        return self.columns[key]
+
+    def __iter__(self):
+        """ Yields (raw line, parsed row) pairs
+        """
+        for row in self.reader:
+            if self.end is not None and not self.complete():
+                break
+            self.rowsRead += 1
+            self.lastRow = row
+            yield self.pop_line(), row
+        self.close()
+
+    def chunks(self, chunksize):
+        """ Yields PitchChunks of up to chunksize rows. Only one chunk is
+            held in memory at a time.
+        """
+        lines, rows = [], []
+        for line, row in self:
+            lines.append(line)
+            rows.append(row)
+            if len(rows) == chunksize:
+                yield self.decode(lines, rows)
+                lines, rows = [], []
+        if rows:
+            yield self.decode(lines, rows)
+
+    def decode(self, lines, rows):
+        """ Decode rows into typed arrays using the same rules as
+            Season.process_row.
+        """
+        n = len(rows)
+        columns = {'valid': np.ones(n, dtype=bool)}
+        for key in self.intColumns + self.floatColumns:
+            columns[key] = np.zeros(n, dtype=int if key in self.intColumns
+                                    else float)
+        for key in self.boolColumns:
+            columns[key] = np.zeros(n, dtype=bool)
+        for key in self.strColumns + self.extraColumns:
+            columns[key] = np.empty(n, dtype=object)
+        converters = [(key, int) for key in self.intColumns]
+        converters += [(key, float) for key in self.floatColumns]
+        converters += [(key, is_true) for key in self.boolColumns]
+        converters += [(key, str) for key in
+                       self.strColumns + self.extraColumns]
+        converters = [(key, columns[key], self.position(key), convert)
+                      for key, convert in converters]
+        reasons = {}
+        for num, row in enumerate(rows):
+            try:
+                for key, column, pos, convert in converters:
+                    column[num] = convert(row[pos])
+            except ValueError:
+                columns['valid'][num] = False
+                reasons[num] = self.reasons[key]
+            except IndexError:
+                columns['valid'][num] = False
+                reasons[num] = 'row has too few fields'
+        return PitchChunk(lines, columns, reasons)
+
+    @property
+    def elapsed(self):
+        return (self.stop or time.time()) - self.start
+
+    @property
+    def rate(self):
+        """ Rows read per second
+        """
+        return self.rowsRead / max(self.elapsed, 1e-9)
+
+    def close(self):
+        if self.stop is None:
+            self.stop = time.time()
+        self.file.close()
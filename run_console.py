@@ -1,11 +1,19 @@
 import pandas as pd
 from batters import Batters
+from columnar import ColumnarStore, is_columnar
 
 def create_df(filename):
-    df = pd.read_csv(filename)
+    """ filename is a processed CSV file, or a directory written with
+        Season.process_file(columnar=...) whose columns are memory mapped
+    """
     cols = ['batter', 'batterId', 'probCalledStrike', 'runExpPrior',
-            'runExpSwing', 'runExpTake', 'pitchResult', 'paResult']
-    df = df[cols]
+            'runExpSwing', 'runExpTake', 'pitchResult', 'paResult',
+            'pitcherHand', 'pitchType', 'balls', 'strikes', 'gameDate']
+    if is_columnar(filename):
+        df = ColumnarStore(filename).frame(cols)
+    else:
+        df = pd.read_csv(filename)
+        df = df[cols]
     swings = ['IP', 'SS', 'F', 'FT', 'MB']
     takes = ['B', 'SL', 'BID']
     df['swing'] = df['pitchResult'].isin(swings)
@@ -17,11 +25,6 @@ def create_df(filename):
     df['dSwingTake'] = df['runExpSwing'] - df['runExpTake']
     return df
 
-csv = 'data/2016_processed.csv'
-df = create_df(csv)
-
-batters = Batters(df, minPA=500)
-
 def create_leaderboard(name, df, n, top=True, ascending=True):
     if top:
         filename = 'leaderboard/' + name + '_top_%s.csv' % (n)
@@ -29,3 +32,9 @@ def create_leaderboard(name, df, n, top=True, ascending=True):
         filename = 'leaderboard/' + name + '_bottom_%s.csv' % (n)
     (df.set_index('batter_name')[name].sort_values(ascending=ascending).
      head(n).to_csv(filename))
+
+if __name__ == '__main__':
+    csv = 'data/2016_processed.csv'
+    df = create_df(csv)
+
+    batters = Batters(df, minPA=500)
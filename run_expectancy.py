@@ -1,6 +1,9 @@
-from pandas import read_csv
-from numpy import mean
+from pandas import read_csv, DataFrame, MultiIndex
+import numpy as np
 from pickle import dump, load
+from collections import OrderedDict
+from sys import getsizeof
+from array import array
 
 class RunExpectancy(object):
     def __init__(self, bases_file, count_file):
@@ -8,6 +11,58 @@ class RunExpectancy(object):
         self.runExpBases = load(open(bases_file, 'r'))
         # These values are for bitwise operations
         self.hits = {'S': 1, 'D': 2, 'T': 4, 'HR': 8}
+        # Row of each hit type in the dense hit table
+        self.hitCodes = {'S': 0, 'D': 1, 'T': 2, 'HR': 3}
+        self.countTable = self.compile_count_table(self.runExpCount)
+        self.basesTable = self.compile_bases_table(self.runExpBases)
+        self.hitTable, self.hitBases = self.compile_hit_table()
+        self.outcomeTable = self.compile_outcome_table()
+
+    def base_code(self, first, second, third):
+        """ Encode the base runners as an integer from 0 to 7 with first,
+            second and third as bits 1, 2 and 4.
+        """
+        return int(bool(first)) + 2 * bool(second) + 4 * bool(third)
+
+    def compile_count_table(self, runExpCount):
+        """ Compile the count run expectancy Series into a dense
+            3 outs x 4 balls x 3 strikes x 8 base states array. States
+            missing from the Series are NaN.
+        """
+        table = np.full((3, 4, 3, 8), np.nan)
+        for key, value in runExpCount.iteritems():
+            outs, balls, strikes, first, second, third = key
+            if outs < 3 and balls < 4 and strikes < 3:
+                table[outs, balls, strikes,
+                      self.base_code(first, second, third)] = value
+        return table
+
+    def compile_bases_table(self, runExpBases):
+        """ Compile the hit run expectancy Series into a dense
+            4 hits x 8 base states x 3 outs array. States missing from the
+            Series are NaN.
+        """
+        table = np.full((4, 8, 3), np.nan)
+        for key, value in runExpBases.iteritems():
+            hit, first, second, third, outs = key
+            if hit in self.hitCodes and outs < 3:
+                table[self.hitCodes[hit], self.base_code(first, second, third),
+                      outs] = value
+        return table
+
+    def lookup(self, table, name, *idx):
+        """ Returns table[idx], raising a KeyError naming the state if it
+            is out of range or missing from the source table.
+        """
+        try:
+            if min(idx) < 0:
+                raise IndexError
+            value = table[idx]
+        except IndexError:
+            value = np.nan
+        if value != value:
+            raise KeyError('No run expectancy in %s table for %s' % (name, idx))
+        return value
 
     def exp_runs(self, outs, balls, strikes, first, second, third):
         """ Returns the expected runs from the inning at a given point
@@ -16,13 +71,19 @@ class RunExpectancy(object):
         if outs == 3:
             return 0
         else:
-            return self.runExpCount[outs, balls, strikes, first, second, third]
+            return self.lookup(self.countTable,
+                               'count (outs, balls, strikes, bases)', outs,
+                               balls, strikes,
+                               self.base_code(first, second, third))
 
-    def strike_outcomes(self, outs, balls, strikes, first, second, third):
+    def strike_state(self, outs, balls, strikes, first, second, third):
+        """ Returns the state after a strike. A strikeout ending the inning
+            leaves three outs.
+        """
         if outs == 2:
             if strikes == 2:
                 # Strikeout, inning over
-                return 0
+                outs += 1
             else:
                 strikes += 1
         else:
@@ -33,9 +94,15 @@ class RunExpectancy(object):
                 balls = 0
             else:
                 strikes += 1
-        return self.exp_runs(outs, balls, strikes, first, second, third)
+        return outs, balls, strikes, first, second, third
 
-    def ball_outcomes(self, outs, balls, strikes, first, second, third):
+    def strike_outcomes(self, outs, balls, strikes, first, second, third):
+        return self.exp_runs(*self.strike_state(outs, balls, strikes, first,
+                                                second, third))
+
+    def ball_state(self, outs, balls, strikes, first, second, third):
+        """ Returns the runs scored and the state after a ball
+        """
         runs = 0
         if balls == 3:
             first = True
@@ -50,20 +117,32 @@ class RunExpectancy(object):
                 second = True
         else:
             balls += 1
-        return runs + self.exp_runs(outs, balls, strikes, first, second, third)
+        return runs, (outs, balls, strikes, first, second, third)
+
+    def ball_outcomes(self, outs, balls, strikes, first, second, third):
+        runs, state = self.ball_state(outs, balls, strikes, first, second,
+                                      third)
+        return runs + self.exp_runs(*state)
+
+    def out_state(self, outs, balls, strikes, first, second, third):
+        """ Returns the state after a ball in play is caught
+        """
+        # Out, inning over when this is the third
+        outs += 1
+        return outs, balls, strikes, first, second, third
 
     def out_outcomes(self, outs, balls, strikes, first, second, third):
-        if outs == 2:
-            # Out, inning over
-            return 0
-        else:
-            outs += 1
-        return self.exp_runs(outs, balls, strikes, first, second, third)
+        return self.exp_runs(*self.out_state(outs, balls, strikes, first,
+                                             second, third))
 
-    def foul_outcomes(self, outs, balls, strikes, first, second, third):
+    def foul_state(self, outs, balls, strikes, first, second, third):
         if strikes < 2:
             strikes += 1
-        return self.exp_runs(outs, balls, strikes, first, second, third)
+        return outs, balls, strikes, first, second, third
+
+    def foul_outcomes(self, outs, balls, strikes, first, second, third):
+        return self.exp_runs(*self.foul_state(outs, balls, strikes, first,
+                                              second, third))
 
     def adjust_runners(self, first, second, third, runs, hit):
         """ Adjust base runners to reflect the hit and the number of runs
@@ -101,14 +180,102 @@ class RunExpectancy(object):
                         reversed(range(3))]
         raise BaseException('Could not adjust runners in a logical manner')
 
-    def base_outcomes(self, outs, balls, strikes, first, second, third, hit):
-        assert hit in self.hits
-        runs = self.runExpBases[hit, first, second, third, outs]
+    def compile_hit_table(self):
+        """ Enumerate every hit x base state x outs once. Returns the
+            4 x 8 x 3 array of expected runs plus post-hit run expectancy,
+            and the matching array of post-hit base codes. Entries that
+            cannot be scored are NaN and -1.
+        """
+        values = np.full((4, 8, 3), np.nan)
+        bases = np.full((4, 8, 3), -1, dtype=int)
+        for hit, h in self.hitCodes.items():
+            for b in range(8):
+                runners = [bool(b & 1), bool(b & 2), bool(b & 4)]
+                for outs in range(3):
+                    try:
+                        runs, after = self.hit_transition(outs, *(runners +
+                                                                  [hit]))
+                        value = runs + self.exp_runs(outs, 0, 0, *after)
+                    except (KeyboardInterrupt, SystemExit):
+                        raise
+                    except BaseException:
+                        # adjust_runners raises BaseException when the
+                        # runs scored cannot be placed; leave it unscored.
+                        continue
+                    values[h, b, outs] = value
+                    bases[h, b, outs] = self.base_code(*after)
+        return values, bases
+
+    def compile_outcome_table(self):
+        """ Evaluate state_outcomes once for every state code. Returns an
+            array with one row per code, NaN where a state cannot be scored.
+            Rows for three outs hold a prior of 0.
+        """
+        table = np.full((4 * 4 * 3 * 8, 9), np.nan)
+        for code in range(len(table)):
+            state = self.decode_state(code)
+            if state[0] >= 3:
+                table[code, 0] = 0
+                continue
+            try:
+                table[code] = self.state_outcomes(*state)
+            except (KeyError, ValueError):
+                try:
+                    table[code, 0] = self.exp_runs(*state)
+                except KeyError:
+                    pass
+        return table
+
+    def base_outcome_table(self):
+        """ Returns the precomputed hit transitions as a DataFrame indexed
+            by (hit, first, second, third, outs) for inspection.
+        """
+        rows, index = [], []
+        for hit, h in sorted(self.hitCodes.items(), key=lambda x: x[1]):
+            for b in range(8):
+                for outs in range(3):
+                    after = self.hitBases[h, b, outs]
+                    index.append((hit, bool(b & 1), bool(b & 2),
+                                  bool(b & 4), outs))
+                    rows.append([self.basesTable[h, b, outs],
+                                 after >= 0 and bool(after & 1),
+                                 after >= 0 and bool(after & 2),
+                                 after >= 0 and bool(after & 4),
+                                 self.hitTable[h, b, outs]])
+        names = ['hit', 'manOnFirst', 'manOnSecond', 'manOnThird', 'outs']
+        columns = ['runs', 'endManOnFirst', 'endManOnSecond',
+                   'endManOnThird', 'runExp']
+        return DataFrame(rows, columns=columns,
+                         index=MultiIndex.from_tuples(index, names=names))
+
+    def hit_transition(self, outs, first, second, third, hit):
+        """ Returns the expected runs scored on a hit and the base runners
+            afterwards.
+        """
+        runs = self.lookup(self.basesTable, 'hit (hit, bases, outs)',
+                           self.hitCodes[hit],
+                           self.base_code(first, second, third), outs)
         bases = self.adjust_runners(first, second, third, int(round(runs, 0)),
                                     hit)
+        return runs, bases
+
+    def compute_base_outcome(self, outs, first, second, third, hit):
+        runs, bases = self.hit_transition(outs, first, second, third, hit)
         count = self.exp_runs(outs, 0, 0, *bases)
         return runs + count
 
+    def base_outcomes(self, outs, balls, strikes, first, second, third, hit):
+        assert hit in self.hits
+        try:
+            value = self.hitTable[self.hitCodes[hit],
+                                  self.base_code(first, second, third), outs]
+        except IndexError:
+            value = np.nan
+        if value != value or outs < 0:
+            # Not in the table, raise the same error as computing it would
+            return self.compute_base_outcome(outs, first, second, third, hit)
+        return value
+
     def exp_runs_swing(self, outs, balls, strikes, first, second, third,
                        px, pz, pitchType, hand, heatmap):
         """ Returns the expected runs from the inning given the batter
@@ -121,27 +288,24 @@ class RunExpectancy(object):
             P(out|swing) * runExp(out)
             P(foul|swing) * runExp(foul)
         """
-        s = self.base_outcomes(outs, balls, strikes, first, second,
-                                  third, 'S')
-        single = heatmap.prob_single(px, pz, pitchType, hand) * s
-        d  = self.base_outcomes(outs, balls, strikes, first, second,
-                                   third, 'D')
-        double = heatmap.prob_double(px, pz, pitchType, hand) * d
-        t = self.base_outcomes(outs, balls, strikes, first, second,
-                                  third, 'T')
-        triple = heatmap.prob_double(px, pz, pitchType, hand) * t
-        hr = self.base_outcomes(outs, balls, strikes, first, second,
-                                   third, 'HR')
-        homer = heatmap.prob_homer(px, pz, pitchType, hand) * hr
-        miss = heatmap.prob_miss(px, pz, pitchType, hand) * \
-                 self.strike_outcomes(outs, balls, strikes, first, second,
-                                      third)
-        out = heatmap.prob_out(px, pz, pitchType, hand) * \
-                 self.out_outcomes(outs, balls, strikes, first, second,
-                                      third)
-        foul = heatmap.prob_foul(px, pz, pitchType, hand) * \
-                 self.foul_outcomes(outs, balls, strikes, first, second,
-                                      third)
+        probs = heatmap.outcome_distribution(px, pz, pitchType, hand)
+        return self.exp_runs_swing_probs(outs, balls, strikes, first, second,
+                                         third, probs)
+
+    def exp_runs_swing_probs(self, outs, balls, strikes, first, second,
+                             third, probs):
+        """ exp_runs_swing given the swing outcome probabilities from
+            HeatMap.outcome_distribution.
+        """
+        state = (outs, balls, strikes, first, second, third)
+        single = probs[0] * self.base_outcomes(*(state + ('S',)))
+        double = probs[1] * self.base_outcomes(*(state + ('D',)))
+        # Triples have always been weighted by P(double|swing)
+        triple = probs[1] * self.base_outcomes(*(state + ('T',)))
+        homer = probs[3] * self.base_outcomes(*(state + ('HR',)))
+        miss = probs[4] * self.strike_outcomes(*state)
+        out = probs[5] * self.out_outcomes(*state)
+        foul = probs[6] * self.foul_outcomes(*state)
         run_exp = sum([single, double, triple, homer, miss, out, foul])
         return run_exp
 
@@ -159,43 +323,356 @@ class RunExpectancy(object):
                                       third)
         return (probStrike*strikeRuns) + (probBall * ballRuns)
 
+    def state_codes(self, outs, balls, strikes, first, second, third):
+        """ Encode arrays of game states as integer codes:
+            ((outs * 4 + balls) * 3 + strikes) * 8 + base state, where the
+            base state has first, second and third as bits 1, 2 and 4.
+        """
+        outs, balls, strikes = [np.asarray(x, dtype=int) for x in
+                                (outs, balls, strikes)]
+        bases = (np.asarray(first, dtype=int) +
+                 2 * np.asarray(second, dtype=int) +
+                 4 * np.asarray(third, dtype=int))
+        return ((outs * 4 + balls) * 3 + strikes) * 8 + bases
+
+    def decode_state(self, code):
+        """ Inverse of state_codes for a single code. Returns
+            (outs, balls, strikes, first, second, third).
+        """
+        code = int(code)
+        bases, code = code % 8, code // 8
+        strikes, code = code % 3, code // 3
+        balls, outs = code % 4, code // 4
+        return (outs, balls, strikes, bool(bases & 1), bool(bases & 2),
+                bool(bases & 4))
+
+    def state_outcomes(self, outs, balls, strikes, first, second, third):
+        """ Returns the expected runs of every outcome of a pitch for one
+            game state, in the order
+            [prior, single, double, triple, homer, strike, out, foul, ball].
+        """
+        state = (outs, balls, strikes, first, second, third)
+        return [self.exp_runs(*state),
+                self.base_outcomes(*(state + ('S',))),
+                self.base_outcomes(*(state + ('D',))),
+                self.base_outcomes(*(state + ('T',))),
+                self.base_outcomes(*(state + ('HR',))),
+                self.strike_outcomes(*state),
+                self.out_outcomes(*state),
+                self.foul_outcomes(*state),
+                self.ball_outcomes(*state)]
+
+    def score_batch(self, outs, balls, strikes, first, second, third, probs,
+                    probCalledStrike):
+        """ Vectorized runExpPrior, runExpSwing and runExpTake for arrays of
+            pitches.
+            Input: game state arrays, an (n, 7) array of swing outcome
+            probabilities from HeatMap.outcome_distributions and an array of
+            called strike probabilities.
+            Output: three float arrays. runExpSwing and runExpTake are NaN
+            where the scalar methods would raise (three outs, states missing
+            from the tables or no swings recorded at that location). All
+            three are NaN for counts out of range, such as four balls.
+        """
+        outs, balls, strikes = [np.asarray(x, dtype=int) for x in
+                                (outs, balls, strikes)]
+        # Out of range counts would otherwise encode as another state
+        valid = ((outs >= 0) & (outs <= 3) & (balls >= 0) & (balls <= 3) &
+                 (strikes >= 0) & (strikes <= 2))
+        codes = self.state_codes(outs, balls, strikes, first, second, third)
+        probs = np.asarray(probs, dtype=float).reshape(len(codes), 7)
+        probStrike = np.asarray(probCalledStrike, dtype=float)
+        values = self.outcomeTable[np.where(valid, codes, 0)]
+        values[~valid] = np.nan
+        # Sum in the same order as exp_runs_swing so results are identical.
+        # As there, triples are weighted by P(double|swing).
+        runExpSwing = np.zeros(len(codes))
+        for col, idx in [(1, 0), (2, 1), (3, 1), (4, 3), (5, 4), (6, 5),
+                         (7, 6)]:
+            runExpSwing += probs[:, idx] * values[:, col]
+        probBall = 1 - probStrike
+        runExpTake = (probStrike * values[:, 5]) + (probBall * values[:, 8])
+        return values[:, 0], runExpSwing, runExpTake
+
+class SwingCache(object):
+    """ Bounded LRU cache in front of RunExpectancy.exp_runs_swing. Entries
+        are keyed on the game state, zone cell, pitch type, hand, batter and
+        the version of that batter's (hand, pitchType) heat map, so they go
+        stale exactly when HeatMap.process_pitch changes the map.
+    """
+    # Rough per-entry overhead of the OrderedDict and tuples, in bytes
+    entryOverhead = 200
+
+    def __init__(self, runExp, maxBytes=64 * 2 ** 20, maxEntries=None):
+        self.runExp = runExp
+        self.maxBytes = maxBytes
+        self.maxEntries = maxEntries
+        self.entries = OrderedDict()
+        self.bytes = 0
+        self.hits, self.misses, self.evictions = 0, 0, 0
+
+    def entry_size(self, key, value):
+        return (self.entryOverhead + getsizeof(key) + getsizeof(value) +
+                sum(getsizeof(x) for x in key))
+
+    def exp_runs_swing(self, batterId, outs, balls, strikes, first, second,
+                       third, px, pz, pitchType, hand, heatmap):
+        """ exp_runs_swing for the batter's heatmap, from the cache when
+            possible. A ZeroDivisionError is cached and raised again.
+        """
+        i, j = heatmap.get_location(px, pz)
+        key = (batterId, heatmap.version(hand, pitchType), outs, balls,
+               strikes, first, second, third, i, j, pitchType, hand)
+        entries = self.entries
+        if key in entries:
+            value = entries.pop(key)
+            entries[key] = value
+            self.hits += 1
+        else:
+            self.misses += 1
+            try:
+                value = self.runExp.exp_runs_swing(outs, balls, strikes,
+                                                   first, second, third, px,
+                                                   pz, pitchType, hand,
+                                                   heatmap)
+            except ZeroDivisionError:
+                value = None
+            self.add(key, value)
+        if value is None:
+            raise ZeroDivisionError('no swings recorded for this location')
+        return value
+
+    def add(self, key, value):
+        self.entries[key] = value
+        self.bytes += self.entry_size(key, value)
+        while self.entries and (self.bytes > self.maxBytes or
+                                (self.maxEntries and
+                                 len(self.entries) > self.maxEntries)):
+            oldKey, oldValue = self.entries.popitem(last=False)
+            self.bytes -= self.entry_size(oldKey, oldValue)
+            self.evictions += 1
+
+    def clear(self):
+        self.entries.clear()
+        self.bytes = 0
+
+    def stats(self):
+        """ Cache counters as a dict
+        """
+        return {'hits': self.hits, 'misses': self.misses,
+                'evictions': self.evictions, 'entries': len(self.entries),
+                'bytes': self.bytes, 'maxBytes': self.maxBytes}
+
+
+class RunExpectancyTable(object):
+    """ Run expectancy table stored as weighted sum and count accumulators
+        indexed by game state, so tables from several files or seasons can
+        be merged and updated without rereading the raw data. finalize()
+        gives the mean Series RunExpectancy loads.
+    """
+    def __init__(self, keys, name, sums=None, counts=None):
+        self.keys = list(keys)
+        self.name = name
+        self.sums = sums
+        self.counts = counts
+
+    def update(self, df, weight=1.0):
+        """ Add the rows of a DataFrame holding the key columns and the
+            value column. Returns self.
+        """
+        grouped = df.groupby(self.keys)[self.name]
+        sums = grouped.agg('sum') * weight
+        counts = grouped.agg('count') * weight
+        if self.sums is None:
+            self.sums, self.counts = sums, counts
+        else:
+            self.sums = self.sums.add(sums, fill_value=0)
+            self.counts = self.counts.add(counts, fill_value=0)
+        return self
+
+    def merge(self, other, weight=1.0):
+        """ Returns a new table combining this one with other, whose sums
+            and counts are scaled by weight.
+        """
+        assert self.keys == other.keys and self.name == other.name
+        table = RunExpectancyTable(self.keys, self.name, self.sums,
+                                   self.counts)
+        if other.sums is None:
+            return table
+        if table.sums is None:
+            table.sums = other.sums * weight
+            table.counts = other.counts * weight
+        else:
+            table.sums = table.sums.add(other.sums * weight, fill_value=0)
+            table.counts = table.counts.add(other.counts * weight,
+                                            fill_value=0)
+        return table
+
+    def finalize(self):
+        """ Returns the mean of each state as a Series
+        """
+        run_exp = (self.sums / self.counts).sort_index()
+        run_exp.index.names = self.keys
+        run_exp.name = self.name
+        return run_exp
+
+    def dump(self, output):
+        dump(self, open(output, 'w'))
+
+
 # Generate run expectancy tables
+COUNT_KEYS = ['outs', 'balls', 'strikes', 'manOnFirst', 'manOnSecond',
+              'manOnThird']
+HITS_KEYS = ['paResult', 'manOnFirst', 'manOnSecond', 'manOnThird', 'outs']
+
+
+def count_frame(df):
+    """ Returns the columns of a play-by-play DataFrame needed for the count
+        table, with the runs scored in each pitch's whole half-inning.
+    """
+    runsHome = df['runsHome'].fillna(0)
+    runs = runsHome.groupby([df['gameString'], df['inning'],
+                             df['side']]).transform(sum)
+    df_min = df[COUNT_KEYS].copy()
+    df_min['runs'] = runs
+    return df_min
+
+
+def hits_frame(df):
+    """ Returns the columns of a play-by-play DataFrame needed for the hits
+        table, restricted to base hits.
+    """
+    hits = ['S', 'D', 'T', 'HR']
+    df_hits = df.loc[df['paResult'].isin(hits), HITS_KEYS + ['runsHome']]
+    df_hits = df_hits.copy()
+    df_hits['runsHome'] = df_hits['runsHome'].fillna(0)
+    return df_hits
+
+
+class RunExpectancyBuilder(object):
+    """ Accumulates the count and hits tables one raw CSV row at a time, so
+        they can be built during a scan that also does other work. States
+        are kept in compact arrays and runs per half-inning in a dict; the
+        tables match those built from read_csv.
+    """
+    def __init__(self, header):
+        self.columns = dict((key, num) for num, key in enumerate(header))
+        self.outs = array('b')
+        self.balls = array('b')
+        self.strikes = array('b')
+        self.bases = array('b')
+        self.halfInnings = array('l')
+        self.halfInningCodes = {}
+        self.halfInningRuns = []
+        self.hits = []
+
+    def get(self, row, key):
+        return row[self.columns[key]]
+
+    def is_true(self, value):
+        return value.lower() == 'true'
+
+    def add_row(self, row):
+        """ Add a row. Raises IndexError, adding nothing, if the row is
+            missing fields.
+        """
+        get = self.get
+        try:
+            runs = float(get(row, 'runsHome'))
+        except ValueError:
+            runs = 0.0
+        if runs != runs:
+            runs = 0.0
+        key = (get(row, 'gameString'), get(row, 'inning'), get(row, 'side'))
+        first = self.is_true(get(row, 'manOnFirst'))
+        second = self.is_true(get(row, 'manOnSecond'))
+        third = self.is_true(get(row, 'manOnThird'))
+        paResult = get(row, 'paResult')
+        try:
+            outs = int(get(row, 'outs'))
+            balls = int(get(row, 'balls'))
+            strikes = int(get(row, 'strikes'))
+        except ValueError:
+            outs = None
+        code = self.halfInningCodes.get(key)
+        if code is None:
+            code = self.halfInningCodes[key] = len(self.halfInningRuns)
+            self.halfInningRuns.append(0.0)
+        self.halfInningRuns[code] += runs
+        if outs is None:
+            # Missing count: only the half-inning's runs are kept
+            return
+        self.outs.append(outs)
+        self.balls.append(balls)
+        self.strikes.append(strikes)
+        self.bases.append(first + 2 * second + 4 * third)
+        self.halfInnings.append(code)
+        if paResult in ('S', 'D', 'T', 'HR'):
+            self.hits.append((paResult, first, second, third, outs, runs))
+
+    def count_table(self, weight=1.0):
+        """ The count RunExpectancyTable of the rows added so far
+        """
+        bases = np.array(self.bases, dtype=int)
+        runs = np.array(self.halfInningRuns)
+        df = DataFrame({
+            'outs': np.array(self.outs, dtype=int),
+            'balls': np.array(self.balls, dtype=int),
+            'strikes': np.array(self.strikes, dtype=int),
+            'manOnFirst': (bases & 1) > 0,
+            'manOnSecond': (bases & 2) > 0,
+            'manOnThird': (bases & 4) > 0,
+            'runs': runs[np.array(self.halfInnings, dtype=int)]},
+            columns=COUNT_KEYS + ['runs'])
+        return RunExpectancyTable(COUNT_KEYS, 'runs').update(df, weight)
+
+    def hits_table(self, weight=1.0):
+        """ The hits RunExpectancyTable of the rows added so far
+        """
+        df = DataFrame(self.hits, columns=HITS_KEYS + ['runsHome'])
+        return RunExpectancyTable(HITS_KEYS, 'runsHome').update(df, weight)
+
+
+def run_expectancy_count_table(filename, weight=1.0):
+    """ Create the count run expectancy accumulator from play-by-play file
+        Input: filename, weight of this file's pitches
+        Output: RunExpectancyTable
+    """
+    table = RunExpectancyTable(COUNT_KEYS, 'runs')
+    return table.update(count_frame(read_csv(filename)), weight)
+
+
+def run_expectancy_hits_table(filename, weight=1.0):
+    """ Create the hits run expectancy accumulator from play-by-play file
+        Input: filename, weight of this file's pitches
+        Output: RunExpectancyTable
+    """
+    table = RunExpectancyTable(HITS_KEYS, 'runsHome')
+    return table.update(hits_frame(read_csv(filename)), weight)
+
+
 def run_expectancy_count(filename, output=False):
     """ Create Run Expectancies based on count from play-by-play file
         Input: filename
         Output: pickled pandas dataframe
     """
-    df = read_csv(filename)
-    df['runsHome'].fillna(0, inplace=True)
-    runs = df.groupby(['gameString', 'inning', 'side'])['runsHome'].agg(sum)
-    df_runs = df.apply(lambda x: runs[x['gameString'], x['inning'], x['side']],
-                       axis=1)
-    df_runs.name = 'runs'
-    df = df.join(df_runs)
-    df_min = df[['outs', 'balls', 'strikes', 'manOnFirst', 'manOnSecond',
-                'manOnThird', 'runs']]
-    run_exp = df_min.groupby(['outs', 'balls', 'strikes', 'manOnFirst',
-                              'manOnSecond', 'manOnThird'])['runs'].agg(mean)
+    run_exp = run_expectancy_count_table(filename).finalize()
     if output:
         assert type(output) is str
         dump(run_exp, open(output, 'w'))
     else:
         return run_exp
 
+
 def run_expectancy_hits(filename, output=False):
     """ Create Run Expectancies based on hits from play-by-play file
         Input: filename
         Output: pickled pandas dataframe
     """
-    hits = ['S', 'D', 'T', 'HR']
-    df = read_csv(filename)
-    df['runsHome'].fillna(0, inplace=True)
-    df_hits = df[df['paResult'].isin(hits) == True]
-    run_exp = df_hits.groupby(['paResult', 'manOnFirst', 'manOnSecond',
-                               'manOnThird', 'outs'])['runsHome'].agg(mean)
+    run_exp = run_expectancy_hits_table(filename).finalize()
     run_exp.fillna(0, inplace=True)
     if output:
         assert type(output) is str
         dump(run_exp, open(output, 'w'))
     else:
-        return run_exp
\ No newline at end of file
+        return run_exp
@@ -1,29 +1,75 @@
 from pickle import load, dump
-from run_expectancy import RunExpectancy
+from copy import copy
+import os
+import re
+import tempfile
+from heapq import merge
+from multiprocessing import Pool
+import numpy as np
+from run_expectancy import RunExpectancy, SwingCache
 from heatmap import HeatMap
+from reader import PitchReader
+from columnar import ColumnarWriter
+from store import HeatMapStore, LazyHeatMaps, is_store, write_store
+from stats import SeasonStats
 
 class Season(object):
-    def __init__(self, basesFile, countFile, lastSeason=None):
-        if lastSeason:
+    keepCheckpoints = 5
+
+    def __init__(self, basesFile, countFile, lastSeason=None, stats=None,
+                 swingCache=None, entityKeys=None):
+        """ stats is an optional SeasonStats to instrument processing.
+            swingCache is an optional maximum size in bytes of a SwingCache
+            for runExpSwing evaluations. It is off by default: a streaming
+            pass updates the batter's map on every pitch, so it only pays
+            off when rescoring rows against maps that do not change.
+            entityKeys are id columns, such as pitcherId, catcherId and
+            umpireId, to also accumulate heat maps for in self.entities,
+            keyed by column then id. Batter heat maps stay in self.season.
+            lastSeason is a pickle of heat maps or a HeatMapStore
+            directory, whose heat maps are only read when first used.
+        """
+        if lastSeason and is_store(lastSeason):
+            self.season = LazyHeatMaps(HeatMapStore(lastSeason))
+        elif lastSeason:
             self.season = load(open(lastSeason, 'r'))
         else:
             self.season = {}
         self.header = None
+        self.columns = None
+        self.reader = None
         self.runExp = RunExpectancy(basesFile, countFile)
+        self.swingCache = None
+        if swingCache:
+            self.swingCache = SwingCache(self.runExp, maxBytes=swingCache)
         self.batterId, self.px, self.pz = None, None, None
         self.pitchType, self.pitchResult, self.paResult = None, None, None
         self.outs, self.balls, self.strikes = None, None, None
         self.first, self.second, self.third = None, None, None
         self.probCalledStrike, self.hand = None, None
+        self.blankReason = None
+        self.stats = stats
+        self.entityKeys = [x for x in entityKeys or [] if x != 'batterId']
+        self.entities = dict((key, {}) for key in self.entityKeys)
+        self.entityIds = None
+        # Classifies pitches once for every heat map they are added to
+        self.classifier = HeatMap()
 
     def process_batter(self, batterId, px, pz, pitchType, pitchResult,
-                       paResult, hand):
+                       paResult, hand, entityIds=None):
+        """ Add a pitch to the batter's heat map and, with entityKeys, to
+            the heat maps of entityIds, the pitch's ids in those columns.
+            Without entityIds only the batter's heat map is updated.
+        """
         try:
             batterId = int(batterId)
             px, pz = float(px), float(pz)
         except:
             return
-        if batterId in self.season:
+        if self.entityKeys:
+            self.process_entities(batterId, px, pz, pitchType, pitchResult,
+                                  paResult, hand, entityIds)
+        elif batterId in self.season:
             self.season[batterId].process_pitch(px, pz, pitchType, pitchResult,
                                                 paResult, hand)
         else:
@@ -31,13 +77,65 @@ class Season(object):
             self.season[batterId].process_pitch(px, pz, pitchType, pitchResult,
                                                 paResult, hand)
 
+    def process_entities(self, batterId, px, pz, pitchType, pitchResult,
+                         paResult, hand, entityIds):
+        """ process_batter for every entity. The pitch is located and
+            classified once and the result added to each heat map.
+        """
+        if entityIds is None:
+            entityIds = [None] * len(self.entityKeys)
+        heatmaps = []
+        for maps, entityId in zip([self.season] + [self.entities[key] for
+                                                   key in self.entityKeys],
+                                  [batterId] + list(entityIds)):
+            if entityId is None:
+                continue
+            if entityId not in maps:
+                maps[entityId] = HeatMap()
+            heatmaps.append(maps[entityId])
+        counts = self.classifier.pitch_counts(pitchType, pitchResult,
+                                              paResult)
+        if counts is None:
+            return
+        i, j = self.classifier.get_location(px, pz)
+        for heatmap in heatmaps:
+            heatmap.add_counts(i, j, pitchType, hand, counts)
+
+    def entity_id(self, value):
+        try:
+            return int(value)
+        except ValueError:
+            return value or None
+
+    def dump_entities(self, directory, prefix='heatmaps'):
+        """ Pickle each entity's heat maps to its own file in directory,
+            such as heatmaps_pitcherId.pickle. Returns the paths.
+        """
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        paths = []
+        for key in self.entityKeys:
+            path = os.path.join(directory, '%s_%s.pickle' % (prefix, key))
+            dump(self.entities[key], open(path, 'w'))
+            paths.append(path)
+        return paths
+
+    def set_header(self, header):
+        """ Resolve column positions once per file
+        """
+        self.header = header
+        self.columns = dict((key, num) for num, key in enumerate(header))
+
     def get_index(self, row, key):
         assert type(key) is str
         assert self.header
-        return row[self.header.index(key)]
+        return row[self.columns[key]]
 
     def process_row(self, row):
-        self.batterId = int(self.get_index(row, 'batterId'))
+        try:
+            self.batterId = int(self.get_index(row, 'batterId'))
+        except ValueError:
+            raise ValueError('batterId has no value')
         try:
             self.px = float(self.get_index(row, 'px'))
             self.pz = float(self.get_index(row, 'pz'))
@@ -46,14 +144,24 @@ class Season(object):
         self.pitchType = str(self.get_index(row, 'pitchType'))
         self.pitchResult = str(self.get_index(row, 'pitchResult'))
         self.paResult = str(self.get_index(row, 'paResult'))
-        self.outs = int(self.get_index(row, 'outs'))
-        self.balls = int(self.get_index(row, 'balls'))
-        self.strikes = int(self.get_index(row, 'strikes'))
+        try:
+            self.outs = int(self.get_index(row, 'outs'))
+            self.balls = int(self.get_index(row, 'balls'))
+            self.strikes = int(self.get_index(row, 'strikes'))
+        except ValueError:
+            raise ValueError('outs, balls and/or strikes have no value')
         self.first = bool(self.get_index(row, 'manOnFirst') == 'TRUE')
         self.second = bool(self.get_index(row, 'manOnSecond') == 'TRUE')
         self.third = bool(self.get_index(row, 'manOnThird') == 'TRUE')
-        self.probCalledStrike = float(self.get_index(row, 'probCalledStrike'))
+        try:
+            self.probCalledStrike = float(self.get_index(row,
+                                                         'probCalledStrike'))
+        except ValueError:
+            raise ValueError('probCalledStrike has no value')
         self.hand = str(self.get_index(row, 'pitcherHand'))
+        if self.entityKeys:
+            self.entityIds = [self.entity_id(self.get_index(row, key))
+                              for key in self.entityKeys]
 
     def get_run_exp_prior_params(self):
         return (self.outs, self.balls, self.strikes, self.first, self.second,
@@ -71,67 +179,470 @@ class Season(object):
 
     def get_process_batter_params(self):
         return (self.batterId, self.px, self.pz, self.pitchType,
-                self.pitchResult, self.paResult, self.hand)
+                self.pitchResult, self.paResult, self.hand, self.entityIds)
 
-    def process_season(self, filename, output):
+    def process_season(self, filename, output, entityDir=None):
         """ Generate heat maps for a given CSV file. Outputs the heat maps
-            objects pickled
+            as save_heatmaps does, and with entityDir each entity's heat maps
         """
-        with open(filename, 'r') as f:
-            for num, line in enumerate(f):
-                row = line.strip().split(',')
-                if num == 0:
-                    self.header = row
-                else:
-                    try:
-                        self.process_row(row)
-                    except ValueError:
-                        continue
-                    paramsBatter = self.get_process_batter_params()
-                    self.process_batter(*paramsBatter)
-        dump(self.season, open(output, 'w'))
-        f.close()
+        self.reader = PitchReader(filename, extraColumns=self.entityKeys)
+        self.set_header(self.reader.header)
+        for line, row in self.reader:
+            try:
+                self.process_row(row)
+            except (ValueError, IndexError):
+                continue
+            paramsBatter = self.get_process_batter_params()
+            self.process_batter(*paramsBatter)
+        self.save_heatmaps(output)
+        if entityDir:
+            self.dump_entities(entityDir)
+
+    def save_heatmaps(self, output):
+        """ Pickle the heat maps to output, or if output is a directory
+            write them as a HeatMapStore. Writing back to the store they
+            were loaded from only writes the batters that changed.
+        """
+        if (isinstance(self.season, LazyHeatMaps) and
+                os.path.abspath(output) ==
+                os.path.abspath(self.season.store.directory)):
+            self.season.flush()
+        elif is_store(output) or os.path.isdir(output):
+            write_store(self.season, output)
+        else:
+            dump(dict(self.season.items()), open(output, 'w'))
 
     def generate_new_cols(self):
         """ Generate runExpPrior, runExpSwing, runExpTake
         """
         paramsPrior = self.get_run_exp_prior_params()
         runExpPrior = self.runExp.exp_runs(*paramsPrior)
+        self.blankReason = None
         try:
             if self.batterId in self.season and self.outs < 3:
                 paramsSwing = self.get_run_exp_swing_params()
-                runExpSwing = self.runExp.exp_runs_swing(*paramsSwing)
+                if self.swingCache:
+                    runExpSwing = self.swingCache.exp_runs_swing(
+                        self.batterId, *paramsSwing)
+                else:
+                    runExpSwing = self.runExp.exp_runs_swing(*paramsSwing)
                 paramsTake = self.get_run_exp_take_params()
                 runExpTake = self.runExp.exp_runs_take(*paramsTake)
             else:
+                self.blankReason = ('three outs' if self.outs >= 3 else
+                                    'new batter')
                 runExpSwing = ''
                 runExpTake = ''
         except ZeroDivisionError:
+            self.blankReason = 'no swings'
             runExpSwing = ''
             runExpTake = ''
         return [str(runExpPrior), str(runExpSwing), str(runExpTake)]
 
-    def process_file(self, filename, output):
+    def process_line(self, line, row):
+        """ Score one row then add it to the batter's heat map. Returns
+            the output line, or None if the row is skipped.
+        """
+        if self.stats:
+            return self.process_line_stats(line, row)
+        try:
+            self.process_row(row)
+        except (ValueError, IndexError):
+            return None
+        newCols = self.generate_new_cols()
+        paramsBatter = self.get_process_batter_params()
+        self.process_batter(*paramsBatter)
+        return line.strip() + ',' + ','.join(newCols) + '\n'
+
+    def timed(self, rows):
+        """ rows, such as the reader's rows or chunks, with the time taken
+            to read and decode each added to the stats' parse stage
+        """
+        if self.stats:
+            return self.stats.timed(rows, 'parse')
+        return rows
+
+    def process_line_stats(self, line, row):
+        """ process_line recording counts and stage times in self.stats
+        """
+        stats = self.stats
+        stats.read(self)
+        start = stats.now()
+        try:
+            self.process_row(row)
+        except ValueError as e:
+            stats.add_time('parse', start)
+            stats.skip(str(e))
+            return None
+        except IndexError:
+            stats.add_time('parse', start)
+            stats.skip('row has too few fields')
+            return None
+        start = stats.add_time('parse', start)
+        newCols = self.generate_new_cols()
+        start = stats.add_time('scoring', start)
+        stats.score(self.blankReason)
+        paramsBatter = self.get_process_batter_params()
+        self.process_batter(*paramsBatter)
+        stats.add_time('heatmap', start)
+        return line.strip() + ',' + ','.join(newCols) + '\n'
+
+    def process_file(self, filename, output, chunksize=None, processes=None,
+                     checkpointDir=None, columnar=None):
         """ Processes play-by-play file generating/updating heat maps and run
             expectancy probabilities at each point in time.
             Output: original CSV file with appended run expectancies.
+            With chunksize, rows are decoded chunksize at a time into typed
+            arrays and each chunk is scored in one vectorized pass.
+            With processes, batters are sharded across a process pool by
+            batterId, each worker reading the file for its own rows; the
+            output is identical to a serial run.
+            With checkpointDir, processing resumes from the latest checkpoint
+            there, only rows added to the file since are processed and
+            appended to output, and a new checkpoint is saved. Resuming
+            raises ValueError if filename is not the checkpoint's file or
+            has changed before where it left off. A last row still being
+            written is left for the next run.
+            With columnar, a directory, the output is also written there as
+            typed binary columns (see columnar.py); output may then be None
+            to skip the CSV. It cannot be combined with checkpointDir.
         """
-        out = open(output, 'wa')
-        with open(filename, 'r') as f:
-            for num, line in enumerate(f):
-                row = line.strip().split(',')
-                if num == 0:
-                    # Get header, create new column names
-                    self.header = row
-                    row += ['runExpPrior', 'runExpSwing', 'runExpTake\n']
-                else:
-                    try:
-                        self.process_row(row)
-                    except ValueError:
-                        continue
-                    row += self.generate_new_cols()
-                    paramsBatter = self.get_process_batter_params()
-                    self.process_batter(*paramsBatter)
-                out.write(','.join(row) + '\n')
-        f.close()
+        assert not (columnar and checkpointDir)
+        checkpoint = None
+        if checkpointDir:
+            checkpoint = self.load_checkpoint(checkpointDir)
+        if checkpoint:
+            self.check_checkpoint(filename, checkpoint)
+            self.reader = PitchReader(filename, checkpoint['inputOffset'],
+                                      self.entityKeys,
+                                      os.path.getsize(filename))
+            out = open(output, 'r+')
+            out.seek(checkpoint['outputOffset'])
+            out.truncate()
+        else:
+            # A checkpointed file may still be being appended to
+            end = os.path.getsize(filename) if checkpointDir else None
+            self.reader = PitchReader(filename, extraColumns=self.entityKeys,
+                                      end=end)
+            out = open(output or os.devnull, 'w')
+            if columnar:
+                out = ColumnarWriter(columnar, out)
+            out.write(self.reader.headerLine.strip() +
+                      ',runExpPrior,runExpSwing,runExpTake\n')
+        self.set_header(self.reader.header)
+        if processes:
+            self.process_parallel(processes, out)
+        elif chunksize:
+            for chunk in self.timed(self.reader.chunks(chunksize)):
+                self.process_chunk(chunk, out)
+        else:
+            for line, row in self.timed(self.reader):
+                newLine = self.process_line(line, row)
+                if newLine is not None:
+                    if self.stats:
+                        start = self.stats.now()
+                        out.write(newLine)
+                        self.stats.add_time('write', start)
+                    else:
+                        out.write(newLine)
+        if checkpointDir:
+            rows = self.reader.rowsRead
+            if checkpoint:
+                rows += checkpoint['rows']
+            self.save_checkpoint(checkpointDir, {
+                'filename': filename,
+                'inputOffset': self.reader.offset,
+                'rows': rows,
+                'gameString': self.last_game_string(checkpoint),
+                'tail': self.input_tail(filename, self.reader.offset),
+                'outputOffset': out.tell()})
         out.close()
+
+    def input_tail(self, filename, offset, size=1024):
+        """ The size bytes of filename before offset, kept with a
+            checkpoint to tell whether the file has changed up to there
+        """
+        tail = open(filename, 'rb')
+        tail.seek(max(offset - size, 0))
+        text = tail.read(offset - tail.tell())
+        tail.close()
+        return text
+
+    def check_checkpoint(self, filename, checkpoint):
+        """ Raises ValueError unless filename is the file checkpoint was
+            taken on, unchanged up to the checkpoint's input offset
+        """
+        if os.path.abspath(checkpoint['filename']) != \
+                os.path.abspath(filename):
+            raise ValueError('Checkpoint is for %s, not %s' %
+                             (checkpoint['filename'], filename))
+        offset = checkpoint['inputOffset']
+        # Checkpoints from before tails were kept are not checked
+        if 'tail' in checkpoint and \
+                checkpoint['tail'] != self.input_tail(filename, offset):
+            raise ValueError('%s has changed before byte %d, where its '
+                             'checkpoint (game %s) left off' %
+                             (filename, offset, checkpoint['gameString']))
+
+    def last_game_string(self, checkpoint):
+        if self.reader.lastRow:
+            try:
+                return self.get_index(self.reader.lastRow, 'gameString')
+            except IndexError:
+                pass
+        if checkpoint:
+            return checkpoint['gameString']
+
+    def checkpoint_numbers(self, checkpointDir):
+        """ Returns the numbers of the checkpoints saved in checkpointDir
+        """
+        if not os.path.isdir(checkpointDir):
+            return []
+        numbers = []
+        for name in os.listdir(checkpointDir):
+            match = re.match(r'^checkpoint_(\d+)\.pickle$', name)
+            if match:
+                numbers.append(int(match.group(1)))
+        return sorted(numbers)
+
+    def checkpoint_path(self, checkpointDir, number):
+        return os.path.join(checkpointDir, 'checkpoint_%04d.pickle' % number)
+
+    def save_checkpoint(self, checkpointDir, state):
+        """ Pickle the heat maps with the given progress state as the next
+            numbered checkpoint. Returns its number. Each holds every heat
+            map, so only the last keepCheckpoints are kept.
+        """
+        if not os.path.isdir(checkpointDir):
+            os.makedirs(checkpointDir)
+        numbers = self.checkpoint_numbers(checkpointDir)
+        number = numbers[-1] + 1 if numbers else 0
+        state = dict(state, season=self.season, entities=self.entities)
+        path = self.checkpoint_path(checkpointDir, number)
+        dump(state, open(path + '.tmp', 'wb'), protocol=2)
+        os.rename(path + '.tmp', path)
+        for old in (numbers + [number])[:-self.keepCheckpoints]:
+            os.remove(self.checkpoint_path(checkpointDir, old))
+        return number
+
+    def load_checkpoint(self, checkpointDir, number=None):
+        """ Restore the heat maps from a checkpoint, the latest if number
+            is None. Returns the checkpoint's progress state, or None if
+            there are no checkpoints. Heat maps backed by a HeatMapStore
+            that has been written since the checkpoint, as by
+            save_heatmaps, would mix in later counts, so restoring them
+            raises ValueError.
+        """
+        numbers = self.checkpoint_numbers(checkpointDir)
+        if number is None and numbers:
+            number = numbers[-1]
+        if number is None:
+            return None
+        if number not in numbers:
+            raise ValueError('No checkpoint %s in %s' % (number,
+                                                         checkpointDir))
+        state = load(open(self.checkpoint_path(checkpointDir, number), 'rb'))
+        season = state['season']
+        if isinstance(season, LazyHeatMaps) and season.stale():
+            raise ValueError('Checkpoint %s predates a write to heat map '
+                             'store %s and cannot be restored' %
+                             (number, season.store.directory))
+        self.replace_season(state.pop('season'))
+        # Checkpoints from before entity heat maps have none
+        entities = state.pop('entities', {})
+        for key in self.entityKeys:
+            self.entities[key] = entities.get(key, {})
+        return state
+
+    def replace_season(self, season):
+        """ Swap in other heat maps. Their version counters may repeat
+            ones already seen, so the swing cache is cleared.
+        """
+        self.season = season
+        if self.swingCache:
+            self.swingCache.clear()
+
+    def rollback(self, checkpointDir, number, output):
+        """ Return to checkpoint number: later checkpoints are deleted,
+            output is truncated to what had been written at that point and
+            the heat maps are restored. The next checkpointed process_file
+            resumes from there.
+        """
+        state = self.load_checkpoint(checkpointDir, number)
+        for later in self.checkpoint_numbers(checkpointDir):
+            if later > number:
+                os.remove(self.checkpoint_path(checkpointDir, later))
+        out = open(output, 'r+')
+        out.truncate(state['outputOffset'])
+        out.close()
+        return state
+
+    def shard_of(self, row, processes):
+        """ The worker a row belongs to: its batterId modulo processes, or
+            0 for rows without one, which are only counted as skipped
+        """
+        try:
+            return int(self.get_index(row, 'batterId')) % processes
+        except (ValueError, IndexError):
+            return 0
+
+    def shard_copy(self, shard, processes):
+        """ Copy of this Season holding only the heat maps of shard's
+            batters, to be sent to a worker process.
+        """
+        copied = copy(self)
+        copied.reader = None
+        copied.season = dict((batterId, heatmap) for batterId, heatmap in
+                             self.season.items()
+                             if batterId % processes == shard)
+        # Entity counts are added back to this Season's afterwards
+        copied.entities = dict((key, {}) for key in self.entityKeys)
+        if self.stats:
+            copied.stats = SeasonStats()
+        return copied
+
+    def shard_output(self, path):
+        """ Yields the (row number, line) records a worker wrote to path,
+            then deletes it
+        """
+        shardFile = open(path, 'r')
+        for header in iter(shardFile.readline, ''):
+            num, size = header.split()
+            yield int(num), shardFile.read(int(size))
+        shardFile.close()
+        os.remove(path)
+
+    def process_parallel(self, processes, out):
+        """ Score the remaining rows of self.reader across a process pool
+            and write them to out in their original order. Each worker
+            reads the file from the reader's offset and scores the rows of
+            the batters whose id modulo processes is its number, writing
+            them to a temporary file that is merged into out in row order,
+            so neither the input nor the output is held in memory.
+        """
+        tasks = [(self.shard_copy(shard, processes), self.reader.filename,
+                  self.reader.offset, self.reader.end, shard, processes)
+                 for shard in range(processes)]
+        self.reader.close()
+        paths = []
+        pool = Pool(processes)
+        try:
+            for path, season, stats, entities, position in \
+                    pool.imap_unordered(process_shard, tasks):
+                paths.append(path)
+                self.season.update(season)
+                if self.stats:
+                    self.stats.merge(stats, self)
+                self.merge_entities(entities)
+                self.reader.offset, self.reader.rowsRead, \
+                    self.reader.lastRow = position
+            start = self.stats.now() if self.stats else None
+            for num, newLine in merge(*[self.shard_output(x)
+                                        for x in paths]):
+                out.write(newLine)
+            if self.stats:
+                self.stats.add_time('write', start)
+        finally:
+            pool.close()
+            pool.join()
+            for path in paths:
+                if os.path.exists(path):
+                    os.remove(path)
+
+    def merge_entities(self, entities):
+        """ Add entity heat maps, such as a worker's, to self.entities
+        """
+        for key, maps in entities.items():
+            for entityId, heatmap in maps.items():
+                if entityId in self.entities[key]:
+                    self.entities[key][entityId].merge(heatmap)
+                else:
+                    self.entities[key][entityId] = heatmap
+
+    def process_chunk(self, chunk, out):
+        """ Score and write the valid rows of a PitchChunk. Heat maps are
+            updated pitch by pitch, as in process_file, and the outcome
+            probabilities each pitch sees are scored together afterwards.
+        """
+        stats = self.stats
+        if stats:
+            stats.read(self, len(chunk))
+            for reason in chunk.reasons.values():
+                stats.skip(reason)
+            start = stats.now()
+        rows = np.flatnonzero(chunk.valid)
+        probs = np.full((len(rows), 7), np.nan)
+        blankReasons = {}
+        for num, idx in enumerate(rows):
+            batterId = chunk['batterId'][idx]
+            px, pz = chunk['px'][idx], chunk['pz'][idx]
+            pitchType = chunk['pitchType'][idx]
+            hand = chunk['pitcherHand'][idx]
+            if batterId in self.season and chunk['outs'][idx] < 3:
+                try:
+                    probs[num] = self.season[batterId].outcome_distribution(
+                        px, pz, pitchType, hand)
+                except ZeroDivisionError:
+                    blankReasons[num] = 'no swings'
+            else:
+                blankReasons[num] = ('three outs' if chunk['outs'][idx] >= 3
+                                     else 'new batter')
+            entityIds = [self.entity_id(chunk[key][idx])
+                         for key in self.entityKeys]
+            self.process_batter(batterId, px, pz, pitchType,
+                                chunk['pitchResult'][idx],
+                                chunk['paResult'][idx], hand, entityIds)
+        if stats:
+            start = stats.add_time('heatmap', start)
+        state = [chunk[key][rows] for key in
+                 ['outs', 'balls', 'strikes', 'manOnFirst', 'manOnSecond',
+                  'manOnThird']]
+        prior, swing, take = self.runExp.score_batch(
+            *(state + [probs, chunk['probCalledStrike'][rows]]))
+        newLines = []
+        for num, idx in enumerate(rows):
+            newCols = self.format_new_cols(state[0][num], prior[num],
+                                           swing[num], take[num])
+            newLines.append(chunk.lines[idx].strip() + ',' +
+                            ','.join(newCols) + '\n')
+        if stats:
+            start = stats.add_time('scoring', start)
+            for reason in blankReasons.values():
+                stats.score(reason)
+            stats.score(rows=len(rows) - len(blankReasons))
+        out.writelines(newLines)
+        if stats:
+            stats.add_time('write', start)
+
+    def format_new_cols(self, outs, runExpPrior, runExpSwing, runExpTake):
+        """ Format batch scores as generate_new_cols does, with NaN
+            expectancies left blank.
+        """
+        if outs == 3:
+            runExpPrior = 0
+        if runExpSwing != runExpSwing or runExpTake != runExpTake:
+            runExpSwing, runExpTake = '', ''
+        return [str(runExpPrior), str(runExpSwing), str(runExpTake)]
+
+
+def process_shard(task):
+    """ Worker for Season.process_parallel. Reads the file from offset and
+        replays the rows of one shard in order, writing each output line to
+        a temporary file after a "row number, length" line. Returns the
+        file's path, the final heat maps, stats and entities and where the
+        reader stopped.
+    """
+    season, filename, offset, end, shard, processes = task
+    reader = PitchReader(filename, offset, season.entityKeys, end)
+    fd, path = tempfile.mkstemp(suffix='.shard')
+    out = os.fdopen(fd, 'w')
+    for num, (line, row) in enumerate(season.timed(reader)):
+        if season.shard_of(row, processes) != shard:
+            continue
+        newLine = season.process_line(line, row)
+        if newLine is not None:
+            out.write('%d %d\n' % (num, len(newLine)))
+            out.write(newLine)
+    out.close()
+    return (path, season.season, season.stats, season.entities,
+            (reader.offset, reader.rowsRead, reader.lastRow))
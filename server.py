@@ -0,0 +1,239 @@
+""" Query server for batter approach metrics and pitch expectancies.
+
+    Loads the processed season, the Batters tables, leaderboards and heat
+    maps once, then answers JSON queries over HTTP:
+        python server.py --processed data/2016_processed.csv \\
+            --checkpoints data/checkpoints_2016 --port 8080
+
+    GET /batters?table=mean                       all batters, one table
+    GET /batters/<batter name>                    one batter, every table
+    GET /leaderboard?metric=NetTotal&n=20&top=1&table=value
+                    &split=pitchType&value=SL     one leaderboard
+    GET /expectancy?batterId=&outs=&balls=&strikes=&first=&second=&third=
+                   &px=&pz=&pitchType=&hand=&probCalledStrike=
+                                                  runExp for a pitch
+    GET /stats                                    cache statistics
+"""
+import argparse
+import json
+import sys
+import threading
+import urllib
+import urlparse
+from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+from collections import OrderedDict
+from SocketServer import ThreadingMixIn
+
+import numpy as np
+
+from batters import Batters
+from leaderboard import Leaderboards
+from run_console import create_df
+from season import Season
+
+
+def to_json(value):
+    """ Convert pandas and numpy values to JSON types, NaN to None
+    """
+    if hasattr(value, 'to_dict'):
+        value = value.to_dict()
+    if isinstance(value, dict):
+        return dict((str(key), to_json(item)) for key, item in value.items())
+    if isinstance(value, (list, tuple)):
+        return [to_json(item) for item in value]
+    if isinstance(value, np.generic):
+        value = value.item()
+    if isinstance(value, float) and np.isnan(value):
+        return None
+    return value
+
+
+def parse_bool(value):
+    return value.lower() in ('1', 'true', 'yes')
+
+
+class QueryService(object):
+    """ Answers queries against data held in memory. Responses are kept in
+        a bounded LRU cache; misses are computed one at a time since the
+        Batters and Leaderboards caches are not thread safe, while cache
+        hits are served concurrently.
+    """
+    tables = ['value', 'count', 'mean']
+
+    def __init__(self, batters, season, cacheSize=4096):
+        """ batters is a Batters object and season a Season whose heat maps
+            are used for expectancies.
+        """
+        self.batters = batters
+        self.boards = Leaderboards(batters)
+        self.season = season
+        self.runExp = season.runExp
+        self.cacheSize = cacheSize
+        self.cache = OrderedDict()
+        self.cacheLock = threading.Lock()
+        self.computeLock = threading.Lock()
+        self.hits, self.misses = 0, 0
+        self.routes = {'batters': self.batters_table,
+                       'batter': self.batter,
+                       'leaderboard': self.leaderboard,
+                       'expectancy': self.expectancy}
+
+    def table(self, name):
+        if name not in self.tables:
+            raise ValueError('table must be one of %s' % ', '.join(
+                self.tables))
+        return self.batters.aggregate()[self.tables.index(name)]
+
+    def batters_table(self, table='value'):
+        return self.table(table).to_dict(orient='index')
+
+    def batter(self, name):
+        """ Every table's row for one batter, by name
+        """
+        full = self.table('value')
+        if name not in full.index:
+            raise KeyError('No batter %s' % name)
+        return dict((table, self.table(table).loc[name])
+                    for table in self.tables)
+
+    def leaderboard(self, metric='NetTotal', n='20', top='1', table='value',
+                    split=None, value=None):
+        if metric not in self.batters.metrics:
+            raise KeyError('No metric %s' % metric)
+        if table not in self.tables:
+            raise ValueError('table must be one of %s' % ', '.join(
+                self.tables))
+        if split and split not in self.boards.splits:
+            raise KeyError('No split %s' % split)
+        board = self.boards.board(metric, int(n), parse_bool(top), table,
+                                  split, value)
+        return [[name, score] for name, score in board.iteritems()]
+
+    def expectancy(self, batterId, outs, balls, strikes, first, second,
+                   third, px, pz, pitchType, hand, probCalledStrike):
+        """ runExpPrior, runExpSwing and runExpTake for a hypothetical
+            pitch to a batter. runExpSwing is None when the batter has no
+            swings at that location.
+        """
+        batterId = int(batterId)
+        state = (int(outs), int(balls), int(strikes), parse_bool(first),
+                 parse_bool(second), parse_bool(third))
+        if batterId not in self.season.season:
+            raise KeyError('No heat map for batter %s' % batterId)
+        heatmap = self.season.season[batterId]
+        result = {'runExpPrior': self.runExp.exp_runs(*state),
+                  'runExpTake': self.runExp.exp_runs_take(
+                      *(state + (float(probCalledStrike),)))}
+        try:
+            result['runExpSwing'] = self.runExp.exp_runs_swing(
+                *(state + (float(px), float(pz), pitchType, hand, heatmap)))
+        except ZeroDivisionError:
+            result['runExpSwing'] = None
+        return result
+
+    def query(self, route, params):
+        """ Returns the JSON-ready response to route with params, from the
+            cache if possible.
+        """
+        if route not in self.routes:
+            raise KeyError('No route %s' % route)
+        key = (route,) + tuple(sorted(params.items()))
+        with self.cacheLock:
+            if key in self.cache:
+                response = self.cache.pop(key)
+                self.cache[key] = response
+                self.hits += 1
+                return response
+        with self.computeLock:
+            try:
+                response = to_json(self.routes[route](**params))
+            except TypeError as e:
+                raise ValueError(str(e))
+        with self.cacheLock:
+            self.misses += 1
+            self.cache[key] = response
+            while len(self.cache) > self.cacheSize:
+                self.cache.popitem(last=False)
+        return response
+
+    def stats(self):
+        with self.cacheLock:
+            return {'hits': self.hits, 'misses': self.misses,
+                    'entries': len(self.cache), 'cacheSize': self.cacheSize}
+
+
+class QueryHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        url = urlparse.urlparse(self.path)
+        params = dict(urlparse.parse_qsl(url.query))
+        parts = [urllib.unquote(x) for x in url.path.split('/') if x]
+        service = self.server.service
+        try:
+            if parts == ['stats']:
+                self.reply(200, service.stats())
+                return
+            if len(parts) == 2 and parts[0] == 'batters':
+                parts, params = ['batter'], {'name': parts[1]}
+            if len(parts) != 1:
+                raise KeyError('No route %s' % url.path)
+            self.reply(200, service.query(parts[0], params))
+        except KeyError as e:
+            self.reply(404, {'error': e.args[0] if e.args else str(e)})
+        except ValueError as e:
+            self.reply(400, {'error': str(e)})
+
+    def reply(self, status, body):
+        data = json.dumps(body, sort_keys=True)
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            BaseHTTPRequestHandler.log_message(self, format, *args)
+
+
+class QueryServer(ThreadingMixIn, HTTPServer):
+    allow_reuse_address = True
+    daemon_threads = True
+
+    def __init__(self, address, service, verbose=False):
+        HTTPServer.__init__(self, address, QueryHandler)
+        self.service = service
+        self.verbose = verbose
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--processed', default='data/2016_processed.csv')
+    parser.add_argument('--heatmaps', help='pickled heat maps')
+    parser.add_argument('--checkpoints',
+                        help='checkpoint directory to load heat maps from')
+    parser.add_argument('--hits', default='data/run_exp_hits_2015.pickle')
+    parser.add_argument('--count', default='data/run_exp_count_2015.pickle')
+    parser.add_argument('--min-pa', type=int, default=500)
+    parser.add_argument('--cache-size', type=int, default=4096)
+    parser.add_argument('--host', default='localhost')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--verbose', action='store_true')
+    args = parser.parse_args(argv)
+
+    season = Season(args.hits, args.count, lastSeason=args.heatmaps)
+    if args.checkpoints:
+        season.load_checkpoint(args.checkpoints)
+    batters = Batters(create_df(args.processed), minPA=args.min_pa)
+    service = QueryService(batters, season, args.cache_size)
+    server = QueryServer((args.host, args.port), service, args.verbose)
+    sys.stderr.write('Serving on %s:%d\n' % server.server_address)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    server.server_close()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,249 @@
+from multiprocessing import Pool
+import numpy as np
+from reader import PitchReader
+
+
+# Pitch outcomes, in the order of the transition tables
+SINGLE, DOUBLE, TRIPLE, HOMER, STRIKE, OUT, FOUL, BALL = range(8)
+
+
+def pitch_pool(filename, chunksize=100000):
+    """ The pitches of a play-by-play file that simulations draw from, as a
+        dict of px, pz, pitchType, pitcherHand and probCalledStrike arrays.
+    """
+    keys = ['px', 'pz', 'pitchType', 'pitcherHand', 'probCalledStrike']
+    parts = dict((key, []) for key in keys)
+    for chunk in PitchReader(filename).chunks(chunksize):
+        for key in keys:
+            parts[key].append(chunk[key][chunk.valid])
+    return dict((key, np.concatenate(parts[key])) for key in keys)
+
+
+def always_swing(swing, take, swingRate):
+    return np.ones(len(swing), dtype=bool)
+
+
+def never_swing(swing, take, swingRate):
+    return np.zeros(len(swing), dtype=bool)
+
+
+def optimal_swing(swing, take, swingRate):
+    """ Swing only when runExpSwing > runExpTake
+    """
+    return swing > take
+
+
+class InningSimulator(object):
+    """ Monte Carlo simulation of innings, pitch by pitch, with every
+        inning advanced in lockstep as NumPy arrays.
+
+        Each pitch is drawn from a pool of real pitches. The batter swings
+        according to a policy; a swing's outcome is drawn from the batter's
+        HeatMap and a take is a called strike with the pitch's
+        probCalledStrike.
+        State changes come from RunExpectancy's strike_state, ball_state,
+        out_state and foul_state and its hit transitions (hitBases and
+        adjust_runners), compiled into tables once. Unlike the one-step
+        scoring methods, plate appearances end properly: the count resets
+        after a ball in play or a walk, and a walk forces runners ahead.
+    """
+    def __init__(self, runExp, lineup, pool, policies=None):
+        """ lineup is a list of HeatMaps batting in turn; policies is a
+            matching list of policies, or one for everyone. A policy is
+            None to swing at each batter's observed swing rate for the
+            zone cell and pitch type, or a function of the runExpSwing,
+            runExpTake and swing rate arrays returning which pitches to
+            swing at, such as optimal_swing. Functions must be defined at
+            module level to be used with processes.
+        """
+        self.runExp = runExp
+        self.lineup = list(lineup)
+        if not isinstance(policies, (list, tuple)):
+            policies = [policies] * len(self.lineup)
+        assert len(policies) == len(self.lineup)
+        self.policies = list(policies)
+        self.pool = pool
+        self.nextCodes, self.runs, self.paOver = self.compile_transitions()
+
+    def compile_transitions(self):
+        """ For every state code before three outs and every outcome,
+            returns the next state code, the runs scored and whether the
+            plate appearance is over. Three outs are code -1.
+        """
+        runExp = self.runExp
+        nStates = 3 * 4 * 3 * 8
+        nextCodes = np.full((nStates, 8), -1, dtype=int)
+        runs = np.zeros((nStates, 8))
+        paOver = np.zeros((nStates, 8), dtype=bool)
+        for code in range(nStates):
+            state = runExp.decode_state(code)
+            outs, balls, strikes, first, second, third = state
+            bases = runExp.base_code(first, second, third)
+            for hit in range(4):
+                scored, after = self.hit_transition(outs, bases, hit)
+                nextCodes[code, hit] = self.encode(outs, 0, 0, after)
+                runs[code, hit] = scored
+                paOver[code, hit] = True
+            after = runExp.strike_state(*state)
+            nextCodes[code, STRIKE] = self.encode(*after)
+            paOver[code, STRIKE] = strikes == 2
+            after = runExp.out_state(*state)
+            nextCodes[code, OUT] = self.encode(after[0], 0, 0,
+                                               *after[3:])
+            paOver[code, OUT] = True
+            nextCodes[code, FOUL] = self.encode(*runExp.foul_state(*state))
+            if balls < 3:
+                scored, after = runExp.ball_state(*state)
+                nextCodes[code, BALL] = self.encode(*after)
+            else:
+                scored, after = self.walk(first, second, third)
+                nextCodes[code, BALL] = self.encode(outs, 0, 0, after)
+                runs[code, BALL] = scored
+                paOver[code, BALL] = True
+        return nextCodes, runs, paOver
+
+    def encode(self, outs, balls, strikes, first, second=None, third=None):
+        """ State code, or -1 for three outs. first may be a base code.
+        """
+        if outs >= 3:
+            return -1
+        if second is None:
+            bases = first
+        else:
+            bases = self.runExp.base_code(first, second, third)
+        return ((outs * 4 + balls) * 3 + strikes) * 8 + bases
+
+    def hit_transition(self, outs, bases, hit):
+        """ Runs scored and base code after a hit. Where the hit table has
+            no transition, every runner advances as many bases as the
+            batter.
+        """
+        after = self.runExp.hitBases[hit, bases, outs]
+        if after >= 0:
+            return (int(round(self.runExp.basesTable[hit, bases, outs])),
+                    after)
+        advance = hit + 1
+        moved = (bases << advance) | (1 << (advance - 1))
+        return bin(moved >> 3).count('1'), moved & 7
+
+    def walk(self, first, second, third):
+        """ Runs scored and base code after a walk
+        """
+        if first and second and third:
+            return 1, 7
+        if first and second:
+            return 0, 7
+        if first:
+            return 0, 3 | (4 if third else 0)
+        return 0, 1 | (2 if second else 0) | (4 if third else 0)
+
+    def swing_decisions(self, batter, codes, draws, rng):
+        """ Returns which of the pool pitches draws, thrown to one lineup
+            slot in states codes, are swung at and their swing outcome
+            probabilities.
+        """
+        heatmap, policy = self.lineup[batter], self.policies[batter]
+        pool = self.pool
+        args = (pool['px'][draws], pool['pz'][draws],
+                pool['pitchType'][draws], pool['pitcherHand'][draws])
+        probs = heatmap.outcome_distributions(*args)
+        rate = heatmap.swing_rates(*args)
+        canSwing = ~np.isnan(probs).any(axis=1)
+        if policy is None:
+            swing = rng.random_sample(len(draws)) < np.nan_to_num(rate)
+        else:
+            outs, balls, strikes, first, second, third = self.decode(codes)
+            swingRuns, takeRuns = self.runExp.score_batch(
+                outs, balls, strikes, first, second, third, probs,
+                pool['probCalledStrike'][draws])[1:]
+            swing = np.asarray(policy(swingRuns, takeRuns, rate), dtype=bool)
+        return swing & canSwing, probs
+
+    def decode(self, codes):
+        bases, rest = codes % 8, codes // 8
+        strikes, rest = rest % 3, rest // 3
+        balls, outs = rest % 4, rest // 4
+        return (outs, balls, strikes, (bases & 1) > 0, (bases & 2) > 0,
+                (bases & 4) > 0)
+
+    def simulate(self, innings, seed=0, maxPitches=1000):
+        """ Simulate innings from no outs, no one on and the first batter
+            up. Returns arrays of the runs and pitches of each inning.
+        """
+        rng = np.random.RandomState(seed)
+        codes = np.zeros(innings, dtype=int)
+        batters = np.zeros(innings, dtype=int)
+        runs = np.zeros(innings)
+        pitches = np.zeros(innings, dtype=int)
+        active = np.arange(innings)
+        poolSize = len(self.pool['px'])
+        while len(active) and pitches[active[0]] < maxPitches:
+            draws = rng.randint(0, poolSize, len(active))
+            outcomes = np.empty(len(active), dtype=int)
+            for batter in np.unique(batters[active]):
+                rows = np.flatnonzero(batters[active] == batter)
+                swing, probs = self.swing_decisions(
+                    batter, codes[active[rows]], draws[rows], rng)
+                # Swing outcomes, normalized as double plays count twice
+                # and errors not at all
+                probs = np.nan_to_num(probs)
+                totals = probs.sum(axis=1)
+                totals[totals == 0] = 1
+                cumulative = np.cumsum(probs / totals[:, None], axis=1)
+                u = rng.random_sample(len(rows))
+                swingOutcome = (u[:, None] > cumulative).sum(axis=1)
+                swingOutcome = np.minimum(swingOutcome, 6)
+                called = (rng.random_sample(len(rows)) <
+                          self.pool['probCalledStrike'][draws[rows]])
+                takeOutcome = np.where(called, STRIKE, BALL)
+                outcomes[rows] = np.where(swing, swingOutcome, takeOutcome)
+            current = codes[active]
+            runs[active] += self.runs[current, outcomes]
+            batters[active] = ((batters[active] +
+                                self.paOver[current, outcomes]) %
+                               len(self.lineup))
+            codes[active] = self.nextCodes[current, outcomes]
+            pitches[active] += 1
+            active = active[codes[active] >= 0]
+        return runs, pitches
+
+    def run(self, innings, seed=0, processes=None, blockSize=10000):
+        """ Simulate innings in blocks of blockSize, each with its own
+            random stream so results do not depend on processes. Returns a
+            dict with the runs and pitches of each inning and their means.
+        """
+        tasks = [(num, min(blockSize, innings - start), seed)
+                 for num, start in enumerate(range(0, innings, blockSize))]
+        if processes:
+            pool = Pool(processes, initializer=set_simulator,
+                        initargs=(self,))
+            try:
+                blocks = pool.map(simulate_block, tasks)
+            finally:
+                pool.close()
+                pool.join()
+        else:
+            set_simulator(self)
+            try:
+                blocks = [simulate_block(task) for task in tasks]
+            finally:
+                set_simulator(None)
+        runs = np.concatenate([x[0] for x in blocks])
+        pitches = np.concatenate([x[1] for x in blocks])
+        return {'runs': runs, 'pitches': pitches, 'meanRuns': runs.mean(),
+                'stdErr': runs.std() / np.sqrt(max(len(runs), 1)),
+                'meanPitches': pitches.mean()}
+
+
+# Simulator shared with worker processes
+simulator = None
+
+
+def set_simulator(sim):
+    global simulator
+    simulator = sim
+
+
+def simulate_block(task):
+    num, innings, seed = task
+    return simulator.simulate(innings, seed=[seed, num])
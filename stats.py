@@ -0,0 +1,120 @@
+import json
+import sys
+from timeit import default_timer
+
+
+class SeasonStats(object):
+    """ Opt-in instrumentation for Season processing. Counts rows read,
+        skipped (by reason), scored and blanked (by reason), times each
+        stage and reports how many heat maps and pitch types are held.
+        Pass one to Season(stats=...) and read as_dict() after a run.
+        With every set, a report is emitted each time that many rows have
+        been read.
+    """
+    stages = ['parse', 'heatmap', 'scoring', 'write']
+
+    def __init__(self, every=None, emit=None):
+        """ emit is called with the report dict, by default it is written
+            to stderr as a line of JSON.
+        """
+        self.every = every
+        self.emit = emit
+        self.rowsRead = 0
+        self.rowsScored = 0
+        self.rowsBlanked = 0
+        self.skipped = {}
+        self.blanked = {}
+        self.seconds = dict((stage, 0.0) for stage in self.stages)
+        self.start = default_timer()
+
+    def now(self):
+        return default_timer()
+
+    def add_time(self, stage, start):
+        """ Add the time since start to stage. Returns the current time so
+            consecutive stages can be chained.
+        """
+        now = default_timer()
+        self.seconds[stage] += now - start
+        return now
+
+    def timed(self, items, stage):
+        """ Yields items, adding the time taken to produce each to stage
+        """
+        items = iter(items)
+        while True:
+            start = default_timer()
+            try:
+                item = next(items)
+            except StopIteration:
+                return
+            self.add_time(stage, start)
+            yield item
+
+    def read(self, season=None, rows=1):
+        self.rowsRead += rows
+        self.report(season, rows)
+
+    def report(self, season, rows):
+        """ Emit a report if the last rows read passed a multiple of every
+        """
+        if self.every and ((self.rowsRead - rows) // self.every !=
+                           self.rowsRead // self.every):
+            (self.emit or self.write_json)(self.as_dict(season))
+
+    def skip(self, reason, rows=1):
+        self.skipped[reason] = self.skipped.get(reason, 0) + rows
+
+    def score(self, blankReason=None, rows=1):
+        if blankReason:
+            self.rowsBlanked += rows
+            self.blanked[blankReason] = self.blanked.get(blankReason, 0) + rows
+        else:
+            self.rowsScored += rows
+
+    def merge(self, other, season=None):
+        """ Add the counts and times of another SeasonStats, such as one
+            from a worker process, emitting a report if its rows pass a
+            multiple of every.
+        """
+        self.rowsRead += other.rowsRead
+        self.rowsScored += other.rowsScored
+        self.rowsBlanked += other.rowsBlanked
+        for reason, rows in other.skipped.items():
+            self.skip(reason, rows)
+        for reason, rows in other.blanked.items():
+            self.blanked[reason] = self.blanked.get(reason, 0) + rows
+        for stage in self.stages:
+            self.seconds[stage] += other.seconds[stage]
+        self.report(season, other.rowsRead)
+
+    def heatmap_counts(self, season):
+        """ Number of heat maps and of (hand, pitch type) maps they hold
+        """
+        pitchTypes = 0
+        for heatmap in season.values():
+            for maps in heatmap.maps.values():
+                pitchTypes += len(maps.keys())
+        return len(season), pitchTypes
+
+    def as_dict(self, season=None):
+        elapsed = default_timer() - self.start
+        stats = {'rowsRead': self.rowsRead,
+                 'rowsSkipped': sum(self.skipped.values()),
+                 'skipped': dict(self.skipped),
+                 'rowsScored': self.rowsScored,
+                 'rowsBlanked': self.rowsBlanked,
+                 'blanked': dict(self.blanked),
+                 'seconds': dict(self.seconds),
+                 'elapsed': elapsed,
+                 'rowsPerSec': self.rowsRead / max(elapsed, 1e-9)}
+        if season is not None:
+            stats['heatmaps'], stats['pitchTypeMaps'] = \
+                self.heatmap_counts(season.season)
+        return stats
+
+    def to_json(self, season=None):
+        return json.dumps(self.as_dict(season), sort_keys=True)
+
+    def write_json(self, stats):
+        sys.stderr.write(json.dumps(stats, sort_keys=True) + '\n')
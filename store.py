@@ -0,0 +1,249 @@
+import json
+import os
+import shutil
+import tempfile
+import numpy as np
+from heatmap import HeatMap
+
+HANDS = ['L', 'R']
+
+
+def is_store(path):
+    return os.path.isfile(os.path.join(path, 'index.bin'))
+
+
+class HeatMapStore(object):
+    """ Heat maps on disk as fixed size count blocks, one per batter, hand
+        and pitch type, in counts.bin, memory mapped for reading. index.bin
+        lists (batterId, hand, pitch type, block) sorted by batterId and
+        meta.json holds the pitch type names, the number of blocks and how
+        many writes the store has had. Rewriting a batter overwrites its
+        blocks in place and appends blocks for new pitch types, so only the
+        batters written are touched.
+    """
+    shape = (9, 5, 5)
+    dtype = np.dtype(int)
+
+    def __init__(self, directory):
+        if not is_store(directory):
+            if not os.path.isdir(directory):
+                os.makedirs(directory)
+            self.directory = directory
+            self.pitchTypes, self.blocks, self.writes = [], 0, 0
+            self.index = np.zeros((0, 4), dtype='int64')
+            open(self.path('counts.bin'), 'wb').close()
+            self.save_index()
+        self.open(directory)
+
+    def path(self, name):
+        return os.path.join(self.directory, name)
+
+    def open(self, directory):
+        self.directory = directory
+        meta = json.load(open(self.path('meta.json')))
+        self.pitchTypes = [x.encode('utf-8') for x in meta['pitchTypes']]
+        self.typeCodes = dict((x, num) for num, x in
+                              enumerate(self.pitchTypes))
+        self.blocks = meta['blocks']
+        self.writes = meta.get('writes', 0)
+        self.index = np.fromfile(self.path('index.bin'),
+                                 dtype='int64').reshape(-1, 4)
+        self.counts = None
+        if self.blocks:
+            self.counts = np.memmap(self.path('counts.bin'), dtype=self.dtype,
+                                    mode='r', shape=(self.blocks,) +
+                                    self.shape)
+
+    def __getstate__(self):
+        return {'directory': self.directory}
+
+    def __setstate__(self, state):
+        self.open(state['directory'])
+
+    def save_index(self):
+        self.index.tofile(self.path('index.bin.tmp'))
+        json.dump({'pitchTypes': self.pitchTypes, 'blocks': self.blocks,
+                   'writes': self.writes},
+                  open(self.path('meta.json.tmp'), 'w'))
+        os.rename(self.path('index.bin.tmp'), self.path('index.bin'))
+        os.rename(self.path('meta.json.tmp'), self.path('meta.json'))
+
+    def batter_ids(self):
+        return np.unique(self.index[:, 0])
+
+    def entries(self, batterId):
+        """ The index rows of a batter
+        """
+        batters = self.index[:, 0]
+        start = np.searchsorted(batters, batterId, side='left')
+        stop = np.searchsorted(batters, batterId, side='right')
+        return self.index[start:stop]
+
+    def __contains__(self, batterId):
+        return len(self.entries(batterId)) > 0
+
+    def __len__(self):
+        return len(self.batter_ids())
+
+    def read(self, batterId):
+        """ The batter's HeatMap, with its counts copied out of the store.
+            Raises KeyError if the store has no such batter.
+        """
+        entries = self.entries(batterId)
+        if not len(entries):
+            raise KeyError(batterId)
+        heatmap = HeatMap()
+        for batter, hand, typeCode, block in entries:
+            heatmap.maps[HANDS[hand]][self.pitchTypes[typeCode]] = np.array(
+                self.counts[block])
+        return heatmap
+
+    def write(self, heatmaps):
+        """ Write a dict of batterId to HeatMap, replacing those batters'
+            heat maps in the store
+        """
+        blocks = dict(((batter, hand, typeCode), block) for
+                      batter, hand, typeCode, block in self.index)
+        written = set(int(x) for x in heatmaps)
+        keep = [row for row in self.index if row[0] not in written]
+        rows = []
+        out = open(self.path('counts.bin'), 'r+b')
+        for batterId, heatmap in heatmaps.items():
+            for hand, maps in heatmap.maps.items():
+                for pitchType, counts in maps.items():
+                    if pitchType not in self.typeCodes:
+                        self.typeCodes[pitchType] = len(self.pitchTypes)
+                        self.pitchTypes.append(pitchType)
+                    key = (int(batterId), HANDS.index(hand),
+                           self.typeCodes[pitchType])
+                    block = blocks.get(key)
+                    if block is None:
+                        block = self.blocks
+                        self.blocks += 1
+                    out.seek(block * self.dtype.itemsize * counts.size)
+                    np.asarray(counts, dtype=self.dtype).tofile(out)
+                    rows.append(key + (block,))
+        out.close()
+        index = np.array(keep + rows, dtype='int64').reshape(-1, 4)
+        self.index = index[np.lexsort(index[:, ::-1].T)]
+        self.writes += 1
+        self.save_index()
+        self.open(self.directory)
+
+
+class LazyHeatMaps(object):
+    """ A dict of batterId to HeatMap backed by a HeatMapStore. Heat maps
+        are read from the store when first accessed and flush writes back
+        only those that changed since, found by their version counters, or
+        were assigned. Changes made without bumping a version, such as
+        editing the arrays of maps directly, are not seen.
+
+        Only the loaded heat maps are pickled, the rest are read from the
+        store when unpickled, so a pickle taken before the store was
+        written to is stale: the store then holds later counts.
+    """
+    def __init__(self, store):
+        self.store = store
+        self.loaded = {}
+        self.loadedVersions = {}
+        self.assigned = set()
+        self.writes = store.writes
+
+    def __contains__(self, batterId):
+        return batterId in self.loaded or batterId in self.store
+
+    def __getitem__(self, batterId):
+        if batterId not in self.loaded:
+            self.loaded[batterId] = self.store.read(batterId)
+            self.loadedVersions[batterId] = {}
+        return self.loaded[batterId]
+
+    def __setitem__(self, batterId, heatmap):
+        self.loaded[batterId] = heatmap
+        self.assigned.add(batterId)
+
+    def get(self, batterId, default=None):
+        if batterId in self:
+            return self[batterId]
+        return default
+
+    def keys(self):
+        return sorted(set(self.loaded) |
+                      set(int(x) for x in self.store.batter_ids()))
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def __len__(self):
+        return len(self.keys())
+
+    def items(self):
+        """ Every batter's heat map, reading all of them from the store
+        """
+        return [(batterId, self[batterId]) for batterId in self.keys()]
+
+    def values(self):
+        return [heatmap for batterId, heatmap in self.items()]
+
+    def update(self, heatmaps):
+        for batterId, heatmap in heatmaps.items():
+            self[batterId] = heatmap
+
+    def dirty(self):
+        """ batterIds of heat maps changed or assigned since loaded or
+            last flushed
+        """
+        return [batterId for batterId, heatmap in self.loaded.items()
+                if batterId in self.assigned or
+                getattr(heatmap, 'versions', {}) !=
+                self.loadedVersions.get(batterId)]
+
+    def flush(self):
+        """ Write the dirty heat maps back to the store. Returns how many
+            were written.
+        """
+        dirty = self.dirty()
+        if not dirty:
+            return 0
+        self.store.write(dict((x, self.loaded[x]) for x in dirty))
+        self.writes = self.store.writes
+        for batterId in dirty:
+            self.loadedVersions[batterId] = dict(
+                getattr(self.loaded[batterId], 'versions', {}))
+        self.assigned.clear()
+        return len(dirty)
+
+    def stale(self):
+        """ True if the store has been written since these heat maps were
+            loaded or last flushed, other than by them
+        """
+        return self.store.writes != getattr(self, 'writes', 0)
+
+
+def write_store(heatmaps, directory):
+    """ Write a dict of batterId to HeatMap, such as a pickled season's, as
+        a HeatMapStore in directory. Returns the store. A store already in
+        directory is replaced whole: the new one is built in a fresh
+        directory beside it and swapped in, leaving none of the old
+        batters or blocks.
+    """
+    if not is_store(directory):
+        store = HeatMapStore(directory)
+        store.write(heatmaps)
+        return store
+    writes = HeatMapStore(directory).writes
+    parent = os.path.dirname(os.path.abspath(directory))
+    building = tempfile.mkdtemp(prefix='.store', dir=parent)
+    try:
+        store = HeatMapStore(building)
+        store.writes = writes
+        store.write(heatmaps)
+        replaced = building + '.old'
+        os.rename(directory, replaced)
+        os.rename(building, directory)
+    except:
+        shutil.rmtree(building, ignore_errors=True)
+        raise
+    shutil.rmtree(replaced)
+    store.open(directory)
+    return store
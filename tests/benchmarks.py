@@ -0,0 +1,239 @@
+""" Benchmarks for the scoring pipeline hot paths.
+
+    Run from the tests directory:
+        python benchmarks.py --rows 700000 --output bench.json
+        python benchmarks.py --baseline bench.json --threshold 0.2
+
+    The input is 2016-WS.csv replicated up to the requested number of rows,
+    with each copy's games renamed so half-innings stay distinct, or with
+    --synthetic SEED a season generated from it by generator.py. Results
+    are written as JSON. With --baseline, any benchmark slower than the
+    baseline by more than the threshold fails the run.
+"""
+import argparse
+import csv
+import json
+import os
+import shutil
+import sys
+import tempfile
+from timeit import default_timer
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                '..'))
+
+from heatmap import HeatMap
+from run_expectancy import RunExpectancy, run_expectancy_count
+from season import Season
+from batters import Batters
+from reader import PitchReader
+from run_console import create_df
+from generator import generate
+
+run_exp_hits = '../data/run_exp_hits_2015.pickle'
+run_exp_count = '../data/run_exp_count_2015.pickle'
+world_series = '2016-WS.csv'
+
+
+def replicate(filename, rows, output):
+    """ Write filename's rows repeatedly to output until it has rows rows.
+        Each copy's gameString gets a suffix so games do not merge.
+    """
+    reader = csv.reader(open(filename, 'r'))
+    header = next(reader)
+    data = list(reader)
+    game = header.index('gameString')
+    writer = csv.writer(open(output, 'w'), lineterminator='\n')
+    writer.writerow(header)
+    written, copy = 0, 0
+    while written < rows:
+        for row in data[:rows - written]:
+            row = list(row)
+            row[game] = '%s_%d' % (row[game], copy)
+            writer.writerow(row)
+        written += min(len(data), rows - written)
+        copy += 1
+
+
+def load_pitches(filename, limit):
+    """ Heat map parameters of the valid rows of filename
+    """
+    pitches, states = [], []
+    for chunk in PitchReader(filename).chunks(10000):
+        for idx in chunk.valid.nonzero()[0]:
+            pitches.append((chunk['px'][idx], chunk['pz'][idx],
+                            chunk['pitchType'][idx],
+                            chunk['pitchResult'][idx],
+                            chunk['paResult'][idx],
+                            chunk['pitcherHand'][idx]))
+            states.append((int(chunk['outs'][idx]), int(chunk['balls'][idx]),
+                           int(chunk['strikes'][idx]),
+                           bool(chunk['manOnFirst'][idx]),
+                           bool(chunk['manOnSecond'][idx]),
+                           bool(chunk['manOnThird'][idx]),
+                           chunk['probCalledStrike'][idx]))
+            if len(pitches) == limit:
+                return pitches, states
+    return pitches, states
+
+
+class Benchmarks(object):
+    def __init__(self, workdir, rows, repeat, callRows, synthetic=None):
+        self.workdir = workdir
+        self.rows = rows
+        self.repeat = repeat
+        self.data = os.path.join(workdir, 'season.csv')
+        if synthetic is None:
+            replicate(world_series, rows, self.data)
+        else:
+            generate(world_series, self.data, rows=rows, seed=synthetic)
+        self.pitches, self.states = load_pitches(self.data, callRows)
+        self.runExp = RunExpectancy(run_exp_hits, run_exp_count)
+        self.heatmap = HeatMap()
+        for pitch in self.pitches:
+            self.heatmap.process_pitch(*pitch)
+        self.processed = os.path.join(workdir, 'processed.csv')
+
+    def time(self, function, ops):
+        """ Best of self.repeat runs. Returns seconds, ops and seconds/op
+        """
+        best = None
+        for _ in range(self.repeat):
+            start = default_timer()
+            function()
+            elapsed = default_timer() - start
+            best = elapsed if best is None else min(best, elapsed)
+        return {'seconds': best, 'ops': ops, 'per_op': best / max(ops, 1)}
+
+    def heatmap_process_pitch(self):
+        def run():
+            heatmap = HeatMap()
+            for pitch in self.pitches:
+                heatmap.process_pitch(*pitch)
+        return self.time(run, len(self.pitches))
+
+    def heatmap_prob(self):
+        heatmap = self.heatmap
+        probs = [heatmap.prob_single, heatmap.prob_double,
+                 heatmap.prob_triple, heatmap.prob_homer, heatmap.prob_miss,
+                 heatmap.prob_out, heatmap.prob_foul, heatmap.prob_swing]
+
+        def run():
+            for px, pz, pitchType, pitchResult, paResult, hand in \
+                    self.pitches:
+                for prob in probs:
+                    try:
+                        prob(px, pz, pitchType, hand)
+                    except ZeroDivisionError:
+                        pass
+        return self.time(run, len(self.pitches) * len(probs))
+
+    def exp_runs_swing(self):
+        def run():
+            for pitch, state in zip(self.pitches, self.states):
+                if state[0] < 3:
+                    try:
+                        self.runExp.exp_runs_swing(
+                            *(state[:6] + (pitch[0], pitch[1], pitch[2],
+                                           pitch[5], self.heatmap)))
+                    except ZeroDivisionError:
+                        pass
+        return self.time(run, len(self.pitches))
+
+    def exp_runs_take(self):
+        def run():
+            for state in self.states:
+                if state[0] < 3:
+                    self.runExp.exp_runs_take(*state)
+        return self.time(run, len(self.states))
+
+    def season_process_file(self):
+        def run():
+            season = Season(run_exp_hits, run_exp_count)
+            season.process_file(self.data, self.processed)
+        return self.time(run, self.rows)
+
+    def run_expectancy_count(self):
+        return self.time(lambda: run_expectancy_count(self.data), self.rows)
+
+    def batters_create_full_dataframe(self):
+        if not os.path.exists(self.processed):
+            Season(run_exp_hits, run_exp_count).process_file(self.data,
+                                                             self.processed)
+        df = create_df(self.processed)
+
+        def run():
+            Batters(df, minPA=1).create_full_dataframe()
+        return self.time(run, len(df))
+
+    names = ['heatmap_process_pitch', 'heatmap_prob', 'exp_runs_swing',
+             'exp_runs_take', 'season_process_file', 'run_expectancy_count',
+             'batters_create_full_dataframe']
+
+    def run(self, names=None):
+        results = {}
+        for name in names or self.names:
+            results[name] = getattr(self, name)()
+            sys.stderr.write('%-32s %10.4fs %12.3gs/op\n' % (
+                name, results[name]['seconds'], results[name]['per_op']))
+        return results
+
+
+def compare(results, baseline, threshold):
+    """ Returns the benchmarks slower per op than the baseline by more than
+        threshold, as (name, baseline per op, new per op, ratio).
+    """
+    regressions = []
+    for name, result in sorted(results.items()):
+        if name not in baseline:
+            continue
+        old = baseline[name]['per_op']
+        ratio = result['per_op'] / old if old else float('inf')
+        if ratio > 1 + threshold:
+            regressions.append((name, old, result['per_op'], ratio))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--rows', type=int, default=700000,
+                        help='rows in the replicated season file')
+    parser.add_argument('--call-rows', type=int, default=50000,
+                        help='pitches used by the per-call benchmarks')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--synthetic', type=int, metavar='SEED',
+                        help='generate the season file with this seed '
+                             'instead of replicating the World Series')
+    parser.add_argument('--only', nargs='*', choices=Benchmarks.names,
+                        help='run only these benchmarks')
+    parser.add_argument('--output', default='bench_results.json')
+    parser.add_argument('--baseline', help='JSON results to compare with')
+    parser.add_argument('--threshold', type=float, default=0.2,
+                        help='allowed slowdown per op, 0.2 is 20%%')
+    args = parser.parse_args(argv)
+
+    workdir = tempfile.mkdtemp()
+    try:
+        bench = Benchmarks(workdir, args.rows, args.repeat, args.call_rows,
+                           args.synthetic)
+        results = bench.run(args.only)
+    finally:
+        shutil.rmtree(workdir)
+    output = {'rows': args.rows, 'repeat': args.repeat,
+              'synthetic': args.synthetic, 'results': results}
+    if args.baseline:
+        baseline = json.load(open(args.baseline))['results']
+        regressions = compare(results, baseline, args.threshold)
+        output['baseline'] = args.baseline
+        output['regressions'] = [name for name, _, _, _ in regressions]
+    json.dump(output, open(args.output, 'w'), indent=2, sort_keys=True)
+    if args.baseline and regressions:
+        for name, old, new, ratio in regressions:
+            sys.stderr.write('REGRESSION %s: %.3g -> %.3g s/op (x%.2f)\n' %
+                             (name, old, new, ratio))
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
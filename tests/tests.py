@@ -1,11 +1,38 @@
 import unittest
-from heatmap import HeatMap
-from run_expectancy import RunExpectancy
+import numpy as np
+from heatmap import HeatMap, LeagueHeatMap
+from run_expectancy import RunExpectancy, RunExpectancyTable, SwingCache
+from run_expectancy import run_expectancy_count, run_expectancy_count_table
+from run_expectancy import count_frame, COUNT_KEYS, HITS_KEYS
+from run_expectancy import run_expectancy_hits, RunExpectancyBuilder
+from reader import PitchReader
+from season import Season
+from store import HeatMapStore, write_store
+from stats import SeasonStats
+from batters import Batters
+from run_console import create_df
+from leaderboard import Leaderboards
+from windows import ApproachWindows
+from live import LiveScorer, QueueFeed, FeedServer, replay_socket
+from server import QueryService, QueryServer
+from processing import build_season
+from simulator import InningSimulator, pitch_pool, never_swing
+from simulator import BALL, STRIKE, OUT, HOMER
+from history import HeatMapHistory
+from generator import PitchModel, SeasonGenerator
 from pickle import load
+import pandas as pd
+import os
+import json
+import tempfile
+import threading
+import urllib2
+from StringIO import StringIO
 
 run_exp_hits = '../data/run_exp_hits_2015.pickle'
 run_exp_count = '../data/run_exp_count_2015.pickle'
 test_data = 'test_data.pickle'
+world_series = '2016-WS.csv'
 
 class Heatmap_unittest(unittest.TestCase):
     def setUp(self):
@@ -44,6 +71,91 @@ class Heatmap_unittest(unittest.TestCase):
         answer = 0.5
         self.assertEqual(foul, answer)
 
+    def test_outcome_distribution(self):
+        pitch = (0.647, 2.325, 'SL', 'R')
+        probs = self.heatmap.outcome_distribution(*pitch)
+        answer = [f(*pitch) for f in (self.heatmap.prob_single,
+                                      self.heatmap.prob_double,
+                                      self.heatmap.prob_triple,
+                                      self.heatmap.prob_homer,
+                                      self.heatmap.prob_miss,
+                                      self.heatmap.prob_out,
+                                      self.heatmap.prob_foul)]
+        self.assertListEqual(probs, answer)
+        self.assertRaises(ZeroDivisionError,
+                          self.heatmap.outcome_distribution, 0.647, 2.325,
+                          'CU', 'R')
+        probs = self.heatmap.outcome_distributions([0.647, 0.647],
+                                                   [2.325, 2.325],
+                                                   ['SL', 'CU'], ['R', 'R'])
+        self.assertListEqual(list(probs[0]), answer)
+        self.assertTrue(np.isnan(probs[1]).all())
+
+class LeagueHeatMap_unittest(unittest.TestCase):
+    def setUp(self):
+        self.rows = load(open(test_data, 'r'))
+        self.heatmap = HeatMap()
+        for params in self.rows:
+            self.heatmap.process_pitch(*params)
+        self.league = LeagueHeatMap()
+        cols = zip(*self.rows)
+        self.league.add_pitches([1] * len(self.rows), *cols)
+
+    def test_batch_matches_heatmap(self):
+        view = self.league[1]
+        for hand in ['L', 'R']:
+            self.assertItemsEqual(self.heatmap.maps[hand].keys(),
+                                  view.maps[hand].keys())
+            for pitchType, counts in self.heatmap.maps[hand].items():
+                self.assertTrue((view.maps[hand][pitchType] == counts).all())
+        self.assertEqual(view.prob_foul(0.647, 2.325, 'SL', 'R'),
+                         self.heatmap.prob_foul(0.647, 2.325, 'SL', 'R'))
+
+    def test_widen(self):
+        league = LeagueHeatMap(dtype=np.uint8)
+        for _ in range(2):
+            league.add_pitches([1] * 200, [0.0] * 200, [2.0] * 200,
+                               ['FF'] * 200, ['SS'] * 200, ['K'] * 200,
+                               ['R'] * 200)
+        self.assertEqual(league[1].maps['R']['FF'][8].max(), 400)
+
+    def test_widen_scalar(self):
+        league = LeagueHeatMap(dtype=np.uint8)
+        league[1] = HeatMap()
+        for _ in range(300):
+            league[1].process_pitch(0.0, 2.0, 'FF', 'SS', 'K', 'R')
+        self.assertEqual(league[1].maps['R']['FF'][8].max(), 300)
+        league[1].merge(league[1].to_heatmap())
+        league[2] = league[1]
+        self.assertEqual(league[2].maps['R']['FF'][8].max(), 600)
+        self.assertEqual(league[1].version('R', 'FF'), 301)
+
+    def test_season(self):
+        tmp = tempfile.mkdtemp()
+        path = lambda name: os.path.join(tmp, name)
+        serial = Season(run_exp_hits, run_exp_count)
+        serial.process_file(world_series, path('serial.csv'))
+        for kwargs in [{}, {'processes': 2}]:
+            season = Season(run_exp_hits, run_exp_count, stats=SeasonStats())
+            season.season = LeagueHeatMap()
+            season.process_file(world_series, path('league.csv'), **kwargs)
+            self.assertEqual(open(path('serial.csv')).read(),
+                             open(path('league.csv')).read())
+            self.assertEqual(season.stats.as_dict(season)['heatmaps'],
+                             len(serial.season))
+        season = Season(run_exp_hits, run_exp_count)
+        season.season = LeagueHeatMap()
+        season.process_season(world_series, path('league.pickle'))
+        heatmaps = load(open(path('league.pickle')))
+        self.assertItemsEqual(heatmaps.keys(), serial.season.keys())
+        for batterId, heatmap in heatmaps.items():
+            self.assertIs(type(heatmap), HeatMap)
+            for hand in heatmap.maps:
+                for pitchType, counts in heatmap.maps[hand].items():
+                    self.assertListEqual(
+                        counts.tolist(),
+                        serial.season[batterId].maps[hand][pitchType].tolist())
+
 class RunExp_unittest(unittest.TestCase):
     def setUp(self):
         self.runExp = RunExpectancy(run_exp_hits, run_exp_count)
@@ -72,3 +184,843 @@ class RunExp_unittest(unittest.TestCase):
         answer = [False, False, False]
         self.assertListEqual(runners, answer)
 
+
+    def test_dense_tables(self):
+        for key, value in self.runExp.runExpCount.iteritems():
+            if key[0] < 3:
+                self.assertEqual(self.runExp.exp_runs(*key), value)
+        for key, value in self.runExp.runExpBases.iteritems():
+            hit, first, second, third, outs = key
+            code = self.runExp.base_code(first, second, third)
+            self.assertEqual(self.runExp.basesTable[
+                self.runExp.hitCodes[hit], code, outs], value)
+
+    def test_missing_state(self):
+        self.runExp.countTable[1, 2, 1, 5] = np.nan
+        self.assertRaises(KeyError, self.runExp.exp_runs, 1, 2, 1, True,
+                          False, True)
+        self.assertRaises(KeyError, self.runExp.exp_runs, 1, 4, 1, True,
+                          False, True)
+
+    def test_hit_table(self):
+        table = self.runExp.base_outcome_table()
+        self.assertEqual(len(table), 4 * 8 * 3)
+        row = table.loc[('D', True, False, True, 1)]
+        value = self.runExp.compute_base_outcome(1, True, False, True, 'D')
+        self.assertEqual(row['runExp'], value)
+        self.assertEqual(self.runExp.base_outcomes(1, 0, 2, True, False, True,
+                                                   'D'), value)
+
+class ScoreBatch_unittest(unittest.TestCase):
+    def setUp(self):
+        self.runExp = RunExpectancy(run_exp_hits, run_exp_count)
+        self.heatmap = HeatMap()
+        for params in load(open(test_data, 'r')):
+            self.heatmap.process_pitch(*params)
+        self.states = [(0, 0, 0, False, False, False),
+                       (1, 3, 2, True, False, True),
+                       (2, 1, 2, True, True, True),
+                       (0, 2, 1, False, True, False)]
+        self.pitch = (0.647, 2.325, 'SL', 'R')
+
+    def test_matches_scalar(self):
+        hm = self.heatmap
+        probs = [f(*self.pitch) for f in (hm.prob_single, hm.prob_double,
+                                          hm.prob_triple, hm.prob_homer,
+                                          hm.prob_miss, hm.prob_out,
+                                          hm.prob_foul)]
+        cols = zip(*self.states)
+        prior, swing, take = self.runExp.score_batch(
+            *(cols + [[probs] * len(self.states), [0.3] * len(self.states)]))
+        for num, state in enumerate(self.states):
+            self.assertEqual(prior[num], self.runExp.exp_runs(*state))
+            params = state + self.pitch + (hm,)
+            self.assertEqual(swing[num], self.runExp.exp_runs_swing(*params))
+            self.assertEqual(take[num],
+                             self.runExp.exp_runs_take(*(state + (0.3,))))
+
+    def test_three_outs(self):
+        prior, swing, take = self.runExp.score_batch(
+            [3], [0], [0], [False], [False], [False], [[0.1] * 7], [0.5])
+        self.assertEqual(prior[0], 0)
+        self.assertTrue(np.isnan(swing[0]) and np.isnan(take[0]))
+
+    def test_out_of_range(self):
+        # Four balls would otherwise score as one out and no balls
+        prior, swing, take = self.runExp.score_batch(
+            [0, 0, 4, -1], [4, 0, 0, 0], [0, 3, 0, 0], [False] * 4,
+            [False] * 4, [False] * 4, [[0.1] * 7] * 4, [0.5] * 4)
+        for values in [prior, swing, take]:
+            self.assertTrue(np.isnan(values).all())
+
+class SwingCache_unittest(unittest.TestCase):
+    def setUp(self):
+        self.runExp = RunExpectancy(run_exp_hits, run_exp_count)
+        self.heatmap = HeatMap()
+        for params in load(open(test_data, 'r')):
+            self.heatmap.process_pitch(*params)
+        self.params = (1, 2, 1, True, False, False, 0.647, 2.325, 'SL', 'R',
+                       self.heatmap)
+
+    def test_hit_and_stale(self):
+        cache = SwingCache(self.runExp)
+        value = cache.exp_runs_swing(100, *self.params)
+        self.assertEqual(value, self.runExp.exp_runs_swing(*self.params))
+        self.assertEqual(cache.exp_runs_swing(100, *self.params), value)
+        self.assertEqual((cache.hits, cache.misses), (1, 1))
+        self.heatmap.process_pitch(0.647, 2.325, 'SL', 'X', 'Home Run', 'R')
+        cache.exp_runs_swing(100, *self.params)
+        self.assertEqual((cache.hits, cache.misses), (1, 2))
+
+    def test_eviction(self):
+        cache = SwingCache(self.runExp, maxEntries=2)
+        for batterId in range(5):
+            cache.exp_runs_swing(batterId, *self.params)
+        self.assertEqual(cache.stats()['entries'], 2)
+        self.assertEqual(cache.evictions, 3)
+        cache = SwingCache(self.runExp, maxBytes=1)
+        cache.exp_runs_swing(1, *self.params)
+        self.assertEqual(cache.stats()['bytes'], 0)
+
+    def test_zero_division(self):
+        cache = SwingCache(self.runExp)
+        params = self.params[:8] + ('KN',) + self.params[9:]
+        for _ in range(2):
+            self.assertRaises(ZeroDivisionError, cache.exp_runs_swing, 1,
+                              *params)
+        self.assertEqual(cache.hits, 1)
+
+class Simulator_unittest(unittest.TestCase):
+    def setUp(self):
+        self.runExp = RunExpectancy(run_exp_hits, run_exp_count)
+        self.heatmap = HeatMap()
+        for params in load(open(test_data, 'r')):
+            self.heatmap.process_pitch(*params)
+        self.pool = pitch_pool(world_series)
+        self.sim = InningSimulator(self.runExp, [self.heatmap], self.pool)
+
+    def test_transitions(self):
+        sim = self.sim
+        loaded = sim.encode(1, 3, 2, True, True, True)
+        self.assertEqual(sim.runs[loaded, BALL], 1)
+        self.assertEqual(sim.nextCodes[loaded, BALL],
+                         sim.encode(1, 0, 0, True, True, True))
+        self.assertEqual(sim.nextCodes[sim.encode(2, 1, 2, False, True,
+                                                  False), STRIKE], -1)
+        code = sim.encode(0, 2, 1, False, True, False)
+        self.assertEqual(sim.nextCodes[code, BALL],
+                         sim.encode(0, 3, 1, False, True, False))
+        self.assertEqual(sim.nextCodes[code, OUT],
+                         sim.encode(1, 0, 0, False, True, False))
+        self.assertEqual(sim.runs[code, HOMER], 2)
+
+    def test_simulate(self):
+        result = self.sim.run(2000, seed=3, blockSize=500)
+        self.assertEqual(len(result['runs']), 2000)
+        self.assertTrue((result['pitches'] >= 3).all())
+        self.assertTrue((result['runs'] >= 0).all())
+        again = self.sim.run(2000, seed=3, blockSize=500, processes=2)
+        self.assertTrue(np.array_equal(result['runs'], again['runs']))
+        sim = InningSimulator(self.runExp, [self.heatmap], self.pool,
+                              never_swing)
+        self.assertGreater(sim.run(500)['meanPitches'], 4)
+
+class History_unittest(unittest.TestCase):
+    def setUp(self):
+        self.history = HeatMapHistory(spacing=7).add_file(world_series)
+        self.batterId = max(self.history.logs, key=lambda x: len(
+            self.history.logs[x]['rows']))
+
+    def replay(self, stop):
+        heatmap = HeatMap()
+        chunk = next(PitchReader(world_series).chunks(100000))
+        for idx in np.flatnonzero(chunk.valid[:stop]):
+            if chunk['batterId'][idx] == self.batterId:
+                heatmap.process_pitch(
+                    chunk['px'][idx], chunk['pz'][idx],
+                    chunk['pitchType'][idx], chunk['pitchResult'][idx],
+                    chunk['paResult'][idx], chunk['pitcherHand'][idx])
+        return heatmap
+
+    def assertMapsEqual(self, first, second):
+        for hand in ['L', 'R']:
+            for pitchType in set(first.maps[hand]) | set(second.maps[hand]):
+                empty = first.generate_new_map()
+                self.assertTrue(np.array_equal(
+                    first.maps[hand].get(pitchType, empty),
+                    second.maps[hand].get(pitchType, empty)))
+
+    def test_as_of_row(self):
+        rows = self.history.logs[self.batterId]['rows']
+        for row in [rows[3], rows[7], rows[-1], rows[-1] + 1]:
+            self.assertMapsEqual(self.history.as_of(self.batterId, row=row),
+                                 self.replay(row))
+        self.assertRaises(KeyError, self.history.as_of, -1)
+
+    def test_as_of_date(self):
+        batterId = self.batterId
+        empty = self.history.as_of(batterId, date='2016-10-25')
+        self.assertFalse(any(counts.any() for maps in empty.maps.values()
+                             for counts in maps.values()))
+        self.assertMapsEqual(self.history.as_of(batterId, date=20161103),
+                             self.history.as_of(batterId))
+
+    def test_as_of_last_season(self):
+        # A batter only in lastSeason has no log but must still be copied
+        heatmap = self.replay(2137)
+        history = HeatMapHistory(lastSeason={1: heatmap})
+        first = history.as_of(1)
+        self.assertMapsEqual(first, heatmap)
+        first.process_pitch(0.0, 2.5, 'FF', 'SS', '', 'R')
+        self.assertMapsEqual(history.as_of(1), heatmap)
+
+
+class RunExpTable_unittest(unittest.TestCase):
+    def test_finalize(self):
+        # The means a direct groupby over the file gives
+        df = pd.read_csv(world_series)
+        df['runsHome'].fillna(0, inplace=True)
+        df['runs'] = df.groupby(['gameString', 'inning', 'side'])[
+            'runsHome'].transform(sum)
+        answer = df.groupby(COUNT_KEYS)['runs'].agg(np.mean)
+        table = run_expectancy_count_table(world_series).finalize()
+        pd.util.testing.assert_series_equal(table, answer, check_names=False)
+        hits = df[df['paResult'].isin(['S', 'D', 'T', 'HR'])]
+        answer = hits.groupby(HITS_KEYS)['runsHome'].agg(np.mean)
+        table = run_expectancy_hits(world_series)
+        pd.util.testing.assert_series_equal(table, answer, check_names=False)
+
+    def test_merge(self):
+        df = pd.read_csv(world_series)
+        games = df['gameString'].unique()
+        first = df[df['gameString'].isin(games[:4])]
+        second = df[df['gameString'].isin(games[4:])]
+        whole = RunExpectancyTable(COUNT_KEYS, 'runs').update(count_frame(df))
+        part = RunExpectancyTable(COUNT_KEYS, 'runs')
+        part.update(count_frame(first))
+        merged = part.merge(RunExpectancyTable(COUNT_KEYS, 'runs').update(
+            count_frame(second)))
+        diff = (merged.finalize() - whole.finalize()).abs().max()
+        self.assertAlmostEqual(diff, 0)
+        # Weights scale a table's influence on the means
+        weighted = part.merge(part, weight=3.0)
+        self.assertEqual(weighted.counts.sum(), 4 * part.counts.sum())
+        diff = (weighted.finalize() - part.finalize()).abs().max()
+        self.assertAlmostEqual(diff, 0)
+
+    def test_builder_short_row(self):
+        header = ['gameString', 'inning', 'side', 'runsHome', 'outs', 'balls',
+                  'strikes', 'paResult', 'manOnFirst', 'manOnSecond',
+                  'manOnThird']
+        builder = RunExpectancyBuilder(header)
+        self.assertRaises(IndexError, builder.add_row,
+                          ['g', '1', 'T', '1', '0', '0', '0', 'S'])
+        self.assertEqual(builder.halfInningRuns, [])
+        builder.add_row(['g', '1', 'T', '1', '0', '0', '0', 'S', 'false',
+                         'false', 'false'])
+        self.assertEqual(builder.halfInningRuns, [1.0])
+
+class Season_unittest(unittest.TestCase):
+    def setUp(self):
+        self.season = Season(run_exp_hits, run_exp_count)
+        self.tmp = tempfile.mkdtemp()
+
+    def read(self, name):
+        return open(os.path.join(self.tmp, name)).read()
+
+    def test_reader(self):
+        reader = PitchReader(world_series)
+        rows = [row for line, row in reader]
+        self.assertEqual(len(rows), 2137)
+        for row in rows:
+            self.assertEqual(len(row), len(reader.header))
+        chunks = list(PitchReader(world_series).chunks(500))
+        self.assertEqual([len(x) for x in chunks], [500] * 4 + [137])
+
+    def test_chunked_output(self):
+        self.season.process_file(world_series,
+                                 os.path.join(self.tmp, 'serial.csv'))
+        season = Season(run_exp_hits, run_exp_count)
+        season.process_file(world_series, os.path.join(self.tmp, 'chunk.csv'),
+                            chunksize=300)
+        self.assertEqual(self.read('serial.csv'), self.read('chunk.csv'))
+
+    def test_parallel_output(self):
+        self.season.process_file(world_series,
+                                 os.path.join(self.tmp, 'serial.csv'))
+        season = Season(run_exp_hits, run_exp_count)
+        season.process_file(world_series,
+                            os.path.join(self.tmp, 'parallel.csv'),
+                            processes=3)
+        self.assertEqual(self.read('serial.csv'), self.read('parallel.csv'))
+        self.assertItemsEqual(self.season.season.keys(), season.season.keys())
+
+    def test_parallel_padded_ids(self):
+        # Rows of one batter written as '0451594' and '451594' are sharded
+        # together, as the heat maps key on int(batterId)
+        lines = open(world_series).readlines()
+        padded = os.path.join(self.tmp, 'padded.csv')
+        open(padded, 'w').writelines(
+            lines[:1] + [x.replace(',451594,', ',0451594,') if num % 2 else x
+                         for num, x in enumerate(lines[1:])])
+        for name, processes in [('serial.csv', None), ('parallel.csv', 3)]:
+            Season(run_exp_hits, run_exp_count).process_file(
+                padded, os.path.join(self.tmp, name), processes=processes)
+        self.assertEqual(self.read('serial.csv'), self.read('parallel.csv'))
+
+    def test_stats(self):
+        reports = []
+        counts = []
+        for kwargs in [{}, {'chunksize': 400}, {'processes': 2}]:
+            reports.append([])
+            stats = SeasonStats(every=1000, emit=reports[-1].append)
+            season = Season(run_exp_hits, run_exp_count, stats=stats)
+            season.process_file(world_series,
+                                os.path.join(self.tmp, 'stats.csv'),
+                                **kwargs)
+            result = stats.as_dict(season)
+            self.assertEqual(result['rowsRead'], 2137)
+            self.assertEqual(result['rowsRead'], result['rowsSkipped'] +
+                             result['rowsScored'] + result['rowsBlanked'])
+            self.assertEqual(result['heatmaps'], len(season.season))
+            counts.append((result['skipped'], result['blanked']))
+            self.assertGreater(result['seconds']['parse'], 0)
+        self.assertEqual(counts[0], counts[1])
+        self.assertEqual(counts[0], counts[2])
+        self.assertIn('new batter', counts[0][1])
+        self.assertEqual([len(x) for x in reports[:2]], [2, 2])
+        # Workers' rows are reported as their results are merged
+        self.assertGreater(len(reports[2]), 0)
+        self.assertEqual(reports[2][-1]['rowsRead'], 2137)
+
+    def test_checkpoint_resume(self):
+        self.season.process_file(world_series,
+                                 os.path.join(self.tmp, 'serial.csv'))
+        lines = open(world_series).readlines()
+        partial = os.path.join(self.tmp, 'partial.csv')
+        output = os.path.join(self.tmp, 'resumed.csv')
+        checkpoints = os.path.join(self.tmp, 'checkpoints')
+        open(partial, 'w').writelines(lines[:1000])
+        season = Season(run_exp_hits, run_exp_count)
+        season.process_file(partial, output, checkpointDir=checkpoints)
+        first = self.read('resumed.csv')
+        open(partial, 'a').writelines(lines[1000:])
+        season = Season(run_exp_hits, run_exp_count)
+        season.process_file(partial, output, checkpointDir=checkpoints)
+        self.assertEqual(self.read('serial.csv'), self.read('resumed.csv'))
+        state = season.rollback(checkpoints, 0, output)
+        self.assertEqual(state['rows'], 999)
+        self.assertEqual(first, self.read('resumed.csv'))
+        season = Season(run_exp_hits, run_exp_count)
+        season.process_file(partial, output, checkpointDir=checkpoints,
+                            chunksize=250)
+        self.assertEqual(self.read('serial.csv'), self.read('resumed.csv'))
+        self.assertEqual(season.checkpoint_numbers(checkpoints), [0, 1])
+
+    def test_checkpoint_checks(self):
+        self.season.process_file(world_series,
+                                 os.path.join(self.tmp, 'serial.csv'))
+        lines = open(world_series).readlines()
+        partial = os.path.join(self.tmp, 'partial.csv')
+        output = os.path.join(self.tmp, 'resumed.csv')
+        checkpoints = os.path.join(self.tmp, 'checkpoints')
+        # The last row is still being written
+        open(partial, 'w').writelines(lines[:1000] + [lines[1000][:30]])
+        season = Season(run_exp_hits, run_exp_count)
+        season.process_file(partial, output, checkpointDir=checkpoints)
+        self.assertEqual(season.load_checkpoint(checkpoints)['rows'], 999)
+        open(partial, 'a').write(lines[1000][30:])
+        for num, start in enumerate(range(1001, len(lines), 200)):
+            open(partial, 'a').writelines(lines[start:start + 200])
+            season.process_file(partial, output, checkpointDir=checkpoints,
+                                processes=2 if num % 2 else None)
+        self.assertEqual(self.read('serial.csv'), self.read('resumed.csv'))
+        self.assertEqual(season.checkpoint_numbers(checkpoints),
+                         [2, 3, 4, 5, 6])
+        self.assertRaises(ValueError, season.process_file, world_series,
+                          output, checkpointDir=checkpoints)
+        open(partial, 'w').writelines(lines[:-1] + ['changed' + lines[-1]])
+        self.assertRaises(ValueError, season.process_file, partial, output,
+                          checkpointDir=checkpoints)
+
+    def test_checkpoint_swing_cache(self):
+        # Rolling back restores older heat map versions, which must not
+        # hit runExpSwing values cached from the discarded rows
+        self.season.process_file(world_series,
+                                 os.path.join(self.tmp, 'serial.csv'))
+        lines = open(world_series).readlines()
+        partial = os.path.join(self.tmp, 'partial.csv')
+        output = os.path.join(self.tmp, 'resumed.csv')
+        checkpoints = os.path.join(self.tmp, 'checkpoints')
+        open(partial, 'w').writelines(lines[:1000])
+        season = Season(run_exp_hits, run_exp_count, swingCache=2 ** 24)
+        season.process_file(partial, output, checkpointDir=checkpoints)
+        open(partial, 'a').writelines(lines[1500:])
+        season.process_file(partial, output, checkpointDir=checkpoints)
+        open(partial, 'w').writelines(lines)
+        season.rollback(checkpoints, 0, output)
+        self.assertEqual(season.swingCache.stats()['entries'], 0)
+        season.process_file(partial, output, checkpointDir=checkpoints)
+        self.assertEqual(self.read('serial.csv'), self.read('resumed.csv'))
+
+    def test_build_season(self):
+        self.season.process_file(world_series,
+                                 os.path.join(self.tmp, 'serial.csv'))
+        outputs = [os.path.join(self.tmp, x) for x in
+                   ['built.csv', 'count.pickle', 'hits.pickle',
+                    'heatmaps.pickle']]
+        season = Season(run_exp_hits, run_exp_count)
+        build_season(season, world_series, *outputs)
+        self.assertEqual(self.read('serial.csv'), self.read('built.csv'))
+        self.assertTrue(load(open(outputs[1])).equals(
+            run_expectancy_count(world_series)))
+        self.assertTrue(load(open(outputs[2])).equals(
+            run_expectancy_hits(world_series)))
+        heatmaps = load(open(outputs[3]))
+        self.assertItemsEqual(heatmaps.keys(), self.season.season.keys())
+        for batterId, heatmap in heatmaps.items():
+            maps = self.season.season[batterId].maps
+            for hand in heatmap.maps:
+                for pitchType, counts in heatmap.maps[hand].items():
+                    self.assertTrue((maps[hand][pitchType] == counts).all())
+
+    def test_columnar(self):
+        self.season.process_file(world_series,
+                                 os.path.join(self.tmp, 'serial.csv'))
+        columnar = os.path.join(self.tmp, 'columnar')
+        season = Season(run_exp_hits, run_exp_count)
+        season.process_file(world_series, None, chunksize=300,
+                            columnar=columnar)
+        df = create_df(os.path.join(self.tmp, 'serial.csv'))
+        mapped = create_df(columnar)
+        self.assertEqual(len(mapped), len(df))
+        self.assertEqual(str(mapped['batter'].dtype), 'category')
+        self.assertListEqual(list(mapped['batter']), list(df['batter']))
+        self.assertTrue(mapped['paResult'].isnull().equals(
+            df['paResult'].isnull()))
+        self.assertTrue(np.allclose(mapped['runExpSwing'], df['runExpSwing'],
+                                    equal_nan=True))
+        for x, y in zip(Batters(df, minPA=5).create_dataframes(),
+                        Batters(mapped, minPA=5).create_dataframes()):
+            self.assertTrue(x.equals(y))
+
+    def test_entities(self):
+        keys = ['pitcherId', 'catcherId', 'umpireId']
+        self.season.process_file(world_series,
+                                 os.path.join(self.tmp, 'serial.csv'))
+        results = []
+        for kwargs in [{}, {'chunksize': 300}, {'processes': 2}]:
+            season = Season(run_exp_hits, run_exp_count, entityKeys=keys)
+            season.process_file(world_series,
+                                os.path.join(self.tmp, 'entities.csv'),
+                                **kwargs)
+            self.assertEqual(self.read('serial.csv'),
+                             self.read('entities.csv'))
+            results.append(season)
+        maps = lambda heatmaps: dict(
+            ((entityId, hand, pitchType), counts.tolist())
+            for entityId, heatmap in heatmaps.items()
+            for hand in heatmap.maps
+            for pitchType, counts in heatmap.maps[hand].items())
+        batters = maps(self.season.season)
+        for season in results:
+            self.assertEqual(maps(season.season), batters)
+            for key in keys:
+                self.assertEqual(maps(season.entities[key]),
+                                 maps(results[0].entities[key]))
+        totals = [sum(heatmap.maps[hand][pitchType][8].sum()
+                      for heatmap in heatmaps.values()
+                      for hand in heatmap.maps
+                      for pitchType in heatmap.maps[hand])
+                  for heatmaps in [self.season.season] +
+                  results[0].entities.values()]
+        self.assertEqual(len(set(totals)), 1)
+        paths = results[0].dump_entities(os.path.join(self.tmp, 'maps'))
+        self.assertEqual([os.path.basename(x) for x in paths],
+                         ['heatmaps_pitcherId.pickle',
+                          'heatmaps_catcherId.pickle',
+                          'heatmaps_umpireId.pickle'])
+        self.assertItemsEqual(load(open(paths[0])).keys(),
+                              results[0].entities['pitcherId'].keys())
+        # Without entity ids only the batter's heat map is updated
+        season = Season(run_exp_hits, run_exp_count, entityKeys=keys)
+        season.process_batter(1, 0.0, 2.5, 'FF', 'SS', '', 'R')
+        self.assertEqual(season.season.keys(), [1])
+        self.assertEqual(season.entities, dict((x, {}) for x in keys))
+
+    def test_heatmap_store(self):
+        pickled = os.path.join(self.tmp, 'heatmaps.pickle')
+        store = os.path.join(self.tmp, 'store')
+        self.season.process_season(world_series, pickled)
+        os.makedirs(store)
+        self.season.save_heatmaps(store)
+        season = Season(run_exp_hits, run_exp_count, lastSeason=store)
+        self.assertEqual(len(season.season.loaded), 0)
+        self.assertItemsEqual(season.season.keys(), self.season.season.keys())
+        batterId = [x for x in season.season.keys()
+                    if 'FF' in self.season.season[x].maps['R']][0]
+        self.assertTrue((season.season[batterId].maps['R']['FF'] ==
+                         self.season.season[batterId].maps['R']['FF']).all())
+        self.assertEqual(season.season.flush(), 0)
+        for name, lastSeason in [('pickled.csv', pickled),
+                                 ('stored.csv', store)]:
+            season = Season(run_exp_hits, run_exp_count,
+                            lastSeason=lastSeason)
+            season.process_file(world_series, os.path.join(self.tmp, name))
+        self.assertEqual(self.read('pickled.csv'), self.read('stored.csv'))
+        self.assertEqual(season.season.flush(), len(self.season.season))
+        reopened = Season(run_exp_hits, run_exp_count, lastSeason=store)
+        self.assertEqual(reopened.season[batterId].maps['R']['FF'].tolist(),
+                         (2 * self.season.season[batterId].maps['R']['FF'])
+                         .tolist())
+
+    def test_replace_store(self):
+        store = os.path.join(self.tmp, 'store')
+        self.season.process_file(world_series, os.path.join(self.tmp, 'a'))
+        heatmaps = dict(self.season.season.items())
+        write_store(heatmaps, store)
+        kept = sorted(heatmaps)[:3]
+        write_store(dict((x, heatmaps[x]) for x in kept), store)
+        self.assertListEqual(list(HeatMapStore(store).batter_ids()), kept)
+        self.assertEqual(HeatMapStore(store).blocks,
+                         sum(len(y) for x in kept
+                             for y in heatmaps[x].maps.values()))
+        self.assertItemsEqual(os.listdir(self.tmp), ['a', 'store'])
+
+    def test_checkpoint_store(self):
+        store = os.path.join(self.tmp, 'store')
+        lines = open(world_series).readlines()
+        partial = os.path.join(self.tmp, 'partial.csv')
+        output = os.path.join(self.tmp, 'processed.csv')
+        checkpoints = os.path.join(self.tmp, 'checkpoints')
+        self.season.process_file(world_series, os.path.join(self.tmp, 'a'))
+        write_store(dict(self.season.season.items()), store)
+        open(partial, 'w').writelines(lines[:1000])
+        season = Season(run_exp_hits, run_exp_count, lastSeason=store)
+        season.process_file(partial, output, checkpointDir=checkpoints)
+        open(partial, 'a').writelines(lines[1000:])
+        season.process_file(partial, output, checkpointDir=checkpoints)
+        season.rollback(checkpoints, 0, output)
+        season.process_file(partial, output, checkpointDir=checkpoints)
+        season.save_heatmaps(store)
+        # The store now holds counts from after checkpoint 0
+        self.assertRaises(ValueError, season.rollback, checkpoints, 0, output)
+        self.assertEqual(season.checkpoint_numbers(checkpoints), [0, 1])
+
+
+class Generator_unittest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.model = PitchModel(world_series)
+
+    def generate(self, name, seed, **kwargs):
+        path = os.path.join(self.tmp, name)
+        SeasonGenerator(self.model, seed=seed, teams=4, games=3).write(
+            path, **kwargs)
+        return path
+
+    def test_reproducible(self):
+        first = open(self.generate('first.csv', 1)).read()
+        self.assertEqual(first, open(self.generate('again.csv', 1)).read())
+        self.assertNotEqual(first, open(self.generate('other.csv', 2)).read())
+        path = self.generate('rows.csv', 1, rows=500)
+        self.assertEqual(open(path).read(),
+                         ''.join(first.splitlines(True)[:501]))
+
+    def test_games(self):
+        path = self.generate('season.csv', 3, seasons=2)
+        df = pd.read_csv(path)
+        self.assertListEqual(list(df.columns),
+                             list(pd.read_csv(world_series).columns))
+        self.assertEqual(df['gameString'].nunique(), 2 * 3 * 2)
+        games = df.groupby('gameString').last()
+        self.assertFalse((games['visitingTeamFinalRuns'] ==
+                          games['homeTeamFinalRuns']).any())
+        self.assertTrue((games['inning'] >= 9).all())
+        self.assertTrue(df['outs'].between(0, 2).all())
+        season = Season(run_exp_hits, run_exp_count)
+        season.process_file(path, os.path.join(self.tmp, 'processed.csv'))
+        self.assertEqual(len(season.season), df['batterId'].nunique())
+
+class Live_unittest(unittest.TestCase):
+    def setUp(self):
+        tmp = tempfile.mkdtemp()
+        processed = os.path.join(tmp, 'processed.csv')
+        Season(run_exp_hits, run_exp_count).process_file(world_series,
+                                                         processed)
+        self.scores = [line.strip().split(',')[-3:]
+                       for line in open(processed).readlines()[1:]]
+
+    def check(self, events):
+        events = [x for x in events if 'skipped' not in x]
+        self.assertEqual(len(events), len(self.scores))
+        for event, scores in zip(events, self.scores):
+            self.assertEqual(event['runExpPrior'], float(scores[0]))
+            if scores[1]:
+                self.assertEqual(event['runExpSwing'], float(scores[1]))
+            else:
+                self.assertIsNone(event['runExpSwing'])
+
+    def test_queue_feed(self):
+        events = []
+        scorer = LiveScorer(Season(run_exp_hits, run_exp_count),
+                            publish=events.append)
+        feed = QueueFeed(scorer)
+        feed.start()
+        lines = open(world_series).readlines()
+        scorer.set_header(lines[0])
+        for line in lines[1:]:
+            feed.put(line)
+        feed.stop()
+        self.check(events)
+        self.assertEqual(scorer.latency_stats()['events'], len(self.scores))
+
+    def test_socket_feed(self):
+        scorer = LiveScorer(Season(run_exp_hits, run_exp_count))
+        server = FeedServer(('localhost', 0), scorer)
+        thread = threading.Thread(target=server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        out = StringIO()
+        rows = replay_socket(world_series, server.server_address, out=out)
+        server.shutdown()
+        server.server_close()
+        self.assertEqual(rows, 2137)
+        self.check([json.loads(x) for x in out.getvalue().splitlines()])
+
+    def test_socket_multiline_rows(self):
+        # Quoted descriptions may span lines
+        lines = open(world_series).readlines()
+        multiline = os.path.join(tempfile.mkdtemp(), 'multiline.csv')
+        with open(multiline, 'w') as out:
+            out.write(lines[0])
+            for line in lines[1:]:
+                line = line.rstrip('\r\n')
+                if line.endswith(','):
+                    line += '"Line one\nline two"'
+                out.write(line + '\n')
+        scorer = LiveScorer(Season(run_exp_hits, run_exp_count))
+        server = FeedServer(('localhost', 0), scorer)
+        thread = threading.Thread(target=server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        out = StringIO()
+        rows = replay_socket(multiline, server.server_address, out=out)
+        server.shutdown()
+        server.server_close()
+        self.assertEqual(rows, 2137)
+        self.check([json.loads(x) for x in out.getvalue().splitlines()])
+
+
+    def test_socket_bad_state(self):
+        # A state missing from the tables skips the row, not the feed
+        lines = open(world_series).readlines()
+        header = lines[0].strip().split(',')
+        row = lines[1].split(',')
+        row[header.index('balls')] = '7'
+        feed = os.path.join(tempfile.mkdtemp(), 'feed.csv')
+        open(feed, 'w').writelines(lines[:1] + [','.join(row)] + lines[1:])
+        scorer = LiveScorer(Season(run_exp_hits, run_exp_count))
+        server = FeedServer(('localhost', 0), scorer)
+        thread = threading.Thread(target=server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        out = StringIO()
+        replay_socket(feed, server.server_address, out=out)
+        server.shutdown()
+        server.server_close()
+        events = [json.loads(x) for x in out.getvalue().splitlines()]
+        self.assertEqual(events[0], {'skipped': 'state not in the run '
+                                                'expectancy tables'})
+        self.check(events)
+
+
+class Batters_unittest(unittest.TestCase):
+    def setUp(self):
+        tmp = tempfile.mkdtemp()
+        processed = os.path.join(tmp, 'processed.csv')
+        Season(run_exp_hits, run_exp_count).process_file(world_series,
+                                                         processed)
+        self.batters = Batters(create_df(processed), minPA=10)
+
+    def test_full_dataframe(self):
+        full = self.batters.create_full_dataframe()
+        objs = [self.batters.get_swing_value_added().agg(sum),
+                self.batters.get_swing_value_lost().agg(sum),
+                self.batters.get_take_value_added().agg(sum),
+                self.batters.get_take_value_lost().agg(sum),
+                self.batters.get_swing_value_total().agg(sum),
+                self.batters.get_take_value_total().agg(sum),
+                self.batters.get_value_net_total().agg(sum)]
+        answer = pd.concat(objs, keys=self.batters.metrics, axis=1).round(2)
+        # concat drops the index name where the batters differ
+        pd.util.testing.assert_frame_equal(full, answer, check_names=False)
+        self.assertEqual(full.index.name, 'batter')
+
+    def test_windows(self):
+        windows = ApproachWindows(self.batters)
+        df = self.batters.df
+        dates = pd.to_datetime(df['gameDate'])
+        inWindow = (dates >= '2016-10-28') & (dates < '2016-11-02')
+        answer = Batters(df[inWindow], minPA=1).create_full_dataframe()
+        snapshot = windows.snapshot('2016-10-28', '2016-11-01')
+        for metric in self.batters.metrics:
+            values = snapshot.loc[answer.index, metric].round(2)
+            values = values.where(snapshot.loc[answer.index,
+                                               metric + '_count'] > 0)
+            self.assertTrue(np.allclose(values.fillna(0),
+                                        answer[metric].fillna(0)))
+        batter = answer.index[0]
+        last = windows.query(batter, lastPitches=10)
+        rows = df[df['batter'] == batter].tail(10)
+        self.assertEqual(last['NetTotal_count'],
+                         (rows['swing'] | rows['take']).sum())
+
+    def test_windows_season(self):
+        # Enough batters over a full season to overflow nanosecond keys
+        rng = np.random.RandomState(0)
+        n = 50000
+        batterIds = rng.randint(0, 700, n)
+        swing = rng.rand(n) < 0.5
+        df = pd.DataFrame({
+            'batterId': batterIds,
+            'batter': ['Batter %03d' % x for x in batterIds],
+            'gameDate': (pd.Timestamp('2016-04-03') +
+                         pd.to_timedelta(rng.randint(0, 200, n), unit='D')
+                         ).strftime('%Y-%m-%d 19:05:00'),
+            'paResult': 'S', 'swing': swing, 'take': ~swing,
+            'shouldSwing': rng.rand(n) < 0.5, 'shouldTake': rng.rand(n) < 0.5,
+            'dSwing': rng.randn(n), 'dTake': rng.randn(n)})
+        windows = ApproachWindows(Batters(df, minPA=1))
+        snapshot = windows.snapshot('2016-06-01', '2016-08-31')
+        dates = pd.to_datetime(df['gameDate'])
+        inWindow = (dates >= '2016-06-01') & (dates < '2016-09-01')
+        answer = df[inWindow].groupby('batter').size()
+        self.assertTrue((snapshot.loc[answer.index, 'NetTotal_count'] ==
+                         answer).all())
+        self.assertEqual(snapshot['NetTotal_count'].sum(), inWindow.sum())
+
+    def test_counts(self):
+        count = self.batters.create_count_dataframe()
+        netTotal = self.batters.get_value_net_total().agg(len)
+        self.assertListEqual(list(count['NetTotal_count']), list(netTotal))
+        self.assertTrue((count['dSwing_count'] + count['dTake_count'] ==
+                         count['NetTotal_count']).all())
+
+    def test_bootstrap(self):
+        full = self.batters.create_full_dataframe()
+        bounds = self.batters.create_full_dataframe(ci=0.95, resamples=100)
+        self.assertTrue(bounds[full.columns].equals(full))
+        known = full['NetTotal'].notnull()
+        self.assertTrue((bounds['NetTotal_low'][known] <=
+                         bounds['NetTotal_high'][known]).all())
+        self.assertTrue(bounds['dSwing|Swing_low'][
+            full['dSwing|Swing'].isnull()].isnull().all())
+        means = self.batters.create_mean_dataframe(ci=0.9, resamples=100)
+        self.assertIn('NetTotal_mean_high', means.columns)
+        names, sums, _ = self.batters.bootstrap(100)
+        self.assertEqual(sums.shape, (100, len(full), 7))
+        parallel = Batters(self.batters.orig_df, minPA=10)
+        self.assertTrue(np.array_equal(parallel.bootstrap(100,
+                                                          processes=2)[1],
+                                       sums))
+
+
+class Leaderboards_unittest(unittest.TestCase):
+    def setUp(self):
+        tmp = tempfile.mkdtemp()
+        self.processed = os.path.join(tmp, 'processed.csv')
+        Season(run_exp_hits, run_exp_count).process_file(world_series,
+                                                         self.processed)
+        self.leaderboards = Leaderboards(source=self.processed, minPA=5)
+
+    def test_board(self):
+        full = self.leaderboards.batters.create_full_dataframe()
+        board = self.leaderboards.board('NetTotal', 5)
+        answer = full['NetTotal'].sort_values(ascending=False).head(5)
+        self.assertListEqual(list(board.index), list(answer.index))
+        bottom = self.leaderboards.board('dTake', 3, top=False,
+                                         table='mean', split='pitcherHand',
+                                         value='R')
+        self.assertTrue((bottom.diff().dropna() >= 0).all())
+        self.assertIn('0-0', self.leaderboards.split_values('count'))
+
+    def test_invalidate(self):
+        board = self.leaderboards.board('NetTotal', 5)
+        self.assertIs(board, self.leaderboards.board('NetTotal', 5))
+        lines = open(self.processed).readlines()
+        open(self.processed, 'w').writelines(lines[:1000])
+        os.utime(self.processed, (0, 0))
+        self.assertIsNot(board, self.leaderboards.board('NetTotal', 5))
+
+    def test_invalidate_columnar(self):
+        columnar = os.path.join(os.path.dirname(self.processed), 'columns')
+        Season(run_exp_hits, run_exp_count).process_file(
+            world_series, None, columnar=columnar)
+        leaderboards = Leaderboards(source=columnar, minPA=5)
+        board = leaderboards.board('NetTotal', 5)
+        self.assertIs(board, leaderboards.board('NetTotal', 5))
+        lines = open(world_series).readlines()
+        partial = os.path.join(os.path.dirname(self.processed), 'partial.csv')
+        open(partial, 'w').writelines(lines[:1000])
+        Season(run_exp_hits, run_exp_count).process_file(
+            partial, None, columnar=columnar)
+        # The columns were rewritten in place, so the directory is as it was
+        self.assertIsNot(board, leaderboards.board('NetTotal', 5))
+
+class QueryServer_unittest(unittest.TestCase):
+    def setUp(self):
+        tmp = tempfile.mkdtemp()
+        processed = os.path.join(tmp, 'processed.csv')
+        self.season = Season(run_exp_hits, run_exp_count)
+        self.season.process_file(world_series, processed)
+        self.batters = Batters(create_df(processed), minPA=5)
+        service = QueryService(self.batters, self.season)
+        self.server = QueryServer(('localhost', 0), service)
+        thread = threading.Thread(target=self.server.serve_forever)
+        thread.daemon = True
+        thread.start()
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def get(self, path):
+        url = 'http://%s:%d%s' % (self.server.server_address + (path,))
+        try:
+            response = urllib2.urlopen(url)
+        except urllib2.HTTPError as e:
+            return e.code, json.load(e)
+        return response.getcode(), json.load(response)
+
+    def test_queries(self):
+        full = self.batters.create_full_dataframe()
+        name = full['NetTotal'].idxmax()
+        status, board = self.get('/leaderboard?metric=NetTotal&n=3')
+        self.assertEqual(status, 200)
+        self.assertEqual(board[0][0], name)
+        status, batter = self.get('/batters/' + urllib2.quote(name))
+        self.assertAlmostEqual(batter['value']['NetTotal'],
+                               full.loc[name, 'NetTotal'])
+        self.assertEqual(self.get('/batters/nobody')[0], 404)
+        self.assertEqual(self.get('/batters?table=bad')[0], 400)
+        self.get('/leaderboard?metric=NetTotal&n=3')
+        self.assertEqual(self.get('/stats')[1]['hits'], 1)
+
+    def test_expectancy(self):
+        batterId = 451594
+        state = (1, 2, 1, True, False, False)
+        query = ('/expectancy?batterId=%d&outs=1&balls=2&strikes=1&first=1'
+                 '&second=0&third=0&px=0.0&pz=2.5&pitchType=FF&hand=R'
+                 '&probCalledStrike=0.6' % batterId)
+        status, result = self.get(query)
+        self.assertEqual(status, 200)
+        runExp = self.season.runExp
+        self.assertAlmostEqual(result['runExpTake'],
+                               runExp.exp_runs_take(*(state + (0.6,))))
+        try:
+            swing = runExp.exp_runs_swing(*(state + (
+                0.0, 2.5, 'FF', 'R', self.season.season[batterId])))
+            self.assertAlmostEqual(result['runExpSwing'], swing)
+        except ZeroDivisionError:
+            self.assertIsNone(result['runExpSwing'])
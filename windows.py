@@ -0,0 +1,127 @@
+import numpy as np
+import pandas as pd
+
+# Nanoseconds in a day, to key searches on day numbers
+DAY = np.int64(86400 * 10 ** 9)
+
+
+class ApproachWindows(object):
+    """ Per-batter, date-ordered prefix sums of every Batters metric, so the
+        sums, counts and means over any date range or any number of recent
+        pitches take a binary search per batter instead of a scan.
+    """
+    def __init__(self, batters):
+        self.metrics = batters.metrics
+        df = batters.df
+        codes = batters.classify()
+        batterCodes, names = pd.factorize(df['batter'], sort=True)
+        dates = pd.to_datetime(df['gameDate']).values.astype('int64')
+        keep = batterCodes >= 0
+        # Order by batter then date, keeping file order within a date
+        order = np.lexsort((np.arange(len(df)), dates, batterCodes))
+        order = order[keep[order]]
+        self.names = np.asarray(names)
+        self.batterCodes = dict((x, num) for num, x in enumerate(self.names))
+        self.batters = batterCodes[order]
+        self.dates = dates[order]
+        codes = codes[order]
+        values = np.where(codes < 2, df['dSwing'].values[order],
+                          df['dTake'].values[order])
+        present = (codes >= 0) & ~np.isnan(values)
+        values = np.where(present, values, 0)
+        # Columns: the four components, the two side totals and NetTotal
+        member = np.zeros((len(codes), len(self.metrics)), dtype=bool)
+        for num in range(4):
+            member[:, num] = codes == num
+        member[:, 4] = (codes == 0) | (codes == 1)
+        member[:, 5] = (codes == 2) | (codes == 3)
+        member[:, 6] = codes >= 0
+        self.sums = self.prefix(member * values[:, None])
+        self.lens = self.prefix(member.astype(int))
+        self.counts = self.prefix((member & present[:, None]).astype(int))
+        bounds = np.searchsorted(self.batters, np.arange(len(self.names) + 1))
+        self.starts, self.ends = bounds[:-1], bounds[1:]
+        # Key sorted the same way as the rows, for league-wide searches.
+        # Days rather than nanoseconds, so batter * span cannot overflow.
+        days = self.dates // DAY
+        self.base = days.min() if len(days) else 0
+        self.span = np.int64(days.max() - self.base + 1 if len(days) else 1)
+        self.keys = self.batters * self.span + (days - self.base)
+
+    def prefix(self, values):
+        """ Cumulative sums with a leading row of zeros
+        """
+        out = np.zeros((len(values) + 1,) + values.shape[1:],
+                       dtype=values.dtype)
+        np.cumsum(values, axis=0, out=out[1:])
+        return out
+
+    def to_day(self, date):
+        return np.int64(pd.Timestamp(date).value) // DAY
+
+    def bounds(self, start=None, end=None, lastPitches=None, batter=None):
+        """ Row bounds [lo, hi) of the window for every batter, or for one
+            batter code. The window covers whole days from start to end.
+        """
+        if batter is None:
+            codes = np.arange(len(self.names))
+        else:
+            codes = np.array([batter])
+        starts, ends = self.starts[codes], self.ends[codes]
+        lo, hi = starts.copy(), ends.copy()
+        if start is not None:
+            offset = max(self.to_day(start) - self.base, 0)
+            offset = min(offset, self.span)
+            lo = np.searchsorted(self.keys, codes * self.span + offset,
+                                 side='left')
+        if end is not None:
+            offset = self.to_day(end) - self.base
+            if offset < 0:
+                hi = starts.copy()
+            else:
+                offset = min(offset, self.span - 1)
+                hi = np.searchsorted(self.keys, codes * self.span + offset,
+                                     side='right')
+        if lastPitches is not None:
+            lo = np.maximum(lo, hi - lastPitches)
+        lo = np.clip(lo, starts, ends)
+        hi = np.clip(hi, lo, ends)
+        return codes, lo, hi
+
+    def frame(self, codes, lo, hi):
+        sums = self.sums[hi] - self.sums[lo]
+        lens = self.lens[hi] - self.lens[lo]
+        counts = self.counts[hi] - self.counts[lo]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            means = np.where(counts > 0, sums / counts, np.nan) * 100
+        index = pd.Index(self.names[codes])
+        df = pd.DataFrame(sums, index=index, columns=self.metrics)
+        for num, metric in enumerate(self.metrics):
+            df[metric + '_count'] = lens[:, num]
+            df[metric + '_mean'] = means[:, num]
+        return df
+
+    def snapshot(self, start=None, end=None, lastPitches=None):
+        """ Sums, counts and means per 100 pitches of every metric for every
+            batter over a window, in one vectorized pass. The window covers
+            games from start to end (inclusive), further limited to each
+            batter's last lastPitches pitches if given.
+        """
+        return self.frame(*self.bounds(start, end, lastPitches))
+
+    def last_days(self, days, end=None, lastPitches=None):
+        """ snapshot of the days up to end, the latest date by default
+        """
+        if end is None:
+            end = pd.Timestamp(int(self.dates.max()))
+        end = pd.Timestamp(end)
+        start = end - pd.Timedelta(days=days - 1)
+        return self.snapshot(start, end, lastPitches)
+
+    def query(self, batter, start=None, end=None, lastPitches=None):
+        """ The window metrics of one batter as a Series
+        """
+        if batter not in self.batterCodes:
+            raise KeyError('No pitches for batter %s' % batter)
+        code = self.batterCodes[batter]
+        return self.frame(*self.bounds(start, end, lastPitches, code)).iloc[0]